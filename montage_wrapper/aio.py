@@ -0,0 +1,85 @@
+"""
+Asynchronous versions of the Montage command wrappers.
+
+Every function in :mod:`montage_wrapper.commands` has a coroutine
+counterpart with the same name and arguments in this module, which runs the
+Montage command with :func:`asyncio.create_subprocess_exec` and returns the
+same :class:`~montage_wrapper.status.Struct` results. This module requires
+Python 3.5 or later.
+"""
+
+import asyncio
+import functools
+import inspect
+import time
+
+from astropy import log
+
+from . import commands
+from . import runner
+
+__all__ = ['execute', 'run']
+
+
+async def execute(command):
+    '''
+    Run a command without blocking the event loop, and wait for it to finish.
+
+    Parameters
+    ----------
+    command : list
+        The command to run, as a list of arguments.
+
+    Returns
+    -------
+    stdout, stderr : bytes
+        The output of the command.
+    returncode : int
+        The exit code of the command.
+    '''
+    p = await asyncio.create_subprocess_exec(*command,
+                                             stdout=asyncio.subprocess.PIPE,
+                                             stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await p.communicate()
+    return stdout, stderr, p.returncode
+
+
+async def run(name, command):
+    '''
+    Run a Montage command without blocking the event loop, and parse its
+    output.
+
+    Parameters
+    ----------
+    name : str
+        The name of the Montage command, used in error messages.
+    command : list
+        The command to run, as a list of arguments.
+
+    Returns
+    -------
+    result : :class:`~montage_wrapper.status.Struct`
+        The status returned by the command.
+    '''
+    start = time.time()
+    stdout, stderr, returncode = await execute(command)
+    log.debug("%s exited with code %i after %.2fs" % (name, returncode,
+                                                      time.time() - start))
+    return runner.check_output(name, stdout, stderr, returncode)
+
+
+def _make_coroutine(function):
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        name, command = runner.build(function, *args, **kwargs)
+        return await run(name, command)
+
+    return wrapper
+
+
+for _name, _function in sorted(vars(commands).items()):
+    if inspect.isfunction(_function) and _name.startswith('m') \
+            and _name[1:2].isupper():
+        globals()[_name] = _make_coroutine(_function)
+        __all__.append(_name)
@@ -0,0 +1,378 @@
+"""
+Background modelling in Python, as an alternative to mFitExec and mBgModel.
+
+mFitExec runs mFitplane as a separate process for each difference image.
+:func:`fit_diffs` instead fits planes to all the difference images from a
+single process, reading the images through memory-mapped arrays and fitting
+them in parallel threads, optionally on a subsample of the pixels.
+
+mBgModel finds the background corrections for a set of overlapping images by
+iterative relaxation, which can require many iterations (and still not
+converge) for large sets of images. :func:`model_background` instead solves
+for the corrections of all images at once, as a single sparse weighted
+linear least-squares problem, either with a sparse direct solver or with
+LSQR.
+
+As in the tables written by mFitExec and read by mBgExec, planes are
+functions of the pixel coordinates relative to the reference pixel of each
+image. Since all the projected images (and the difference images) share the
+same projection, these coordinates are the same for all images, so that the
+difference between the corrections of two overlapping images should match
+the plane fitted to their difference image.
+
+For each difference image, the difference between the corrections of the two
+images is required to match the fitted plane at the center of the overlap,
+and (unless only levels are fitted) to have the same slopes, scaled by the
+half-size of the overlap so that all the equations are in units of pixel
+values. The equations are weighted by the square root of the number of
+pixels in the overlap. Since the differences only constrain the corrections
+up to a plane common to all the images in each connected group of
+overlapping images, the corrections are shifted to have a mean of zero
+within each group.
+"""
+
+import os
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+from astropy.io import fits
+from astropy.table import Table
+
+from . import status
+
+__all__ = ['fit_diffs', 'model_background']
+
+# Columns of the tables written by mFitExec
+FITS_COLUMNS = ['plus', 'minus', 'a', 'b', 'c', 'crpix1', 'crpix2', 'xmin',
+                'xmax', 'ymin', 'ymax', 'xcenter', 'ycenter', 'npixel', 'rms',
+                'boxx', 'boxy', 'boxwidth', 'boxheight', 'boxang']
+
+
+def _fit_plane(filename, border=0, subsample=1, chunk_rows=1024):
+    '''
+    Fit a plane to a difference image, as a function of the pixel coordinates
+    relative to the reference pixel, and return the values for a row of the
+    fits table (without the plus and minus columns), or `None` if there are
+    too few valid pixels to fit a plane.
+    '''
+
+    with fits.open(filename, memmap=True) as hdulist:
+
+        data = hdulist[0].data
+        crpix1 = hdulist[0].header['CRPIX1']
+        crpix2 = hdulist[0].header['CRPIX2']
+        ny, nx = data.shape
+
+        # The plane is fitted relative to the center of the image, which
+        # keeps the normal equations well conditioned
+        x_ref = 0.5 * (nx + 1) - crpix1
+        y_ref = 0.5 * (ny + 1) - crpix2
+
+        rows = numpy.arange(border, ny - border, subsample)
+        cols = numpy.arange(border, nx - border, subsample)
+        x = cols + 1 - crpix1 - x_ref
+
+        sums = numpy.zeros((3, 4))
+        xmin = ymin = numpy.inf
+        xmax = ymax = -numpy.inf
+
+        chunks = []
+        for start in range(0, len(rows), chunk_rows):
+
+            chunk_y = rows[start:start + chunk_rows]
+            if len(chunk_y) == 0 or len(cols) == 0:
+                continue
+            values = numpy.array(data[chunk_y[0]:chunk_y[-1] + 1:subsample,
+                                      cols[0]:cols[-1] + 1:subsample], dtype=float)
+            valid = ~numpy.isnan(values)
+            if not numpy.any(valid):
+                continue
+
+            j, i = numpy.nonzero(valid)
+            px = x[i]
+            py = chunk_y[j] + 1 - crpix2 - y_ref
+            z = values[valid]
+
+            design = numpy.array([px, py, numpy.ones_like(px)])
+            sums[:, :3] += design.dot(design.T)
+            sums[:, 3] += design.dot(z)
+
+            xmin, xmax = min(xmin, px.min()), max(xmax, px.max())
+            ymin, ymax = min(ymin, py.min()), max(ymax, py.max())
+
+            chunks.append((design, z))
+
+        npixel = int(round(sums[2, 2]))
+        if npixel < 3:
+            return None
+
+        solution, _, rank, _ = numpy.linalg.lstsq(sums[:, :3], sums[:, 3], rcond=None)
+        if rank < 3:
+            return None
+
+        residuals = 0.
+        for design, z in chunks:
+            residuals += numpy.sum((z - solution.dot(design)) ** 2)
+
+        del data
+
+    a, b, c = solution
+    c -= a * x_ref + b * y_ref
+    xmin, xmax, xcenter = xmin + x_ref, xmax + x_ref, 0.5 * (xmin + xmax) + x_ref
+    ymin, ymax, ycenter = ymin + y_ref, ymax + y_ref, 0.5 * (ymin + ymax) + y_ref
+
+    return [a, b, c, crpix1, crpix2, xmin, xmax, ymin, ymax, xcenter, ycenter,
+            npixel * subsample ** 2, numpy.sqrt(residuals / npixel),
+            xcenter, ycenter, xmax - xmin, ymax - ymin, 0.]
+
+
+def fit_diffs(diffs_table, fits_table, diff_dir, border=0, subsample=1,
+              n_workers=None):
+    '''
+    Fit planes to all the difference images generated by mDiffExec.
+
+    This produces the same table of image-to-image difference parameters as
+    mFitExec, but the planes are fitted by linear least-squares in threads of
+    the current process rather than by running mFitplane on each image.
+
+    Parameters
+    ----------
+    diffs_table : str
+        Overlap table generated by mOverlaps, the last column of which
+        contains the filenames of the difference images generated by
+        mDiffExec.
+    fits_table : str
+        Output table of difference parameters.
+    diff_dir : str
+        Directory containing difference images.
+    border : int, optional
+        Number of border pixels to ignore at edges of each image.
+    subsample : int, optional
+        Only use one pixel out of `subsample` in each direction to fit the
+        planes. The number of pixels in the output table is then an estimate
+        of the number of pixels in the full image.
+    n_workers : int, optional
+        The number of threads to use to fit the images
+
+    Returns
+    -------
+    status : :class:`~montage_wrapper.status.Struct`
+        The status, with the number of images fitted (``count``) and the
+        number of images for which the fit failed (``failed``)
+    '''
+
+    if subsample < 1:
+        raise ValueError("subsample should be at least 1")
+
+    diffs = Table.read(diffs_table, format='ascii.ipac')
+    filenames = [os.path.join(diff_dir, str(fname).strip())
+                 for fname in diffs[diffs.colnames[-1]]]
+
+    def fit(filename):
+        if not os.path.exists(filename):
+            return None
+        return _fit_plane(filename, border=border, subsample=subsample)
+
+    if n_workers and n_workers > 1:
+        pool = ThreadPool(n_workers)
+        try:
+            results = pool.map(fit, filenames)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [fit(filename) for filename in filenames]
+
+    rows = [[int(plus), int(minus)] + result
+            for plus, minus, result in zip(diffs['cntr1'], diffs['cntr2'], results)
+            if result is not None]
+
+    table = Table(rows=rows if rows else None, names=FITS_COLUMNS,
+                  dtype=[int, int] + [float] * 11 + [int] + [float] * 6)
+
+    with open(fits_table, 'w') as f:
+        table.write(f, format='ascii.ipac')
+
+    return status.make_struct("mFitExec", {'stat': 'OK', 'count': len(rows),
+                                           'failed': len(filenames) - len(rows),
+                                           'warning': 0})
+
+
+def _read_fits(fits_table, ids):
+    '''
+    Read the valid plane fits from a table written by mFitExec, and return
+    the indices of the plus and minus images, the fitted coefficients, the
+    center of the overlaps, their half-sizes, and the number of pixels.
+    '''
+
+    table = Table.read(fits_table, format='ascii.ipac')
+
+    index = dict((image_id, i) for i, image_id in enumerate(ids))
+
+    keep = numpy.array([int(plus) in index and int(minus) in index
+                        for plus, minus in zip(table['plus'], table['minus'])],
+                       dtype=bool)
+    for column in ['a', 'b', 'c', 'xmin', 'xmax', 'ymin', 'ymax', 'npixel']:
+        keep &= numpy.isfinite(numpy.asarray(table[column], dtype=float))
+    keep &= numpy.asarray(table['npixel'], dtype=float) > 0
+
+    table = table[keep]
+
+    plus = numpy.array([index[int(i)] for i in table['plus']], dtype=int)
+    minus = numpy.array([index[int(i)] for i in table['minus']], dtype=int)
+
+    def column(name):
+        return numpy.asarray(table[name], dtype=float)
+
+    xcenter = 0.5 * (column('xmin') + column('xmax'))
+    ycenter = 0.5 * (column('ymin') + column('ymax'))
+    xsize = numpy.maximum(0.5 * (column('xmax') - column('xmin')), 1.)
+    ysize = numpy.maximum(0.5 * (column('ymax') - column('ymin')), 1.)
+
+    return (plus, minus, column('a'), column('b'), column('c'),
+            xcenter, ycenter, xsize, ysize, column('npixel'))
+
+
+def model_background(images_table, fits_table, corrections_table,
+                     level_only=False, method='direct', atol=1e-10, btol=1e-10,
+                     iter_lim=None):
+    '''
+    Compute background corrections from plane fits to difference images.
+
+    This requires scipy to be installed.
+
+    Parameters
+    ----------
+    images_table : str
+        Table of the projected images (generated by mImgtbl)
+    fits_table : str
+        Table of plane fits to the difference images (generated by
+        mFitExec or mDiffFitExec)
+    corrections_table : str
+        Output table of background corrections, in the same format as
+        written by mBgModel
+    level_only : bool, optional
+        Calculate level adjustments only (ie, don't attempt to match the
+        slopes as well).
+    method : str, optional
+        How to solve the least-squares problem: ``'direct'`` to solve the
+        normal equations with a sparse LU decomposition, which is the
+        fastest, or ``'lsqr'`` to use LSQR, which needs less memory for very
+        large problems.
+    atol, btol : float, optional
+        Stopping tolerances for LSQR
+    iter_lim : int, optional
+        Maximum number of LSQR iterations
+
+    Returns
+    -------
+    status : :class:`~montage_wrapper.status.Struct`
+        The status, with the number of images and of fits used (and the
+        number of LSQR iterations if ``method='lsqr'``)
+    '''
+
+    if method not in ['direct', 'lsqr']:
+        raise ValueError("method should be one of direct/lsqr")
+
+    try:
+        from scipy import sparse
+        from scipy.sparse.csgraph import connected_components
+        from scipy.sparse.linalg import lsqr, spsolve
+    except ImportError:
+        raise ImportError("scipy is required to model the background")
+
+    images = Table.read(images_table, format='ascii.ipac')
+    ids = [int(cntr) for cntr in images['cntr']]
+    n_images = len(ids)
+
+    plus, minus, a, b, c, xcenter, ycenter, xsize, ysize, npixel = _read_fits(fits_table, ids)
+    n_fits = len(plus)
+
+    # Parameters for each image are (C, A, B), or only C for levels. To keep
+    # the problem well conditioned, the level C of each image is solved for
+    # at the mean center of its overlaps rather than at the reference pixel.
+    n_par = 1 if level_only else 3
+    both = numpy.concatenate([plus, minus])
+    n_overlaps = numpy.maximum(numpy.bincount(both, minlength=n_images), 1)
+    x0 = numpy.bincount(both, weights=numpy.concatenate([xcenter, xcenter]),
+                        minlength=n_images) / n_overlaps
+    y0 = numpy.bincount(both, weights=numpy.concatenate([ycenter, ycenter]),
+                        minlength=n_images) / n_overlaps
+
+    w = numpy.sqrt(npixel)
+    k = numpy.arange(n_fits)
+    ones = numpy.ones(n_fits)
+    difference = a * xcenter + b * ycenter + c
+
+    # Difference of the corrections at the center of the overlaps
+    rows = [k, k]
+    cols = [plus * n_par, minus * n_par]
+    values = [w, -w]
+    rhs = [w * difference]
+
+    if not level_only:
+        # Slopes of the difference of the corrections
+        rows += [k, k, k, k]
+        cols += [plus * 3 + 1, plus * 3 + 2, minus * 3 + 1, minus * 3 + 2]
+        values += [w * (xcenter - x0[plus]), w * (ycenter - y0[plus]),
+                   -w * (xcenter - x0[minus]), -w * (ycenter - y0[minus])]
+        rows += [n_fits + k, n_fits + k, 2 * n_fits + k, 2 * n_fits + k]
+        cols += [plus * 3 + 1, minus * 3 + 1, plus * 3 + 2, minus * 3 + 2]
+        values += [w * xsize, -w * xsize, w * ysize, -w * ysize]
+        rhs += [w * xsize * a, w * ysize * b]
+
+    matrix = sparse.csr_matrix((numpy.concatenate(values),
+                                (numpy.concatenate(rows), numpy.concatenate(cols))),
+                               shape=(n_fits * n_par, n_images * n_par))
+    rhs = numpy.concatenate(rhs)
+
+    # The corrections of the first image in each group of overlapping images
+    # are fixed to zero, which removes the degeneracy, and the corrections
+    # are then shifted to have a mean of zero in each group.
+    graph = sparse.coo_matrix((ones, (plus, minus)), shape=(n_images, n_images))
+    n_groups, groups = connected_components(graph, directed=False)
+    reference = numpy.zeros(n_images, dtype=bool)
+    reference[numpy.unique(groups, return_index=True)[1]] = True
+    free = numpy.repeat(~reference, n_par)
+
+    matrix = matrix.tocsc()[:, free]
+    solution = numpy.zeros(n_images * n_par)
+    values = {'stat': 'OK', 'count': n_images, 'nfits': n_fits}
+
+    if numpy.any(free):
+        if method == 'direct':
+            solution[free] = spsolve(matrix.T.dot(matrix).tocsc(), matrix.T.dot(rhs))
+        else:
+            # Scale the columns to unit norm, which helps LSQR converge
+            norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+            norms[norms == 0] = 1.
+            result = lsqr(matrix.dot(sparse.diags(1. / norms)), rhs,
+                          atol=atol, btol=btol, iter_lim=iter_lim)
+            solution[free] = result[0] / norms
+            values['iterations'] = int(result[2])
+
+    solution = solution.reshape(n_images, n_par)
+
+    # Planes as a function of the coordinates relative to the reference pixel
+    if level_only:
+        planes = numpy.zeros((n_images, 3))
+        planes[:, 2] = solution[:, 0]
+    else:
+        planes = numpy.array([solution[:, 1], solution[:, 2],
+                              solution[:, 0] - solution[:, 1] * x0 - solution[:, 2] * y0]).T
+
+    for group in range(n_groups):
+        members = groups == group
+        planes[members] -= planes[members].mean(axis=0)
+
+    corrections = Table()
+    corrections['id'] = ids
+    corrections['a'] = planes[:, 0]
+    corrections['b'] = planes[:, 1]
+    corrections['c'] = planes[:, 2]
+
+    with open(corrections_table, 'w') as f:
+        corrections.write(f, format='ascii.ipac')
+
+    return status.make_struct("model_background", values)
@@ -0,0 +1,168 @@
+"""
+A persistent cache of projected images, shared between calls to
+:func:`~montage_wrapper.wrappers.mosaic`.
+
+Projected images (and their area maps) are stored under a key computed from
+the input file, the header template, the HDU and whether the output should
+exactly match the template, so that re-projecting the same frames onto the
+same header can be skipped. Cached files are hard-linked (or copied, if the
+cache is on a different filesystem) into the projection directory, and the
+least recently used entries are removed when the cache grows beyond a given
+size.
+"""
+
+import os
+import hashlib
+import shutil
+import threading
+
+from . import fits_utils
+
+__all__ = ['ProjectionCache']
+
+
+def _area(filename):
+    return filename[:-5] + '_area.fits'
+
+
+def _link(source, destination):
+    '''
+    Hard-link a file, or copy it if this is not possible.
+    '''
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except (OSError, AttributeError):
+        shutil.copy2(source, destination)
+
+
+class ProjectionCache(object):
+    '''
+    A cache of projected images.
+
+    Parameters
+    ----------
+    directory : str
+        The directory containing the cache (created if it does not exist).
+    max_size : int, optional
+        Maximum size of the cache, in bytes. If set, the least recently used
+        images are removed whenever new images are added to the cache and it
+        exceeds this size.
+    hash_inputs : bool, optional
+        Whether to identify input files by a hash of their contents. By
+        default, the path, size and modification time of the files are used
+        instead, which is much faster.
+    '''
+
+    def __init__(self, directory, max_size=None, hash_inputs=False):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.hash_inputs = hash_inputs
+        self._lock = threading.Lock()
+        self._header_fingerprints = {}
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.fits')
+
+    def _header_fingerprint(self, template_header):
+        stat = os.stat(template_header)
+        cache_key = (os.path.abspath(template_header), stat.st_size, stat.st_mtime)
+        if cache_key not in self._header_fingerprints:
+            header = fits_utils.read_header_file(template_header)
+            self._header_fingerprints[cache_key] = fits_utils.header_fingerprint(header)
+        return self._header_fingerprints[cache_key]
+
+    def key(self, in_image, template_header, hdu=None, exact=False):
+        '''
+        Return the cache key for an input image projected onto a header
+        template (given as a file).
+        '''
+        if self.hash_inputs:
+            md5 = hashlib.md5()
+            with open(in_image, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    md5.update(block)
+            image_id = md5.hexdigest()
+        else:
+            stat = os.stat(in_image)
+            image_id = (os.path.realpath(in_image), stat.st_size, stat.st_mtime)
+        key = repr((image_id, self._header_fingerprint(template_header),
+                    hdu or 0, bool(exact)))
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def fetch(self, key, out_image):
+        '''
+        Link the cached image (and area map) for ``key`` to ``out_image``.
+        Returns `False` if the image is not in the cache.
+        '''
+        path = self._path(key)
+        with self._lock:
+            if not (os.path.exists(path) and os.path.exists(_area(path))):
+                return False
+            # Mark the entry as recently used
+            os.utime(path, None)
+            _link(path, out_image)
+            _link(_area(path), _area(out_image))
+        return True
+
+    def store(self, key, out_image):
+        '''
+        Add a projected image (and its area map) to the cache.
+        '''
+        path = self._path(key)
+        with self._lock:
+            if not os.path.exists(os.path.dirname(path)):
+                os.mkdir(os.path.dirname(path))
+            # Link the area map first, since entries are only considered to
+            # be valid once the image itself is present
+            _link(_area(out_image), _area(path) + '.tmp')
+            os.rename(_area(path) + '.tmp', _area(path))
+            _link(out_image, path + '.tmp')
+            os.rename(path + '.tmp', path)
+        if self.max_size is not None:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for subdir in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for filename in os.listdir(subdir):
+                if filename.endswith('.fits') and not filename.endswith('_area.fits'):
+                    path = os.path.join(subdir, filename)
+                    try:
+                        size = os.path.getsize(path)
+                        if os.path.exists(_area(path)):
+                            size += os.path.getsize(_area(path))
+                        entries.append((os.path.getmtime(path), size, path))
+                    except OSError:
+                        pass
+        return entries
+
+    def size(self):
+        '''
+        Return the total size of the cached images, in bytes.
+        '''
+        return sum(size for mtime, size, path in self._entries())
+
+    def evict(self, max_size=None):
+        '''
+        Remove the least recently used images until the cache is smaller than
+        ``max_size`` (by default the maximum size of the cache).
+        '''
+        if max_size is None:
+            max_size = self.max_size
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for mtime, size, path in entries)
+            for mtime, size, path in entries:
+                if total <= max_size:
+                    break
+                for filename in (path, _area(path)):
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                total -= size
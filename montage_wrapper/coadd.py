@@ -0,0 +1,242 @@
+"""
+Combination of projected images in Python, with background corrections
+applied on the fly.
+
+When matching backgrounds, mBgExec writes a corrected copy of every
+projected image, only for mAdd to read these copies back. The
+:func:`add_frames` function instead reads the projected images directly and
+subtracts the planes from the corrections table (as written by mBgModel)
+while combining them, so that the corrected images are never written.
+
+As for mAdd, all the images should have been projected onto the same
+projection as the header template, which means that each image only covers
+a rectangular region of the output image. The output image is built a chunk
+of rows at a time, and the chunks are combined in parallel threads.
+"""
+
+import os
+import warnings
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+from astropy.io import fits
+from astropy.table import Table
+
+from . import fits_utils
+from . import status
+
+__all__ = ['read_corrections', 'add_frames']
+
+
+def _pixel_boxes(table, header):
+    '''
+    Return the pixel ranges (x0, x1, y0, y1, zero-based and exclusive at the
+    end) covered in an image with the given header by each of the images in
+    a table of images projected onto the same header.
+    '''
+    x0 = numpy.round(header['CRPIX1'] - numpy.asarray(table['crpix1'], dtype=float)).astype(int)
+    y0 = numpy.round(header['CRPIX2'] - numpy.asarray(table['crpix2'], dtype=float)).astype(int)
+    x1 = x0 + numpy.asarray(table['naxis1'], dtype=int)
+    y1 = y0 + numpy.asarray(table['naxis2'], dtype=int)
+    return x0, x1, y0, y1
+
+
+def read_corrections(corrections_table):
+    '''
+    Read a table of background corrections written by mBgModel.
+
+    Returns
+    -------
+    corrections : dict
+        The ``(a, b, c)`` coefficients of the plane to subtract from each
+        image, indexed by the ``cntr`` value of the image in the image table.
+    '''
+    table = Table.read(corrections_table, format='ascii.ipac')
+    return dict((int(row['id']), (float(row['a']), float(row['b']), float(row['c'])))
+                for row in table)
+
+
+def _background(correction, crpix1, crpix2, rows, ncols):
+    '''
+    Evaluate a background plane for some rows of an image. As for
+    mBackground, the plane is a function of the pixel coordinates relative to
+    the reference pixel of the image.
+    '''
+    a, b, c = correction
+    x = numpy.arange(1, ncols + 1) - crpix1
+    y = numpy.arange(rows[0] + 1, rows[1] + 1) - crpix2
+    return a * x[numpy.newaxis, :] + b * y[:, numpy.newaxis] + c
+
+
+def add_frames(images_table, template_header, out_image, img_dir=None,
+               corrections_table=None, combine='mean', exact=False,
+               bitpix=-64, chunk_rows=256, n_workers=None):
+    '''
+    Combine projected images, optionally subtracting background corrections.
+
+    The results are the same as running mBgExec and then mAdd on the
+    corrected images, except that the output image can directly be written
+    with a floating-point BITPIX.
+
+    Parameters
+    ----------
+    images_table : str
+        The table of projected images (generated by mImgtbl)
+    template_header : str
+        The header template used to project the images
+    out_image : str
+        The output image. The area map is written to the same file name,
+        with ``_area`` appended.
+    img_dir : str, optional
+        The directory containing the projected images
+    corrections_table : str, optional
+        The table of background corrections generated by mBgModel. Images
+        without a correction are combined as they are.
+    combine : str, optional
+        How to combine the images - this should be one of ``'mean'``,
+        ``'median'``, or ``'count'``.
+    exact : bool, optional
+        Whether the output image should match the header template exactly,
+        rather than be trimmed to the region covered by the images.
+    bitpix : int, optional
+        The BITPIX value of the output images, which should be negative.
+    chunk_rows : int, optional
+        The number of output rows to combine at a time
+    n_workers : int, optional
+        The number of threads to use to combine chunks of rows
+
+    Returns
+    -------
+    status : :class:`~montage_wrapper.status.Struct`
+        The status, with the number of images that were combined
+    '''
+
+    if not combine in ['mean', 'median', 'count']:
+        raise Exception("combine should be one of mean/median/count")
+
+    if bitpix > 0:
+        raise ValueError("bitpix should be negative")
+
+    table = Table.read(images_table, format='ascii.ipac')
+    header = fits_utils.read_header_file(template_header)
+
+    if corrections_table is None:
+        corrections = {}
+    else:
+        corrections = read_corrections(corrections_table)
+
+    x0, x1, y0, y1 = _pixel_boxes(table, header)
+
+    # Trim the output image to the region covered by the images
+    ny, nx = header['NAXIS2'], header['NAXIS1']
+    if exact or len(table) == 0:
+        xmin, xmax, ymin, ymax = 0, nx, 0, ny
+    else:
+        xmin, xmax = max(x0.min(), 0), min(x1.max(), nx)
+        ymin, ymax = max(y0.min(), 0), min(y1.max(), ny)
+        if xmax <= xmin or ymax <= ymin:
+            raise status.MontageError("add_frames: no images overlap with the header")
+        header = header.copy()
+        header['NAXIS1'], header['NAXIS2'] = int(xmax - xmin), int(ymax - ymin)
+        header['CRPIX1'] -= xmin
+        header['CRPIX2'] -= ymin
+        x0, x1, y0, y1 = x0 - xmin, x1 - xmin, y0 - ymin, y1 - ymin
+        nx, ny = xmax - xmin, ymax - ymin
+
+    filenames = [str(fname).strip() for fname in table['fname']]
+    if img_dir is not None:
+        filenames = [os.path.join(img_dir, fname) for fname in filenames]
+
+    ids = [int(cntr) for cntr in table['cntr']]
+
+    out = fits_utils.create_image(out_image, header, (ny, nx), bitpix=bitpix)
+    out_area = fits_utils.create_image(out_image[:-5] + '_area.fits', header,
+                                       (ny, nx), bitpix=bitpix)
+
+    def add_chunk(start):
+
+        end = min(start + chunk_rows, ny)
+
+        total = numpy.zeros((end - start, nx))
+        weight = numpy.zeros((end - start, nx))
+        if combine != 'mean':
+            count = numpy.zeros((end - start, nx))
+        if combine == 'median':
+            stack = []
+
+        for i in numpy.nonzero((y0 < end) & (y1 > start) & (x0 < nx) & (x1 > 0))[0]:
+
+            # Rows and columns of the image (rows_in, cols_in) that fall in
+            # this chunk of the output image
+            rows_in = (max(start - y0[i], 0), min(end - y0[i], y1[i] - y0[i]))
+            cols_in = (max(-x0[i], 0), min(nx - x0[i], x1[i] - x0[i]))
+            rows = slice(rows_in[0] + y0[i] - start, rows_in[1] + y0[i] - start)
+            cols = slice(cols_in[0] + x0[i], cols_in[1] + x0[i])
+
+            filename = filenames[i]
+            with fits.open(filename, memmap=True) as hdulist:
+                data = numpy.array(hdulist[0].data[rows_in[0]:rows_in[1],
+                                                   cols_in[0]:cols_in[1]], dtype=float)
+                crpix1 = hdulist[0].header['CRPIX1']
+                crpix2 = hdulist[0].header['CRPIX2']
+            with fits.open(filename[:-5] + '_area.fits', memmap=True) as hdulist:
+                area = numpy.array(hdulist[0].data[rows_in[0]:rows_in[1],
+                                                   cols_in[0]:cols_in[1]], dtype=float)
+
+            if ids[i] in corrections:
+                # The background is evaluated over the full width of the
+                # image, then restricted to the columns in use
+                background = _background(corrections[ids[i]], crpix1, crpix2,
+                                         rows_in, int(x1[i] - x0[i]))
+                data -= background[:, cols_in[0]:cols_in[1]]
+
+            valid = ~numpy.isnan(data) & (area > 0)
+            data[~valid] = 0.
+            area[~valid] = 0.
+
+            total[rows, cols] += data * area
+            weight[rows, cols] += area
+            if combine != 'mean':
+                count[rows, cols] += valid
+            if combine == 'median':
+                values = numpy.nan * numpy.zeros((end - start, nx))
+                values[rows, cols] = numpy.where(valid, data, numpy.nan)
+                stack.append(values)
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            if combine == 'mean':
+                image = total / weight
+            elif combine == 'median':
+                if stack:
+                    with warnings.catch_warnings():
+                        # Pixels not covered by any image are all NaN
+                        warnings.simplefilter('ignore', RuntimeWarning)
+                        image = numpy.nanmedian(stack, axis=0)
+                else:
+                    image = numpy.nan * weight
+            else:
+                image = count
+            image[weight == 0] = numpy.nan
+
+        out[start:end] = fits_utils.to_bitpix(image, bitpix)
+        out_area[start:end] = fits_utils.to_bitpix(weight, bitpix)
+
+    starts = range(0, ny, chunk_rows)
+
+    if n_workers and n_workers > 1:
+        pool = ThreadPool(n_workers)
+        try:
+            pool.map(add_chunk, starts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for start in starts:
+            add_chunk(start)
+
+    out.flush()
+    out_area.flush()
+    del out, out_area
+
+    return status.make_struct("add_frames", {'stat': 'OK', 'count': len(table)})
@@ -1,7 +1,4 @@
-import subprocess
-import shlex
-
-from . import status
+from . import runner
 from .commands_extra import *
 from .mpi import _get_mpi_command
 
@@ -67,28 +64,23 @@ def mAdd(images_table, template_header, out_image, img_dir=None,
     if mpi:
         command = _get_mpi_command(executable="mAddMPI", n_proc=n_proc)
     else:
-        command = "mAdd"
+        command = ["mAdd"]
     if img_dir:
-        command += " -p %s" % str(img_dir)
+        command += ["-p", str(img_dir)]
     if no_area:
-        command += " -n"
+        command += ["-n"]
     if type:
-        command += " -a %s" % str(type)
+        command += ["-a", str(type)]
     if exact:
-        command += " -e"
+        command += ["-e"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(images_table)
-    command += " " + str(template_header)
-    command += " " + str(out_image)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mAdd", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(images_table)]
+    command += [str(template_header)]
+    command += [str(out_image)]
+    return runner.run("mAdd", command)
 
 
 def mAddExec(images_table, template_header, tile_dir, out_image, img_dir=None,
@@ -150,29 +142,24 @@ def mAddExec(images_table, template_header, tile_dir, out_image, img_dir=None,
     if mpi:
         command = _get_mpi_command(executable="mAddExecMPI", n_proc=n_proc)
     else:
-        command = "mAddExec"
+        command = ["mAddExec"]
     if img_dir:
-        command += " -p %s" % str(img_dir)
+        command += ["-p", str(img_dir)]
     if no_area:
-        command += " -n"
+        command += ["-n"]
     if type:
-        command += " -a %s" % str(type)
+        command += ["-a", str(type)]
     if exact:
-        command += " -e"
+        command += ["-e"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(images_table)
-    command += " " + str(template_header)
-    command += " " + str(tile_dir)
-    command += " " + str(out_image)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mAddExec", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(images_table)]
+    command += [str(template_header)]
+    command += [str(tile_dir)]
+    command += [str(out_image)]
+    return runner.run("mAddExec", command)
 
 
 def mArchiveExec(region_table, debug_level=None):
@@ -191,16 +178,11 @@ def mArchiveExec(region_table, debug_level=None):
         Prints out additional debugging information; in this version, the only
         supported level is 1.
     '''
-    command = "mArchiveExec"
+    command = ["mArchiveExec"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
-    command += " " + str(region_table)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mArchiveExec", p.stdout.read().strip())
+        command += ["-d", str(debug_level)]
+    command += [str(region_table)]
+    return runner.run("mArchiveExec", command)
 
 
 def mArchiveGet(remote_ref, local_file, debug=False, raw=False):
@@ -225,19 +207,14 @@ def mArchiveGet(remote_ref, local_file, debug=False, raw=False):
         "Raw" mode - use a raw HTTP GET (no "HTTP/1.1" etc in the header);
         necessary for communication with some servers.
     '''
-    command = "mArchiveGet"
+    command = ["mArchiveGet"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if raw:
-        command += " -r"
-    command += ' "' + str(remote_ref) + '"'
-    command += " " + str(local_file)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mArchiveGet", p.stdout.read().strip())
+        command += ["-r"]
+    command += [str(remote_ref)]
+    command += [str(local_file)]
+    return runner.run("mArchiveGet", command)
 
 
 def mArchiveList(survey, band, object_or_location, width, height, out_file):
@@ -269,19 +246,14 @@ def mArchiveList(survey, band, object_or_location, width, height, out_file):
     out_file : str
         Path to output table
     '''
-    command = "mArchiveList"
-    command += " " + str(survey)
-    command += " " + str(band)
-    command += ' "' + str(object_or_location) + '"'
-    command += " " + str(width)
-    command += " " + str(height)
-    command += " " + str(out_file)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mArchiveList", p.stdout.read().strip())
+    command = ["mArchiveList"]
+    command += [str(survey)]
+    command += [str(band)]
+    command += [str(object_or_location)]
+    command += [str(width)]
+    command += [str(height)]
+    command += [str(out_file)]
+    return runner.run("mArchiveList", command)
 
 
 def mBackground(in_image, out_image, A, B, C, debug_level=None, no_area=False,
@@ -316,24 +288,19 @@ def mBackground(in_image, out_image, A, B, C, debug_level=None, no_area=False,
         mBackground output and errors will be written to status_file instead
         of stdout.
     '''
-    command = "mBackground"
+    command = ["mBackground"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if no_area:
-        command += " -n"
+        command += ["-n"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_image)
-    command += " " + str(out_image)
-    command += " " + str(A)
-    command += " " + str(B)
-    command += " " + str(C)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mBackground", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(in_image)]
+    command += [str(out_image)]
+    command += [str(A)]
+    command += [str(B)]
+    command += [str(C)]
+    return runner.run("mBackground", command)
 
 
 def mBackground_tab(in_image, out_image, images_table, corrections_table,
@@ -372,23 +339,18 @@ def mBackground_tab(in_image, out_image, images_table, corrections_table,
         mBackground_tab output and errors will be written to status_file
         instead of stdout.
     '''
-    command = "mBackground_tab"
+    command = ["mBackground_tab"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if no_area:
-        command += " -n"
+        command += ["-n"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_image)
-    command += " " + str(out_image)
-    command += " " + str(images_table)
-    command += " " + str(corrections_table)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mBackground_tab", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(in_image)]
+    command += [str(out_image)]
+    command += [str(images_table)]
+    command += [str(corrections_table)]
+    return runner.run("mBackground_tab", command)
 
 
 def mBestImage(images_table, ra, dec, debug=False):
@@ -412,18 +374,13 @@ def mBestImage(images_table, ra, dec, debug=False):
     debug_level : int, optional
         Turn on debugging to the specified level (1 or 2)
     '''
-    command = "mBestImage"
+    command = ["mBestImage"]
     if debug:
-        command += " -d"
-    command += " " + str(images_table)
-    command += " " + str(ra)
-    command += " " + str(dec)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mBestImage", p.stdout.read().strip())
+        command += ["-d"]
+    command += [str(images_table)]
+    command += [str(ra)]
+    command += [str(dec)]
+    return runner.run("mBestImage", command)
 
 
 def mBgExec(images_table, corrections_table, corr_dir, proj_dir=None,
@@ -468,24 +425,19 @@ def mBgExec(images_table, corrections_table, corr_dir, proj_dir=None,
     if mpi:
         command = _get_mpi_command(executable="mBgExecMPI", n_proc=n_proc)
     else:
-        command = "mBgExec"
+        command = ["mBgExec"]
     if proj_dir:
-        command += " -p %s" % str(proj_dir)
+        command += ["-p", str(proj_dir)]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if no_area:
-        command += " -n"
-    command += " " + str(images_table)
-    command += " " + str(corrections_table)
-    command += " " + str(corr_dir)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mBgExec", p.stdout.read().strip())
+        command += ["-n"]
+    command += [str(images_table)]
+    command += [str(corrections_table)]
+    command += [str(corr_dir)]
+    return runner.run("mBgExec", command)
 
 
 def mBgModel(images_table, fits_table, corrections_table, n_iter=None,
@@ -526,26 +478,21 @@ def mBgModel(images_table, fits_table, corrections_table, n_iter=None,
         mBgModel output and errors are written to status_file instead of to
         stdout.
     '''
-    command = "mBgModel"
+    command = ["mBgModel"]
     if n_iter:
-        command += " -i %s" % str(n_iter)
+        command += ["-i", str(n_iter)]
     if level_only:
-        command += " -l"
+        command += ["-l"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if ref_img:
-        command += " -r %s" % str(ref_img)
+        command += ["-r", str(ref_img)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(images_table)
-    command += " " + str(fits_table)
-    command += " " + str(corrections_table)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mBgModel", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(images_table)]
+    command += [str(fits_table)]
+    command += [str(corrections_table)]
+    return runner.run("mBgModel", command)
 
 
 def mCatMap(in_table, out_image, template_header, column=None, ref_mag=None,
@@ -583,24 +530,19 @@ def mCatMap(in_table, out_image, template_header, column=None, ref_mag=None,
         Set a spread size for point sources (default is to use no spread).
         Allowed values are 3 or 5.
     '''
-    command = "mCatMap"
+    command = ["mCatMap"]
     if column:
-        command += " -c %s" % str(column)
+        command += ["-c", str(column)]
     if ref_mag:
-        command += " -m %s" % str(ref_mag)
+        command += ["-m", str(ref_mag)]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if size:
-        command += " -w %s" % str(size)
-    command += " " + str(in_table)
-    command += " " + str(out_image)
-    command += " " + str(template_header)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mCatMap", p.stdout.read().strip())
+        command += ["-w", str(size)]
+    command += [str(in_table)]
+    command += [str(out_image)]
+    command += [str(template_header)]
+    return runner.run("mCatMap", command)
 
 
 def mConvert(in_image, out_image, debug_level=None, status_file=None,
@@ -651,27 +593,22 @@ def mConvert(in_image, out_image, debug_level=None, status_file=None,
         image to represent blank pixels (NaN) from the input image. Default
         value is min_val.
     '''
-    command = "mConvert"
+    command = ["mConvert"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if bitpix:
-        command += " -b %s" % str(bitpix)
+        command += ["-b", str(bitpix)]
     if min_val:
-        command += " -min %s" % str(min_val)
+        command += ["-min", str(min_val)]
     if max_val:
-        command += " -max %s" % str(max_val)
+        command += ["-max", str(max_val)]
     if blank_value:
-        command += " -blank %s" % str(blank_value)
-    command += " " + str(in_image)
-    command += " " + str(out_image)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mConvert", p.stdout.read().strip())
+        command += ["-blank", str(blank_value)]
+    command += [str(in_image)]
+    command += [str(out_image)]
+    return runner.run("mConvert", command)
 
 
 def mDiff(in_image_1, in_image_2, out_image, template_header,
@@ -712,23 +649,18 @@ def mDiff(in_image_1, in_image_2, out_image, template_header,
     status_file : str, optional
         Output and errors are sent to status_file instead of to stdout
     '''
-    command = "mDiff"
+    command = ["mDiff"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if no_area:
-        command += " -n"
+        command += ["-n"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_image_1)
-    command += " " + str(in_image_2)
-    command += " " + str(out_image)
-    command += " " + str(template_header)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mDiff", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(in_image_1)]
+    command += [str(in_image_2)]
+    command += [str(out_image)]
+    command += [str(template_header)]
+    return runner.run("mDiff", command)
 
 
 def mDiffExec(diffs_table, template_header, diff_dir, proj_dir=None,
@@ -772,67 +704,96 @@ def mDiffExec(diffs_table, template_header, diff_dir, proj_dir=None,
     if mpi:
         command = _get_mpi_command(executable="mDiffExecMPI", n_proc=n_proc)
     else:
-        command = "mDiffExec"
+        command = ["mDiffExec"]
     if proj_dir:
-        command += " -p %s" % str(proj_dir)
+        command += ["-p", str(proj_dir)]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if no_area:
-        command += " -n"
+        command += ["-n"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(diffs_table)
-    command += " " + str(template_header)
-    command += " " + str(diff_dir)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mDiffExec", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(diffs_table)]
+    command += [str(template_header)]
+    command += [str(diff_dir)]
+    return runner.run("mDiffExec", command)
 
 
 def mDiffFitExec(diffs_table, fits_table, diff_dir, debug=False,
-          status_file=None):
+          status_file=None, template_header=None, proj_dir=None,
+          no_area=False, level_only=False, mpi=False, n_proc=8):
     '''
     Using the table of overlaps found by mOverlaps, mDiffFitExec runs both
     mDiff and mFitplane for each record.  The fitting parameters are written
-    to a file to be used by mBgModel.
+    to a file to be used by mBgModel. The difference images are only kept
+    while they are being fitted.
+
+    If `template_header` is not given, the older form of the command is run
+    instead, which only fits difference images already generated by
+    mDiffExec.
 
     Parameters
     ----------
 
     diffs_table : str
-        Overlap table generated by mOverlaps, the last column of which
-        contains the filenames of the difference images generated by
-        mDiffExec.
+        Table generated by mOverlaps for the images in proj_dir.
 
     fits_table : str
         Output table of difference paramaters.
 
     diff_dir : str
-        Directory containing difference images.
+        Working directory for the difference images.
 
     debug : bool, optional
         Turns on debugging
 
     status_file : str, optional
         Writes output message to status_file instead of to stdout
+
+    template_header : str, optional
+        FITS header template for the difference images.
+
+    proj_dir : str, optional
+        Specifies path to the directory containing reprojected input images.
+
+    no_area : bool, optional
+        No-area-images option. Creates difference images without requiring
+        _area FITS images
+
+    level_only : bool, optional
+        Only fit the level of the difference images, not their slope.
+
+    mpi : bool, optional
+        If set to True, will use the MPI-enabled versions of the Montage
+        executable.
+
+    n_proc : int, optional
+        If mpi is set to True, n_proc is the number of processes to run
+        simultaneously (default is 8)
     '''
-    command = "mDiffFitExec"
+    if mpi:
+        command = _get_mpi_command(executable="mDiffFitExecMPI", n_proc=n_proc)
+    else:
+        command = ["mDiffFitExec"]
+    if proj_dir:
+        command += ["-p", str(proj_dir)]
     if debug:
-        command += " -d"
+        command += ["-d"]
+    if no_area:
+        command += ["-n"]
+    if level_only:
+        command += ["-l"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(diffs_table)
-    command += " " + str(fits_table)
-    command += " " + str(diff_dir)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mDiffFitExec", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(diffs_table)]
+    if template_header:
+        command += [str(template_header)]
+        command += [str(diff_dir)]
+        command += [str(fits_table)]
+    else:
+        command += [str(fits_table)]
+        command += [str(diff_dir)]
+    return runner.run("mDiffFitExec", command)
 
 
 def mExec(survey, band, raw_dir=None, n_tile_x=None, n_tile_y=None,
@@ -898,37 +859,32 @@ def mExec(survey, band, raw_dir=None, n_tile_x=None, n_tile_y=None,
         given, a unique local subdirectory will be created (e.g.;
         ./MOSAIC_AAAaa17v)
     '''
-    command = "mExec"
+    command = ["mExec"]
     if raw_dir:
-        command += " -r %s" % str(raw_dir)
+        command += ["-r", str(raw_dir)]
     if n_tile_x:
-        command += " -n %s" % str(n_tile_x)
+        command += ["-n", str(n_tile_x)]
     if n_tile_y:
-        command += " -m %s" % str(n_tile_y)
+        command += ["-m", str(n_tile_y)]
     if level_only:
-        command += " -l"
+        command += ["-l"]
     if keep:
-        command += " -k"
+        command += ["-k"]
     if remove:
-        command += " -c"
+        command += ["-c"]
     if output_image:
-        command += " -o %s" % str(output_image)
+        command += ["-o", str(output_image)]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if region_header:
-        command += " -f %s" % str(region_header)
+        command += ["-f", str(region_header)]
     if header:
-        command += " -h %s" % str(header)
-    command += " " + str(survey)
-    command += " " + str(band)
+        command += ["-h", str(header)]
+    command += [str(survey)]
+    command += [str(band)]
     if workspace_dir:
-        command += " %s" % str(workspace_dir)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mExec", p.stdout.read().strip())
+        command += [str(workspace_dir)]
+    return runner.run("mExec", command)
 
 
 def mFitExec(diffs_table, fits_table, diff_dir, debug=False, status_file=None,
@@ -969,20 +925,15 @@ def mFitExec(diffs_table, fits_table, diff_dir, debug=False, status_file=None,
     if mpi:
         command = _get_mpi_command(executable="mFitExecMPI", n_proc=n_proc)
     else:
-        command = "mFitExec"
+        command = ["mFitExec"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(diffs_table)
-    command += " " + str(fits_table)
-    command += " " + str(diff_dir)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mFitExec", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(diffs_table)]
+    command += [str(fits_table)]
+    command += [str(diff_dir)]
+    return runner.run("mFitExec", command)
 
 
 def mFitplane(in_image, border=None, debug_level=None, status_file=None):
@@ -1006,20 +957,15 @@ def mFitplane(in_image, border=None, debug_level=None, status_file=None):
     status_file : str, optional
         Output and errors are written to status_file instead of stdout.
     '''
-    command = "mFitplane"
+    command = ["mFitplane"]
     if border:
-        command += " -b %s" % str(border)
+        command += ["-b", str(border)]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_image)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mFitplane", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(in_image)]
+    return runner.run("mFitplane", command)
 
 
 def mFixNaN(in_image, out_image, debug_level=None, nan_value=None,
@@ -1048,22 +994,17 @@ def mFixNaN(in_image, out_image, debug_level=None, nan_value=None,
         If the nan_value option is not used, mFixNaN will replace all pixel
         values between min_blank and max_blank with NaN.
     '''
-    command = "mFixNaN"
+    command = ["mFixNaN"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if nan_value:
-        command += " -v %s" % str(nan_value)
-    command += " " + str(in_image)
-    command += " " + str(out_image)
+        command += ["-v", str(nan_value)]
+    command += [str(in_image)]
+    command += [str(out_image)]
     if min_blank and max_blank:
-        command += " %s" % str(min_blank)
-        command += " %s" % str(max_blank)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mFixNaN", p.stdout.read().strip())
+        command += [str(min_blank)]
+        command += [str(max_blank)]
+    return runner.run("mFixNaN", command)
 
 
 def mFlattenExec(images_table, flat_dir, img_dir=None, debug=False,
@@ -1094,23 +1035,18 @@ def mFlattenExec(images_table, flat_dir, img_dir=None, debug=False,
     status_file : str, optional
         Output and errors are sent to status_file instead of to stdout
     '''
-    command = "mFlattenExec"
+    command = ["mFlattenExec"]
     if img_dir:
-        command += " -p %s" % str(img_dir)
+        command += ["-p", str(img_dir)]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if no_area:
-        command += " -n"
+        command += ["-n"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(images_table)
-    command += " " + str(flat_dir)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mFlattenExec", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(images_table)]
+    command += [str(flat_dir)]
+    return runner.run("mFlattenExec", command)
 
 
 def mGetHdr(in_image, img_header, debug=False, hdu=None, status_file=None):
@@ -1137,21 +1073,16 @@ def mGetHdr(in_image, img_header, debug=False, hdu=None, status_file=None):
     status_file : str, optional
         Output and errors are sent to status_file instead of to stdout
     '''
-    command = "mGetHdr"
+    command = ["mGetHdr"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if hdu:
-        command += " -h %s" % str(hdu)
+        command += ["-h", str(hdu)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_image)
-    command += " " + str(img_header)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mGetHdr", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(in_image)]
+    command += [str(img_header)]
+    return runner.run("mGetHdr", command)
 
 
 def mHdr(object_or_location, width, out_file, system=None, equinox=None,
@@ -1189,26 +1120,21 @@ def mHdr(object_or_location, width, out_file, system=None, equinox=None,
     rotation : float, optional
         Rotation of image; default is 0
     '''
-    command = "mHdr"
+    command = ["mHdr"]
     if system:
-        command += " -s %s" % str(system)
+        command += ["-s", str(system)]
     if equinox:
-        command += " -e %s" % str(equinox)
+        command += ["-e", str(equinox)]
     if height:
-        command += " -h %s" % str(height)
+        command += ["-h", str(height)]
     if pix_size:
-        command += " -p %s" % str(pix_size)
+        command += ["-p", str(pix_size)]
     if rotation:
-        command += " -r %s" % str(rotation)
-    command += ' "' + str(object_or_location) + '"'
-    command += " " + str(width)
-    command += " " + str(out_file)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mHdr", p.stdout.read().strip())
+        command += ["-r", str(rotation)]
+    command += [str(object_or_location)]
+    command += [str(width)]
+    command += [str(out_file)]
+    return runner.run("mHdr", command)
 
 
 def mHdrCheck(in_image, status_file=None):
@@ -1229,16 +1155,11 @@ def mHdrCheck(in_image, status_file=None):
     status_file : str, optional
         Output and errors are sent to status_file instead of to stdout
     '''
-    command = "mHdrCheck"
+    command = ["mHdrCheck"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_image)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mHdrCheck", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(in_image)]
+    return runner.run("mHdrCheck", command)
 
 
 def mHdrtbl(directory, images_table, recursive=False, corners=False,
@@ -1289,27 +1210,22 @@ def mHdrtbl(directory, images_table, recursive=False, corners=False,
         mHdrtbl will only process files with names specified in table
         img_list, ignoring any other files in the directory.
     '''
-    command = "mHdrtbl"
+    command = ["mHdrtbl"]
     if recursive:
-        command += " -r"
+        command += ["-r"]
     if corners:
-        command += " -c"
+        command += ["-c"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if output_invalid:
-        command += " -b"
+        command += ["-b"]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if img_list:
-        command += " -t %s" % str(img_list)
-    command += " " + str(directory)
-    command += " " + str(images_table)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mHdrtbl", p.stdout.read().strip())
+        command += ["-t", str(img_list)]
+    command += [str(directory)]
+    command += [str(images_table)]
+    return runner.run("mHdrtbl", command)
 
 
 def mImgtbl(directory, images_table, recursive=False, corners=False,
@@ -1377,31 +1293,26 @@ def mImgtbl(directory, images_table, recursive=False, corners=False,
         mImgtbl will only process files with names specified in table
         img_list, ignoring any other files in the directory.
     '''
-    command = "mImgtbl"
+    command = ["mImgtbl"]
     if recursive:
-        command += " -r"
+        command += ["-r"]
     if corners:
-        command += " -c"
+        command += ["-c"]
     if include_area:
-        command += " -a"
+        command += ["-a"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if output_invalid:
-        command += " -b"
+        command += ["-b"]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if fieldlist:
-        command += " -f %s" % str(fieldlist)
+        command += ["-f", str(fieldlist)]
     if img_list:
-        command += " -t %s" % str(img_list)
-    command += " " + str(directory)
-    command += " " + str(images_table)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mImgtbl", p.stdout.read().strip())
+        command += ["-t", str(img_list)]
+    command += [str(directory)]
+    command += [str(images_table)]
+    return runner.run("mImgtbl", command)
 
 
 def mMakeHdr(images_table, template_header, debug_level=None,
@@ -1445,27 +1356,22 @@ def mMakeHdr(images_table, template_header, debug_level=None,
         If a coordinate system is specified, the equinox can also be given in
         the form YYYY. Default is J2000.
     '''
-    command = "mMakeHdr"
+    command = ["mMakeHdr"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if cdelt:
-        command += " -p %s" % str(cdelt)
+        command += ["-p", str(cdelt)]
     if north_aligned:
-        command += " -n"
-    command += " " + str(images_table)
-    command += " " + str(template_header)
+        command += ["-n"]
+    command += [str(images_table)]
+    command += [str(template_header)]
     if system:
-        command += " %s" % str(system)
+        command += [str(system)]
         if equinox:
-            command += " %s" % str(equinox)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mMakeHdr", p.stdout.read().strip())
+            command += [str(equinox)]
+    return runner.run("mMakeHdr", command)
 
 
 def mOverlaps(images_table, diffs_table, exact=False, debug_level=None,
@@ -1501,21 +1407,16 @@ def mOverlaps(images_table, diffs_table, exact=False, debug_level=None,
     status_file : str, optional
         Output and errors are sent to status_file instead of to stdout
     '''
-    command = "mOverlaps"
+    command = ["mOverlaps"]
     if exact:
-        command += " -e"
+        command += ["-e"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(images_table)
-    command += " " + str(diffs_table)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mOverlaps", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(images_table)]
+    command += [str(diffs_table)]
+    return runner.run("mOverlaps", command)
 
 
 def mPix2Coord(template_header, ixpix, jypix, debug=False):
@@ -1539,18 +1440,13 @@ def mPix2Coord(template_header, ixpix, jypix, debug=False):
     debug : bool, optional
         Print out additional debugging information
     '''
-    command = "mPix2Coord"
+    command = ["mPix2Coord"]
     if debug:
-        command += " -d"
-    command += " " + str(template_header)
-    command += " " + str(ixpix)
-    command += " " + str(jypix)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mPix2Coord", p.stdout.read().strip())
+        command += ["-d"]
+    command += [str(template_header)]
+    command += [str(ixpix)]
+    command += [str(jypix)]
+    return runner.run("mPix2Coord", command)
 
 
 def mProject(in_image, out_image, template_header, factor=None,
@@ -1614,32 +1510,27 @@ def mProject(in_image, out_image, template_header, factor=None,
         Makes the output region (originally defined in the header template)
         big enough to include all of the input images
     '''
-    command = "mProject"
+    command = ["mProject"]
     if factor:
-        command += " -z %s" % str(factor)
+        command += ["-z", str(factor)]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if hdu:
-        command += " -h %s" % str(hdu)
+        command += ["-h", str(hdu)]
     if scale:
-        command += " -x %s" % str(scale)
+        command += ["-x", str(scale)]
     if weight_file:
-        command += " -w %s" % str(weight_file)
+        command += ["-w", str(weight_file)]
     if threshold:
-        command += " -t %s" % str(threshold)
+        command += ["-t", str(threshold)]
     if whole:
-        command += " -X"
-    command += " " + str(in_image)
-    command += " " + str(out_image)
-    command += " " + str(template_header)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mProject", p.stdout.read().strip())
+        command += ["-X"]
+    command += [str(in_image)]
+    command += [str(out_image)]
+    command += [str(template_header)]
+    return runner.run("mProject", command)
 
 
 def mProjectPP(in_image, out_image, template_header, factor=None,
@@ -1708,36 +1599,31 @@ def mProjectPP(in_image, out_image, template_header, factor=None,
         Reproject the whole image even if part of it is outside the region of
         interest (don't crop while re-projecting).
     '''
-    command = "mProjectPP"
+    command = ["mProjectPP"]
     if factor:
-        command += " -z %s" % str(factor)
+        command += ["-z", str(factor)]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if border:
-        command += " -b %s" % str(border)
+        command += ["-b", str(border)]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if alternate_header:
-        command += " -[i|o] %s" % str(alternate_header)
+        command += ["-[i|o]", str(alternate_header)]
     if hdu:
-        command += " -h %s" % str(hdu)
+        command += ["-h", str(hdu)]
     if scale:
-        command += " -x %s" % str(scale)
+        command += ["-x", str(scale)]
     if weight_file:
-        command += " -w %s" % str(weight_file)
+        command += ["-w", str(weight_file)]
     if threshold:
-        command += " -t %s" % str(threshold)
+        command += ["-t", str(threshold)]
     if whole:
-        command += " -X"
-    command += " " + str(in_image)
-    command += " " + str(out_image)
-    command += " " + str(template_header)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mProjectPP", p.stdout.read().strip())
+        command += ["-X"]
+    command += [str(in_image)]
+    command += [str(out_image)]
+    command += [str(template_header)]
+    return runner.run("mProjectPP", command)
 
 
 def mProjExec(images_table, template_header, proj_dir, stats_table,
@@ -1808,33 +1694,28 @@ def mProjExec(images_table, template_header, proj_dir, stats_table,
     if mpi:
         command = _get_mpi_command(executable="mProjExecMPI", n_proc=n_proc)
     else:
-        command = "mProjExec"
+        command = ["mProjExec"]
     if raw_dir:
-        command += " -p %s" % str(raw_dir)
+        command += ["-p", str(raw_dir)]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if exact:
-        command += " -e"
+        command += ["-e"]
     if whole:
-        command += " -X"
+        command += ["-X"]
     if border:
-        command += " -b %s" % str(border)
+        command += ["-b", str(border)]
     if restart_rec:
-        command += " -r %s" % str(restart_rec)
+        command += ["-r", str(restart_rec)]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if scale_column:
-        command += " -x %s" % str(scale_column)
-    command += " " + str(images_table)
-    command += " " + str(template_header)
-    command += " " + str(proj_dir)
-    command += " " + str(stats_table)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mProjExec", p.stdout.read().strip())
+        command += ["-x", str(scale_column)]
+    command += [str(images_table)]
+    command += [str(template_header)]
+    command += [str(proj_dir)]
+    command += [str(stats_table)]
+    return runner.run("mProjExec", command)
 
 
 def mPutHdr(in_image, out_image, template_header, debug=False,
@@ -1864,22 +1745,17 @@ def mPutHdr(in_image, out_image, template_header, debug=False,
     hdu : int, optional
         Write to the specified FITS extnension (HDU).
     '''
-    command = "mPutHdr"
+    command = ["mPutHdr"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if hdu:
-        command += " -h %s" % str(hdu)
-    command += " " + str(in_image)
-    command += " " + str(out_image)
-    command += " " + str(template_header)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mPutHdr", p.stdout.read().strip())
+        command += ["-h", str(hdu)]
+    command += [str(in_image)]
+    command += [str(out_image)]
+    command += [str(template_header)]
+    return runner.run("mPutHdr", command)
 
 
 def mRotate(in_image, out_image, debug_level=None, status_file=None,
@@ -1915,27 +1791,22 @@ def mRotate(in_image, out_image, debug_level=None, status_file=None,
         width are provided. Only used if ra, dec, and xsize are specified.
         Defaults to xsize.
     '''
-    command = "mRotate"
+    command = ["mRotate"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if status_file:
-        command += " -s %s" % str(status_file)
+        command += ["-s", str(status_file)]
     if rotation_angle:
-        command += " -r %s" % str(rotation_angle)
-    command += " " + str(in_image)
-    command += " " + str(out_image)
+        command += ["-r", str(rotation_angle)]
+    command += [str(in_image)]
+    command += [str(out_image)]
     if ra and dec and xsize:
-        command += " %s" % str(ra)
-        command += " %s" % str(dec)
-        command += " %s" % str(xsize)
+        command += [str(ra)]
+        command += [str(dec)]
+        command += [str(xsize)]
         if ysize:
-            command += " %s" % str(ysize)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mRotate", p.stdout.read().strip())
+            command += [str(ysize)]
+    return runner.run("mRotate", command)
 
 
 def mShrink(in_image, out_image, factor, fixed_size=False, debug_level=None,
@@ -1968,22 +1839,17 @@ def mShrink(in_image, out_image, factor, fixed_size=False, debug_level=None,
     status_file : str, optional
         Output and errors are sent to status_file instead of to stdout
     '''
-    command = "mShrink"
+    command = ["mShrink"]
     if fixed_size:
-        command += " -f"
+        command += ["-f"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_image)
-    command += " " + str(out_image)
-    command += " " + str(factor)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mShrink", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(in_image)]
+    command += [str(out_image)]
+    command += [str(factor)]
+    return runner.run("mShrink", command)
 
 
 def mSubimage(in_image, out_image, ra, dec, xsize, debug=False,
@@ -2026,28 +1892,23 @@ def mSubimage(in_image, out_image, ra, dec, xsize, debug=False,
     ysize : float, optional
         Height of output image in degrees (default is equal to xsize.
     '''
-    command = "mSubimage"
+    command = ["mSubimage"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if all_pixels:
-        command += " -a"
+        command += ["-a"]
     if hdu:
-        command += " -h %s" % str(hdu)
+        command += ["-h", str(hdu)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_image)
-    command += " " + str(out_image)
-    command += " " + str(ra)
-    command += " " + str(dec)
-    command += " " + str(xsize)
+        command += ["-s", str(status_file)]
+    command += [str(in_image)]
+    command += [str(out_image)]
+    command += [str(ra)]
+    command += [str(dec)]
+    command += [str(xsize)]
     if ysize:
-        command += " %s" % str(ysize)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mSubimage", p.stdout.read().strip())
+        command += [str(ysize)]
+    return runner.run("mSubimage", command)
 
 
 def mSubimage_pix(in_image, out_image, xstartpix, ystartpix, xpixsize,
@@ -2085,26 +1946,21 @@ def mSubimage_pix(in_image, out_image, xstartpix, ystartpix, xpixsize,
     ypixsize : int, optional
         Height of output image in pixels (default is equal to xpix_size
     '''
-    command = "mSubimage -p"
+    command = ["mSubimage", "-p"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if hdu:
-        command += " -h %s" % str(hdu)
+        command += ["-h", str(hdu)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_image)
-    command += " " + str(out_image)
-    command += " " + str(xstartpix)
-    command += " " + str(ystartpix)
-    command += " " + str(xpixsize)
+        command += ["-s", str(status_file)]
+    command += [str(in_image)]
+    command += [str(out_image)]
+    command += [str(xstartpix)]
+    command += [str(ystartpix)]
+    command += [str(xpixsize)]
     if ypixsize:
-        command += " %s" % str(ypixsize)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mSubimage_pix", p.stdout.read().strip())
+        command += [str(ypixsize)]
+    return runner.run("mSubimage_pix", command)
 
 
 def mSubset(images_table, template_header, subset_table, debug_level=None,
@@ -2138,22 +1994,17 @@ def mSubset(images_table, template_header, subset_table, debug_level=None,
     status_file : str, optional
         Output and errors are sent to status_file instead of to stdout
     '''
-    command = "mSubset"
+    command = ["mSubset"]
     if debug_level:
-        command += " -d %s" % str(debug_level)
+        command += ["-d", str(debug_level)]
     if fast_mode:
-        command += " -f"
+        command += ["-f"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(images_table)
-    command += " " + str(template_header)
-    command += " " + str(subset_table)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mSubset", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(images_table)]
+    command += [str(template_header)]
+    command += [str(subset_table)]
+    return runner.run("mSubset", command)
 
 
 def mTANHdr(orig_header, new_header, debug=False, order=None, max_iter=None,
@@ -2190,25 +2041,20 @@ def mTANHdr(orig_header, new_header, debug=False, order=None, max_iter=None,
     status_file : str, optional
         Output and errors are written to status_file instead of stdout.
     '''
-    command = "mTANHdr"
+    command = ["mTANHdr"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if order:
-        command += " -o %s" % str(order)
+        command += ["-o", str(order)]
     if max_iter:
-        command += " -i %s" % str(max_iter)
+        command += ["-i", str(max_iter)]
     if tolerance:
-        command += " -t %s" % str(tolerance)
+        command += ["-t", str(tolerance)]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(orig_header)
-    command += " " + str(new_header)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mTANHdr", p.stdout.read().strip())
+        command += ["-s", str(status_file)]
+    command += [str(orig_header)]
+    command += [str(new_header)]
+    return runner.run("mTANHdr", command)
 
 
 def mTblSort(in_table, column_name, out_table, debug=False):
@@ -2230,18 +2076,13 @@ def mTblSort(in_table, column_name, out_table, debug=False):
     debug : bool, optional
         Turns on debugging
     '''
-    command = "mTblSort"
+    command = ["mTblSort"]
     if debug:
-        command += " -d"
-    command += " " + str(in_table)
-    command += " " + str(column_name)
-    command += " " + str(out_table)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mTblSort", p.stdout.read().strip())
+        command += ["-d"]
+    command += [str(in_table)]
+    command += [str(column_name)]
+    command += [str(out_table)]
+    return runner.run("mTblSort", command)
 
 
 def mTileHdr(orig_header, new_header, n_x, n_y, ix, iy, debug=False,
@@ -2287,25 +2128,20 @@ def mTileHdr(orig_header, new_header, n_x, n_y, ix, iy, debug=False,
         Number of pixels to overlap tiles in the y direction (default is 0).
         Only used if xpad is present.
     '''
-    command = "mTileHdr"
+    command = ["mTileHdr"]
     if debug:
-        command += " -d"
+        command += ["-d"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(orig_header)
-    command += " " + str(new_header)
-    command += " " + str(n_x)
-    command += " " + str(n_y)
-    command += " " + str(ix)
-    command += " " + str(iy)
+        command += ["-s", str(status_file)]
+    command += [str(orig_header)]
+    command += [str(new_header)]
+    command += [str(n_x)]
+    command += [str(n_y)]
+    command += [str(ix)]
+    command += [str(iy)]
     if xpad:
-        command += " %s" % str(xpad)
+        command += [str(xpad)]
         if ypad:
-            command += " %s" % str(ypad)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mTileHdr", p.stdout.read().strip())
+            command += [str(ypad)]
+    return runner.run("mTileHdr", command)
 
@@ -1,10 +1,7 @@
 # This file contains commands for which wrappers could not be
 # auto-generated from the HTML docs
 
-import subprocess
-import shlex
-
-from . import status
+from . import runner
 
 
 def mCoverageCheck(in_table, out_table, mode, polygon=None, ra=None,
@@ -70,18 +67,18 @@ def mCoverageCheck(in_table, out_table, mode, polygon=None, ra=None,
         Output and errors are sent to status_file instead of to stdout
     '''
 
-    command = "mCoverageCheck"
+    command = ["mCoverageCheck"]
     if status_file:
-        command += " -s %s" % str(status_file)
-    command += " " + str(in_table)
-    command += " " + str(out_table)
-    command += " -" + mode
+        command += ["-s", str(status_file)]
+    command += [str(in_table)]
+    command += [str(out_table)]
+    command += ["-" + mode]
     if mode == 'points':
         if polygon is None:
             raise Exception("polygon= needs to be specified for mode='points'")
         for point in polygon:
-            command += " " + str(point[0])
-            command += " " + str(point[1])
+            command += [str(point[0])]
+            command += [str(point[1])]
     elif mode == 'box':
         if ra is None:
             raise Exception("ra= needs to be specified for mode='box'")
@@ -89,13 +86,13 @@ def mCoverageCheck(in_table, out_table, mode, polygon=None, ra=None,
             raise Exception("dec= needs to be specified for mode='box'")
         if width is None:
             raise Exception("width= needs to be specified for mode='box'")
-        command += " " + str(ra)
-        command += " " + str(dec)
-        command += " " + str(width)
+        command += [str(ra)]
+        command += [str(dec)]
+        command += [str(width)]
         if height is not None:
-            command += " " + str(height)
+            command += [str(height)]
             if rotation is not None:
-                command += " " + str(rotation)
+                command += [str(rotation)]
         else:
             if rotation is not None:
                 raise Exception("Cannot specify rotation without height")
@@ -107,28 +104,23 @@ def mCoverageCheck(in_table, out_table, mode, polygon=None, ra=None,
             raise Exception("dec= needs to be specified for mode='circle'")
         if radius is None:
             raise Exception("radius= needs to be specified for mode='circle'")
-        command += " " + str(ra)
-        command += " " + str(dec)
-        command += " " + str(radius)
+        command += [str(ra)]
+        command += [str(dec)]
+        command += [str(radius)]
     elif mode == 'point':
         if ra is None:
             raise Exception("ra= needs to be specified for mode='point'")
         if dec is None:
             raise Exception("dec= needs to be specified for mode='point'")
-        command += " " + str(ra)
-        command += " " + str(dec)
+        command += [str(ra)]
+        command += [str(dec)]
     elif mode == 'header':
         if header is None:
             raise Exception("header= needs to be specified for mode='header'")
-        command += " " + header
+        command += [str(header)]
     else:
         raise Exception("Unknown mode: %s" % mode)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mCoverageCheck", p.stdout.read().strip())
+    return runner.run("mCoverageCheck", command)
     
     
 def mTileImage(in_image, tiles_x, tiles_y, overlap_x=None, overlap_y=None):
@@ -154,14 +146,9 @@ def mTileImage(in_image, tiles_x, tiles_y, overlap_x=None, overlap_y=None):
     overlap_y : int, optional
         Pixel overlap in y direction.
     '''
-    command = "mTileImage"
+    command = ["mTileImage"]
     if overlap_x or overlap_y:
-        command += " -o %s,%s" % (overlap_x, overlap_y)
-    command += " -n %s,%s" % (tiles_x, tiles_y)
-    command += " " + str(in_image)
-    p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stderr = p.stderr.read()
-    if stderr:
-        raise Exception(stderr)
-    return status.parse_struct("mTileImage", p.stdout.read().strip())
+        command += ["-o", "%s,%s" % (overlap_x, overlap_y)]
+    command += ["-n", "%s,%s" % (tiles_x, tiles_y)]
+    command += [str(in_image)]
+    return runner.run("mTileImage", command)
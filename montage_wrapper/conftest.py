@@ -1,4 +1,5 @@
 import os
+import sys
 
 # this contains imports plugins that configure py.test for astropy tests.
 # by importing them here in conftest.py they are discoverable by py.test
@@ -6,6 +7,12 @@ import os
 
 from astropy.tests.pytest_plugins import *
 
+# The asyncio wrappers use syntax that is only valid on Python 3.5 and later,
+# so they should not be imported (e.g. by the doctest collection) before then
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('aio.py')
+
 ## Uncomment the following line to treat all DeprecationWarnings as
 ## exceptions
 # enable_deprecations_as_exceptions()
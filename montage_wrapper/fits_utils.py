@@ -0,0 +1,357 @@
+"""
+Helper functions to read and write FITS images directly from Python, for
+the cases where going through a Montage command would mean an extra pass
+over the data.
+"""
+
+import hashlib
+import re
+import shutil
+
+import numpy
+
+from astropy.io import fits
+
+# On-disk data types for each allowed BITPIX value
+BITPIX_DTYPES = {8: 'u1', 16: '>i2', 32: '>i4', 64: '>i8',
+                 -32: '>f4', -64: '>f8'}
+
+# BLANK values used to represent NaN values in integer images
+BLANK_VALUES = {8: 0, 16: -32768, 32: -2147483648, 64: -9223372036854775808}
+
+# Keywords that describe the data layout, and which are therefore set by
+# create_image rather than copied over from the template header
+STRUCTURE_KEYWORDS = re.compile('^(SIMPLE|BITPIX|NAXIS[0-9]*|EXTEND|BSCALE|BZERO|BLANK|END)$')
+
+
+def primary_header(header, shape, bitpix, bscale=None, bzero=None):
+    '''
+    Return a primary header for an image with the given shape and BITPIX,
+    with all other keywords (e.g. WCS) copied from ``header``. For integer
+    BITPIX values, ``bscale`` and ``bzero`` are written if set.
+    '''
+
+    if bitpix not in BITPIX_DTYPES:
+        raise ValueError("Invalid BITPIX value: %s" % bitpix)
+
+    new_header = fits.Header()
+    new_header['SIMPLE'] = True
+    new_header['BITPIX'] = bitpix
+    new_header['NAXIS'] = len(shape)
+    for i, n in enumerate(shape[::-1]):
+        new_header['NAXIS%i' % (i + 1)] = n
+    if bitpix > 0:
+        if bscale is not None:
+            new_header['BSCALE'] = bscale
+        if bzero is not None:
+            new_header['BZERO'] = bzero
+        new_header['BLANK'] = BLANK_VALUES[bitpix]
+
+    for card in header.cards:
+        if not STRUCTURE_KEYWORDS.match(card.keyword):
+            new_header.append(card)
+
+    return new_header
+
+
+def create_image(filename, header, shape, bitpix=-64, bscale=None, bzero=None):
+    '''
+    Create a FITS file of the right size for an image with the given shape
+    and BITPIX, and return its data as a writable memory-mapped array.
+
+    The data is initially filled with zeros, and only the parts of it that
+    are accessed are ever held in memory, so this can be used to write
+    images that are too large to fit in memory.
+
+    Parameters
+    ----------
+    filename : str
+        The FITS file to create (any existing file is overwritten).
+    header : :class:`~astropy.io.fits.Header`
+        Header containing the WCS and any other keywords for the image.
+        Keywords describing the data layout (BITPIX, NAXIS, ...) are ignored.
+    shape : tuple
+        The shape of the data, in Numpy order.
+    bitpix : int, optional
+        The BITPIX value, which sets the on-disk type of the data.
+    bscale, bzero : float, optional
+        The scaling of the data for integer BITPIX values (see
+        :func:`integer_scaling`). The memory-mapped array holds the raw
+        integer values, so data should be converted with :func:`to_bitpix`
+        using the same scaling before being written.
+
+    Returns
+    -------
+    data : `numpy.memmap`
+        The memory-mapped data.
+    '''
+
+    header = primary_header(header, shape, bitpix, bscale=bscale, bzero=bzero)
+    header_bytes = header.tostring().encode('ascii')
+
+    dtype = numpy.dtype(BITPIX_DTYPES[bitpix])
+    n_bytes = int(numpy.prod(shape)) * dtype.itemsize
+    n_bytes_padded = ((n_bytes + 2879) // 2880) * 2880
+
+    with open(filename, 'wb') as f:
+        f.write(header_bytes)
+        if n_bytes_padded > 0:
+            f.seek(len(header_bytes) + n_bytes_padded - 1)
+            f.write(b'\0')
+
+    return numpy.memmap(filename, dtype=dtype, mode='r+',
+                        offset=len(header_bytes), shape=tuple(shape))
+
+
+def _integer_range(bitpix):
+    '''
+    Return the range of raw values available for valid data for an integer
+    BITPIX value, excluding the BLANK value (the smallest value of each
+    type), as floating-point values that can be converted back exactly.
+    '''
+    info = numpy.iinfo(numpy.dtype(BITPIX_DTYPES[bitpix]))
+    imin, imax = float(info.min + 1), float(info.max)
+    if int(imin) < info.min + 1:
+        imin = numpy.nextafter(imin, 0.)
+    if int(imax) > info.max:
+        imax = numpy.nextafter(imax, 0.)
+    return imin, imax
+
+
+def integer_scaling(vmin, vmax, bitpix):
+    '''
+    Return the BSCALE and BZERO values that map the range of values from
+    ``vmin`` to ``vmax`` onto the full range of an integer BITPIX value (as
+    done by mConvert), leaving out the BLANK value used for NaN values.
+    '''
+    imin, imax = _integer_range(bitpix)
+    if not numpy.isfinite(vmin) or not numpy.isfinite(vmax):
+        return 1., 0.
+    if vmax > vmin:
+        bscale = (float(vmax) - float(vmin)) / (float(imax) - float(imin))
+    else:
+        bscale = 1.
+    bzero = float(vmin) - bscale * imin
+    return bscale, bzero
+
+
+def to_bitpix(data, bitpix, bscale=1., bzero=0.):
+    '''
+    Convert an array to the data type for a given BITPIX value, replacing
+    NaN values by the BLANK value for integer types.
+
+    For integer types, values are scaled with ``bscale`` and ``bzero`` (so
+    that the physical values are ``bzero + bscale * raw``) and rounded, and a
+    `ValueError` is raised if any of them do not fit in the data type.
+    '''
+    if bitpix > 0:
+        data = numpy.asarray(data, dtype=float)
+        nan = numpy.isnan(data)
+        raw = numpy.round((numpy.where(nan, 0., data) - bzero) / bscale)
+        imin, imax = _integer_range(bitpix)
+        # Allow for rounding errors when the range of values is mapped onto
+        # the full range of the type
+        tolerance = 0.5 + 1e-9 * imax
+        if numpy.any((raw < imin - tolerance) | (raw > imax + tolerance)):
+            raise ValueError("Values are out of range for BITPIX=%i with "
+                             "BSCALE=%g and BZERO=%g" % (bitpix, bscale, bzero))
+        data = numpy.where(nan, BLANK_VALUES[bitpix], numpy.clip(raw, imin, imax))
+    return data.astype(BITPIX_DTYPES[bitpix])
+
+
+def read_header_file(filename):
+    '''
+    Read a Montage header template file (such as those produced by mMakeHdr).
+    '''
+    with open(filename, 'r') as f:
+        return fits.Header.fromstring(f.read(), sep='\n')
+
+
+def write_header_file(header, filename):
+    '''
+    Write a header to a Montage header template file.
+    '''
+    with open(filename, 'w') as f:
+        for card in header.cards:
+            if card.keyword not in ('COMMENT', 'HISTORY', ''):
+                f.write(card.image + '\n')
+        f.write('END\n')
+
+
+def crop_to_header(in_image, out_image, header, bitpix=None, chunk_rows=1024):
+    '''
+    Pad and/or crop an image to the exact size of a header template.
+
+    This is equivalent to running mAdd in exact size mode on a single image
+    produced by mProject (or mProjectPP), which uses the same projection as
+    the header template but with a different size and an integer offset in
+    CRPIX. The data is copied a chunk of rows at a time through memory-mapped
+    arrays, so that the image is never loaded into memory in full.
+
+    Parameters
+    ----------
+    in_image : str
+        The image produced by mProject
+    out_image : str
+        The output image to create
+    header : :class:`~astropy.io.fits.Header`
+        The header template
+    bitpix : int, optional
+        The BITPIX value of the output image. By default, this is the same as
+        for the input image.
+    chunk_rows : int, optional
+        The number of rows to copy at a time
+    '''
+
+    ny, nx = header['NAXIS2'], header['NAXIS1']
+
+    with fits.open(in_image, memmap=True) as hdulist:
+
+        data = hdulist[0].data
+        ny_in, nx_in = data.shape
+
+        if bitpix is None:
+            bitpix = hdulist[0].header['BITPIX']
+
+        # Offset of the input image in the output image
+        xoff = int(round(header['CRPIX1'] - hdulist[0].header['CRPIX1']))
+        yoff = int(round(header['CRPIX2'] - hdulist[0].header['CRPIX2']))
+
+        out = create_image(out_image, header, (ny, nx), bitpix=bitpix)
+
+        blank = BLANK_VALUES[bitpix] if bitpix > 0 else numpy.nan
+
+        x0, x1 = max(xoff, 0), min(xoff + nx_in, nx)
+        y0, y1 = max(yoff, 0), min(yoff + ny_in, ny)
+
+        for start in range(0, ny, chunk_rows):
+            end = min(start + chunk_rows, ny)
+            out[start:end] = blank
+            ys, ye = max(start, y0), min(end, y1)
+            if ye > ys and x1 > x0:
+                out[ys:ye, x0:x1] = to_bitpix(data[ys - yoff:ye - yoff,
+                                                   x0 - xoff:x1 - xoff], bitpix)
+
+        out.flush()
+        del out
+        del data
+
+
+def paste_image(in_image, out_image, xoff, yoff, chunk_rows=1024):
+    '''
+    Overwrite a rectangular region of an existing image with the contents of
+    another image, in place.
+
+    Only the rows of ``out_image`` covered by ``in_image`` are read and
+    written, through a memory-mapped array. If ``out_image`` has an integer
+    BITPIX, the values are scaled with its existing BSCALE and BZERO.
+
+    Parameters
+    ----------
+    in_image : str
+        The image to copy
+    out_image : str
+        The image to modify
+    xoff, yoff : int
+        The (zero-based) pixel position in ``out_image`` of the first pixel of
+        ``in_image``. ``in_image`` has to fall entirely within ``out_image``.
+    chunk_rows : int, optional
+        The number of rows to copy at a time
+    '''
+
+    with fits.open(out_image, do_not_scale_image_data=True) as hdulist:
+        header = hdulist[0].header
+        offset = hdulist.fileinfo(0)['datLoc']
+
+    bitpix = header['BITPIX']
+    shape = (header['NAXIS2'], header['NAXIS1'])
+    bscale = header.get('BSCALE', 1.)
+    bzero = header.get('BZERO', 0.)
+
+    out = numpy.memmap(out_image, dtype=BITPIX_DTYPES[bitpix], mode='r+',
+                       offset=offset, shape=shape)
+
+    with fits.open(in_image, memmap=True) as hdulist:
+
+        data = hdulist[0].data
+        ny_in, nx_in = data.shape
+
+        if xoff < 0 or yoff < 0 or xoff + nx_in > shape[1] or yoff + ny_in > shape[0]:
+            raise ValueError("Image does not fall within the output image")
+
+        for start in range(0, ny_in, chunk_rows):
+            end = min(start + chunk_rows, ny_in)
+            out[yoff + start:yoff + end, xoff:xoff + nx_in] = to_bitpix(data[start:end], bitpix,
+                                                                        bscale=bscale, bzero=bzero)
+
+        out.flush()
+        del out
+        del data
+
+
+def convert_image(in_image, out_image, bitpix, chunk_rows=1024):
+    '''
+    Convert an image or a cube to a different BITPIX value, a chunk of rows
+    at a time.
+
+    As for mConvert, values are scaled to the full range of the data type
+    (with BSCALE and BZERO) when converting to integer types, which requires
+    a first pass over the data to find its range. If the image already has
+    the requested BITPIX, it is copied as it is.
+    '''
+
+    if fits.getval(in_image, 'BITPIX') == bitpix:
+        shutil.copyfile(in_image, out_image)
+        return
+
+    with fits.open(in_image, memmap=True) as hdulist:
+
+        data = hdulist[0].data
+        header = hdulist[0].header
+        shape = data.shape
+
+        # Rows of the image, or of all the planes of the cube
+        rows = data.reshape((-1, shape[-1]))
+
+        if bitpix > 0:
+            vmin, vmax = numpy.inf, -numpy.inf
+            for start in range(0, rows.shape[0], chunk_rows):
+                chunk = rows[start:start + chunk_rows]
+                valid = chunk[~numpy.isnan(chunk)]
+                if valid.size > 0:
+                    vmin, vmax = min(vmin, valid.min()), max(vmax, valid.max())
+            bscale, bzero = integer_scaling(vmin, vmax, bitpix)
+            out = create_image(out_image, header, shape, bitpix=bitpix,
+                               bscale=bscale, bzero=bzero)
+        else:
+            bscale, bzero = 1., 0.
+            out = create_image(out_image, header, shape, bitpix=bitpix)
+
+        out_rows = out.reshape((-1, shape[-1]))
+
+        for start in range(0, rows.shape[0], chunk_rows):
+            end = min(start + chunk_rows, rows.shape[0])
+            out_rows[start:end] = to_bitpix(rows[start:end], bitpix,
+                                            bscale=bscale, bzero=bzero)
+
+        out.flush()
+        del out, out_rows
+        del data, rows
+
+
+def header_fingerprint(header, keywords=None):
+    '''
+    Return a hash of the cards in a header, optionally restricted to the
+    keywords matching the regular expression ``keywords``. COMMENT and
+    HISTORY cards are ignored.
+    '''
+    if keywords is not None:
+        keywords = re.compile(keywords)
+    cards = []
+    for card in header.cards:
+        if card.keyword in ('', 'COMMENT', 'HISTORY'):
+            continue
+        if keywords is not None and not keywords.match(card.keyword):
+            continue
+        cards.append((card.keyword, str(card.value)))
+    return hashlib.md5(repr(sorted(cards)).encode('utf-8')).hexdigest()
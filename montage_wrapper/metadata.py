@@ -0,0 +1,516 @@
+"""
+Python implementations of the Montage steps that collect image metadata.
+
+These only need to read the FITS headers, which can be done for many files
+at once using a pool of threads. This is much faster than running mImgtbl on
+large directories, especially on parallel filesystems where the latency of
+each file access dominates. The metadata can also be kept in a persistent
+index, so that only new or modified files need to be read again.
+"""
+
+import os
+import json
+import sqlite3
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+from astropy.io import fits
+from astropy.table import Table, MaskedColumn
+from astropy.wcs import WCS
+from astropy import log
+
+from . import status
+
+__all__ = ['build_image_table', 'MetadataIndex']
+
+# File extensions recognized as FITS files (case-insensitive)
+FITS_EXTENSIONS = ('.fits', '.fit', '.fts', '.fits.gz', '.fit.gz', '.fts.gz')
+
+# Columns describing the WCS of each image, in the order used by mImgtbl
+WCS_COLUMNS = ['ctype1', 'ctype2', 'equinox', 'crval1', 'crval2', 'crpix1',
+               'crpix2', 'cdelt1', 'cdelt2', 'crota2']
+
+CORNER_COLUMNS = ['ra1', 'dec1', 'ra2', 'dec2', 'ra3', 'dec3', 'ra4', 'dec4']
+
+FIELDLIST_TYPES = {'int': int, 'char': str, 'double': float}
+
+
+def _list_files(directory, recursive=False, include_area=False,
+                img_list=None):
+    '''
+    Find the FITS files in a directory, returning paths relative to the
+    directory.
+    '''
+
+    if img_list is not None:
+        table = Table.read(img_list, format='ascii.ipac')
+        return [str(fname).strip() for fname in table['fname']]
+
+    if recursive:
+        filenames = []
+        for root, dirs, files in os.walk(directory, followlinks=True):
+            dirs.sort()
+            relative = os.path.relpath(root, directory)
+            for filename in sorted(files):
+                filenames.append(os.path.normpath(os.path.join(relative, filename)))
+    else:
+        filenames = sorted(filename for filename in os.listdir(directory)
+                           if os.path.isfile(os.path.join(directory, filename)))
+
+    selected = []
+    for filename in filenames:
+        lower = filename.lower()
+        for extension in FITS_EXTENSIONS:
+            if lower.endswith(extension):
+                break
+        else:
+            continue
+        if not include_area and lower[:-len(extension)].endswith('_area'):
+            continue
+        selected.append(filename)
+
+    return selected
+
+
+def _read_headers(path):
+    '''
+    Read the headers of all image HDUs in a FITS file, without reading the
+    data. Returns a list of (hdu, header) pairs, or `None` if the file could
+    not be read.
+    '''
+    try:
+        with fits.open(path, memmap=True) as hdulist:
+            headers = []
+            for hdu, item in enumerate(hdulist):
+                header = item.header
+                if header.get('NAXIS', 0) >= 2 and header.get('NAXIS1', 0) > 0 \
+                        and header.get('NAXIS2', 0) > 0:
+                    headers.append((hdu, header.copy()))
+            return headers
+    except Exception as exc:
+        log.debug("Could not read %s: %s" % (path, exc))
+        return None
+
+
+def _cdelt_crota(wcs):
+    '''
+    Convert the linear transformation of a WCS to CDELT and CROTA2 values,
+    as used in Montage image tables.
+    '''
+    if wcs.wcs.has_cd():
+        cd = wcs.wcs.cd
+    else:
+        cd = wcs.wcs.get_pc() * wcs.wcs.cdelt[:, numpy.newaxis]
+    cdelt1 = numpy.hypot(cd[0, 0], cd[1, 0])
+    cdelt2 = numpy.hypot(cd[0, 1], cd[1, 1])
+    if numpy.linalg.det(cd) < 0:
+        cdelt1 = -cdelt1
+    crota2 = numpy.degrees(numpy.arctan2(-cd[0, 1], cd[1, 1]))
+    return cdelt1, cdelt2, crota2
+
+
+def _sky_positions(wcs, naxis1, naxis2):
+    '''
+    Return the longitude and latitude of the center and of the four corners
+    of an image, in the native frame of its WCS.
+    '''
+    x = numpy.array([(naxis1 + 1) / 2., 0.5, naxis1 + 0.5, naxis1 + 0.5, 0.5])
+    y = numpy.array([(naxis2 + 1) / 2., 0.5, 0.5, naxis2 + 0.5, naxis2 + 0.5])
+    return wcs.wcs_pix2world(x, y, 1)
+
+
+def _to_equatorial(lon, lat, frames):
+    '''
+    Convert positions given in a variety of celestial frames to Equatorial
+    J2000 coordinates. Positions are converted in groups sharing the same
+    frame.
+    '''
+
+    from astropy.coordinates import SkyCoord, FK5, ICRS
+
+    fk5 = FK5(equinox='J2000')
+
+    ra = numpy.array(lon, dtype=float)
+    dec = numpy.array(lat, dtype=float)
+
+    groups = {}
+    for index, frame in enumerate(frames):
+        groups.setdefault(repr(frame), (frame, []))[1].append(index)
+
+    for frame, indices in groups.values():
+        if isinstance(frame, ICRS) or (isinstance(frame, FK5) and
+                                       frame.is_equivalent_frame(fk5)):
+            continue
+        coords = SkyCoord(ra[indices], dec[indices], unit='deg',
+                          frame=frame).transform_to(fk5)
+        ra[indices] = coords.ra.degree
+        dec[indices] = coords.dec.degree
+
+    return ra, dec
+
+
+def _read_fieldlist(fieldlist):
+    fields = []
+    with open(fieldlist, 'r') as f:
+        for line in f:
+            if not line.strip() or line.startswith(('#', '|', '\\')):
+                continue
+            keyword, column_type = line.split()[:2]
+            fields.append((keyword.upper(), column_type.lower()))
+    return fields
+
+
+def _file_metadata(directory, filenames, fields, n_workers=16):
+    '''
+    Read the headers of a set of files and compute the image table rows for
+    each of them.
+
+    Returns a dictionary giving for each filename a tuple of the number of
+    HDUs without a valid celestial WCS and the list of rows (one per valid
+    image HDU), or `None` if the file could not be read. Positions are
+    converted to Equatorial J2000 for all files at once.
+    '''
+
+    from astropy.wcs.utils import wcs_to_celestial_frame
+
+    paths = [os.path.join(directory, filename) for filename in filenames]
+
+    if n_workers and n_workers > 1 and len(paths) > 1:
+        pool = ThreadPool(min(n_workers, len(paths)))
+        try:
+            all_headers = pool.map(_read_headers, paths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        all_headers = [_read_headers(path) for path in paths]
+
+    results = {}
+    rows = []
+    lon, lat, frames = [], [], []
+
+    for filename, path, headers in zip(filenames, paths, all_headers):
+
+        if headers is None:
+            results[filename] = None
+            continue
+
+        badwcs = 0
+        file_rows = []
+
+        for hdu, header in headers:
+
+            try:
+                wcs = WCS(header).celestial
+                if wcs.naxis != 2:
+                    raise ValueError("no celestial axes")
+                frame = wcs_to_celestial_frame(wcs)
+                positions = _sky_positions(wcs, header['NAXIS1'], header['NAXIS2'])
+            except Exception:
+                badwcs += 1
+                continue
+
+            cdelt1, cdelt2, crota2 = _cdelt_crota(wcs)
+
+            row = {'naxis1': int(header['NAXIS1']),
+                   'naxis2': int(header['NAXIS2']),
+                   'ctype1': wcs.wcs.ctype[0],
+                   'ctype2': wcs.wcs.ctype[1],
+                   'equinox': float(header.get('EQUINOX', header.get('EPOCH', 2000.))),
+                   'crval1': float(wcs.wcs.crval[0]),
+                   'crval2': float(wcs.wcs.crval[1]),
+                   'crpix1': float(wcs.wcs.crpix[0]),
+                   'crpix2': float(wcs.wcs.crpix[1]),
+                   'cdelt1': float(cdelt1),
+                   'cdelt2': float(cdelt2),
+                   'crota2': float(crota2),
+                   'hdu': hdu,
+                   'size': os.path.getsize(path),
+                   'fname': filename}
+
+            for keyword, column_type in fields:
+                value = header.get(keyword)
+                if value is not None:
+                    value = FIELDLIST_TYPES.get(column_type, str)(value)
+                row[keyword.lower()] = value
+
+            file_rows.append(row)
+            rows.append(row)
+            lon.append(positions[0])
+            lat.append(positions[1])
+            frames.append(frame)
+
+        results[filename] = (badwcs, file_rows)
+
+    if rows:
+        ra, dec = _to_equatorial(numpy.array(lon).ravel(),
+                                 numpy.array(lat).ravel(),
+                                 numpy.repeat(frames, 5))
+        ra = ra.reshape(len(rows), 5)
+        dec = dec.reshape(len(rows), 5)
+        for i, row in enumerate(rows):
+            row['ra'] = float(ra[i, 0])
+            row['dec'] = float(dec[i, 0])
+            for j in range(4):
+                row[CORNER_COLUMNS[2 * j]] = float(ra[i, j + 1])
+                row[CORNER_COLUMNS[2 * j + 1]] = float(dec[i, j + 1])
+
+    return results
+
+
+def _write_table(rows, images_table, corners=False, fields=[]):
+    '''
+    Write image table rows to an IPAC table in the format used by mImgtbl.
+    '''
+
+    from astropy.coordinates import Angle
+
+    table = Table()
+    table.meta['keywords'] = {'datatype': {'value': 'fitshdr'}}
+
+    ra = numpy.array([row['ra'] for row in rows], dtype=float)
+    dec = numpy.array([row['dec'] for row in rows], dtype=float)
+
+    table['cntr'] = numpy.arange(len(rows), dtype=numpy.int32)
+    table['ra'] = ra
+    table['dec'] = dec
+    table['cra'] = Angle(ra, unit='deg').to_string(unit='hour', sep='hms',
+                                                   precision=2, pad=True)
+    table['cdec'] = Angle(dec, unit='deg').to_string(unit='deg', sep='dms',
+                                                     precision=1, pad=True,
+                                                     alwayssign=True)
+    table['naxis1'] = numpy.array([row['naxis1'] for row in rows], dtype=numpy.int32)
+    table['naxis2'] = numpy.array([row['naxis2'] for row in rows], dtype=numpy.int32)
+
+    for column in WCS_COLUMNS:
+        table[column] = [row[column] for row in rows]
+
+    if corners:
+        for column in CORNER_COLUMNS:
+            table[column] = numpy.array([row[column] for row in rows], dtype=float)
+
+    for keyword, column_type in fields:
+        values = [row.get(keyword.lower()) for row in rows]
+        mask = [value is None for value in values]
+        default = FIELDLIST_TYPES.get(column_type, str)()
+        table[keyword.lower()] = MaskedColumn([default if value is None else value
+                                               for value in values], mask=mask)
+
+    table['hdu'] = numpy.array([row['hdu'] for row in rows], dtype=numpy.int32)
+    table['size'] = numpy.array([row['size'] for row in rows], dtype=numpy.int64)
+    table['fname'] = [row['fname'] for row in rows]
+
+    with open(images_table, 'w') as f:
+        table.write(f, format='ascii.ipac')
+
+
+class MetadataIndex(object):
+    '''
+    A persistent index of image metadata, stored in an SQLite database.
+
+    The image table rows for each file are stored along with the size and
+    modification time of the file, so that when the index is updated, only
+    the headers of files that are new or have changed need to be read.
+    Files are identified by their absolute path (with symbolic links
+    resolved), so the same index can be used for several directories.
+
+    Parameters
+    ----------
+    filename : str
+        The SQLite database file (created if it does not exist).
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS files "
+                                     "(path TEXT PRIMARY KEY, size INTEGER, "
+                                     "mtime REAL, badwcs INTEGER, rows TEXT)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS settings "
+                                     "(name TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _check_fields(self, fields):
+        # Cached rows only include the fieldlist keywords that were requested
+        # when they were read, so the index is reset if these change.
+        value = json.dumps(fields)
+        previous = self._connection.execute("SELECT value FROM settings "
+                                            "WHERE name='fields'").fetchone()
+        if previous is None or previous[0] != value:
+            with self._connection:
+                self._connection.execute("DELETE FROM files")
+                self._connection.execute("INSERT OR REPLACE INTO settings "
+                                         "VALUES ('fields', ?)", (value,))
+
+    def update(self, directory, filenames, fields=[], n_workers=16):
+        '''
+        Update the index for the given files (relative to ``directory``), and
+        return a dictionary giving the cached metadata for each of them (see
+        ``_file_metadata``).
+
+        Entries for files in ``directory`` that no longer exist are removed.
+        '''
+
+        fields = [list(field) for field in fields]
+        self._check_fields(fields)
+
+        root = os.path.realpath(directory)
+        paths = dict((filename, os.path.realpath(os.path.join(directory, filename)))
+                     for filename in filenames)
+
+        cached = {}
+        for path, size, mtime, badwcs, rows in self._connection.execute(
+                "SELECT path, size, mtime, badwcs, rows FROM files"):
+            cached[path] = (size, mtime, badwcs, rows)
+
+        results = {}
+        stats = {}
+        changed = []
+
+        for filename in filenames:
+            path = paths[filename]
+            try:
+                stat = os.stat(path)
+            except OSError:
+                results[filename] = None
+                continue
+            stats[filename] = (stat.st_size, stat.st_mtime)
+            if path in cached and cached[path][:2] == stats[filename]:
+                size, mtime, badwcs, rows = cached[path]
+                if rows is None:
+                    results[filename] = None
+                else:
+                    # The file may have been indexed under a different name
+                    # relative to the directory that was scanned
+                    rows = json.loads(rows)
+                    for row in rows:
+                        row['fname'] = filename
+                    results[filename] = (badwcs, rows)
+            else:
+                changed.append(filename)
+
+        log.info("Reading headers for %i new or modified files" % len(changed))
+
+        new = _file_metadata(directory, changed, fields, n_workers=n_workers)
+
+        # Only entries for files in the scanned directory can be removed,
+        # since other entries may belong to other directories
+        scanned = set(paths.values())
+        removed = [(path,) for path in cached
+                   if path not in scanned and
+                   path.startswith(os.path.join(root, '')) and
+                   not os.path.exists(path)]
+
+        with self._connection:
+            for filename in changed:
+                size, mtime = stats[filename]
+                if new[filename] is None:
+                    badwcs, rows = 0, None
+                else:
+                    badwcs, rows = new[filename][0], json.dumps(new[filename][1])
+                self._connection.execute("INSERT OR REPLACE INTO files "
+                                         "VALUES (?, ?, ?, ?, ?)",
+                                         (paths[filename], size, mtime, badwcs, rows))
+            self._connection.executemany("DELETE FROM files WHERE path=?",
+                                         removed)
+
+        results.update(new)
+
+        return results
+
+
+def build_image_table(directory, images_table, recursive=False, corners=False,
+                      include_area=False, fieldlist=None, img_list=None,
+                      n_workers=16, index=None):
+    '''
+    Build an image metadata table, in the same format as mImgtbl.
+
+    Only the headers of the files are read, using a pool of threads, and the
+    positions of the image centers and corners are computed using
+    :mod:`astropy.wcs`.
+
+    Parameters
+    ----------
+
+    directory : str
+        Path to directory containing set of input FITS files.
+
+    images_table : str
+        Path of output metadata table.
+
+    recursive : bool, optional
+        Search the given directory and all its subdirectories recursively.
+
+    corners : bool, optional
+        Add the RA, Dec coordinates (ra1, dec1, ... ra4, dec4) of the image
+        corners to the table. As for mImgtbl, these are always Equatorial
+        J2000.
+
+    include_area : bool, optional
+        By default, files with names ending in _area (assumed to be
+        Montage-created area images) are ignored. Set this to include them.
+
+    fieldlist : str, optional
+        File listing additional keywords to be read from the FITS headers and
+        included in the output table, with one keyword and type (int, char,
+        double) per line.
+
+    img_list : str, optional
+        Table with a ``fname`` column listing the files to process, relative
+        to ``directory``. Any other files in the directory are ignored.
+
+    n_workers : int, optional
+        Number of threads to use to read the headers.
+
+    index : str, optional
+        Path to an SQLite database in which to keep the metadata of each file
+        (see :class:`MetadataIndex`). If set, only the headers of files that
+        are not in the index, or whose size or modification time changed,
+        are read.
+
+    Returns
+    -------
+    result : :class:`~montage_wrapper.status.Struct`
+        Status containing the number of images in the table (``count``), and
+        the number of files that could not be read (``badfits``) or did not
+        have a valid celestial WCS (``badwcs``).
+    '''
+
+    filenames = _list_files(directory, recursive=recursive,
+                            include_area=include_area, img_list=img_list)
+
+    fields = _read_fieldlist(fieldlist) if fieldlist else []
+
+    if index is None:
+        results = _file_metadata(directory, filenames, fields,
+                                 n_workers=n_workers)
+    else:
+        with MetadataIndex(index) as metadata_index:
+            results = metadata_index.update(directory, filenames, fields,
+                                            n_workers=n_workers)
+
+    rows = []
+    badfits = badwcs = 0
+
+    for filename in filenames:
+        if results[filename] is None:
+            badfits += 1
+        else:
+            badwcs += results[filename][0]
+            rows.extend(results[filename][1])
+
+    _write_table(rows, images_table, corners=corners, fields=fields)
+
+    return status.Struct("build_image_table",
+                         '[struct stat="OK", count=%i, badfits=%i, badwcs=%i]'
+                         % (len(rows), badfits, badwcs))
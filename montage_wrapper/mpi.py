@@ -1,3 +1,5 @@
+import shlex
+
 MPI_COMMAND = 'mpirun -n {n_proc} {executable}'
 
 def set_mpi_command(command):
@@ -31,4 +33,4 @@ def set_mpi_command(command):
     MPI_COMMAND = command
     
 def _get_mpi_command(executable=None, n_proc=None):
-    return MPI_COMMAND.format(executable=executable, n_proc=n_proc)
\ No newline at end of file
+    return shlex.split(MPI_COMMAND.format(executable=executable, n_proc=n_proc))
@@ -0,0 +1,235 @@
+"""
+Run the Montage executives in parallel on a single machine, without MPI.
+
+The input table is split into shards, the serial version of the executive is
+run on each shard in a separate process, with at most ``n_proc`` processes
+running at any time, and the output tables are then merged. This gives the
+same results as the MPI versions of the executives, which also split the
+work by rows of the input table.
+"""
+
+import os
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+from astropy.table import Table, vstack
+
+from . import commands as m
+from . import status
+
+__all__ = ['mProjExec', 'mDiffExec', 'mFitExec', 'mDiffFitExec', 'mBgExec']
+
+# Number of shards to create for each process, so that the load stays
+# balanced when some rows take longer to process than others
+SHARDS_PER_PROCESS = 4
+
+
+def _read_table_lines(table):
+    '''
+    Split the lines of an IPAC table into header and data lines.
+    '''
+    with open(table, 'r') as f:
+        lines = f.readlines()
+    header = []
+    for line in lines:
+        if line.startswith(('\\', '|')):
+            header.append(line)
+        else:
+            break
+    data = [line for line in lines[len(header):] if line.strip()]
+    return header, data
+
+
+def _split_table(table, n_shards, shard_dir, start=0):
+    '''
+    Split the rows of an IPAC table into at most ``n_shards`` contiguous
+    shards, ignoring the first ``start`` rows. The lines are copied as-is, so
+    that the shards have exactly the same format as the input table.
+    '''
+    header, data = _read_table_lines(table)
+    data = data[start:]
+    n_shards = max(min(n_shards, len(data)), 1)
+    shards = []
+    for i in range(n_shards):
+        shard = os.path.join(shard_dir, 'shard_%04i.tbl' % i)
+        with open(shard, 'w') as f:
+            f.writelines(header)
+            f.writelines(data[i * len(data) // n_shards:(i + 1) * len(data) // n_shards])
+        shards.append(shard)
+    return shards
+
+
+def _merge_tables(tables, out_table):
+    '''
+    Merge the output tables for all shards, in order. Montage writes the
+    same column layout for all the shards, in which case the data lines are
+    simply concatenated.
+    '''
+
+    tables = [table for table in tables if os.path.exists(table)]
+
+    if len(tables) == 0:
+        return
+
+    headers, data = zip(*[_read_table_lines(table) for table in tables])
+
+    if all(header == headers[0] for header in headers):
+        with open(out_table, 'w') as f:
+            f.writelines(headers[0])
+            for lines in data:
+                f.writelines(lines)
+    else:
+        merged = vstack([Table.read(table, format='ascii.ipac')
+                         for table, lines in zip(tables, data) if lines])
+        with open(out_table, 'w') as f:
+            merged.write(f, format='ascii.ipac')
+
+
+def _merge_status(command, results):
+    '''
+    Combine the status of the executive for each shard, adding up counts.
+    '''
+
+    values = {}
+    stat = 'OK'
+    for result in results:
+        for key, value in result.__dict__.items():
+            if key == 'stat':
+                if value == 'WARNING':
+                    stat = value
+            elif isinstance(value, (int, float)) and key in values:
+                values[key] += value
+            elif key not in values:
+                values[key] = value
+
+    values['stat'] = stat
+
+    return status.make_struct(command, values)
+
+
+def _run_sharded(command, function, in_table, out_table, n_proc,
+                 restart_rec=None):
+    '''
+    Run ``function(shard_table, shard_out_table)`` on shards of ``in_table``
+    with ``n_proc`` concurrent processes, and merge the outputs into
+    ``out_table`` (if not `None`).
+    '''
+
+    out_dir = os.path.dirname(os.path.abspath(out_table or in_table))
+    shard_dir = tempfile.mkdtemp(prefix='shards_', dir=out_dir)
+
+    try:
+
+        shards = _split_table(in_table, SHARDS_PER_PROCESS * n_proc, shard_dir,
+                              start=restart_rec or 0)
+        out_shards = [shard.replace('.tbl', '_out.tbl') for shard in shards]
+
+        def run_shard(i):
+            return function(shards[i], out_shards[i])
+
+        pool = ThreadPool(n_proc)
+        try:
+            results = pool.map(run_shard, range(len(shards)))
+        finally:
+            pool.close()
+            pool.join()
+
+        if out_table is not None:
+            _merge_tables(out_shards, out_table)
+
+    finally:
+        shutil.rmtree(shard_dir)
+
+    return _merge_status(command, [result for result in results if result is not None])
+
+
+def mProjExec(images_table, template_header, proj_dir, stats_table,
+              n_proc=8, restart_rec=None, **kwargs):
+    '''
+    Run mProjExec on shards of the image table in parallel processes.
+
+    Parameters
+    ----------
+    n_proc : int, optional
+        The number of processes to run simultaneously (default is 8)
+
+    All other arguments are the same as for
+    :func:`~montage_wrapper.commands.mProjExec`. The stats tables for all
+    shards are merged into ``stats_table``.
+    '''
+    def run(shard, shard_stats):
+        return m.mProjExec(shard, template_header, proj_dir, shard_stats,
+                           **kwargs)
+    return _run_sharded("mProjExec", run, images_table, stats_table, n_proc,
+                        restart_rec=restart_rec)
+
+
+def mDiffExec(diffs_table, template_header, diff_dir, n_proc=8, **kwargs):
+    '''
+    Run mDiffExec on shards of the diffs table in parallel processes.
+
+    Parameters
+    ----------
+    n_proc : int, optional
+        The number of processes to run simultaneously (default is 8)
+
+    All other arguments are the same as for
+    :func:`~montage_wrapper.commands.mDiffExec`.
+    '''
+    def run(shard, shard_out):
+        return m.mDiffExec(shard, template_header, diff_dir, **kwargs)
+    return _run_sharded("mDiffExec", run, diffs_table, None, n_proc)
+
+
+def mFitExec(diffs_table, fits_table, diff_dir, n_proc=8, **kwargs):
+    '''
+    Run mFitExec on shards of the diffs table in parallel processes.
+
+    Parameters
+    ----------
+    n_proc : int, optional
+        The number of processes to run simultaneously (default is 8)
+
+    All other arguments are the same as for
+    :func:`~montage_wrapper.commands.mFitExec`. The fits tables for all
+    shards are merged into ``fits_table``.
+    '''
+    def run(shard, shard_fits):
+        return m.mFitExec(shard, shard_fits, diff_dir, **kwargs)
+    return _run_sharded("mFitExec", run, diffs_table, fits_table, n_proc)
+
+
+def mDiffFitExec(diffs_table, fits_table, diff_dir, n_proc=8, **kwargs):
+    '''
+    Run mDiffFitExec on shards of the diffs table in parallel processes.
+
+    Parameters
+    ----------
+    n_proc : int, optional
+        The number of processes to run simultaneously (default is 8)
+
+    All other arguments are the same as for
+    :func:`~montage_wrapper.commands.mDiffFitExec`. The fits tables for all
+    shards are merged into ``fits_table``.
+    '''
+    def run(shard, shard_fits):
+        return m.mDiffFitExec(shard, shard_fits, diff_dir, **kwargs)
+    return _run_sharded("mDiffFitExec", run, diffs_table, fits_table, n_proc)
+
+
+def mBgExec(images_table, corrections_table, corr_dir, n_proc=8, **kwargs):
+    '''
+    Run mBgExec on shards of the image table in parallel processes.
+
+    Parameters
+    ----------
+    n_proc : int, optional
+        The number of processes to run simultaneously (default is 8)
+
+    All other arguments are the same as for
+    :func:`~montage_wrapper.commands.mBgExec`.
+    '''
+    def run(shard, shard_out):
+        return m.mBgExec(shard, corrections_table, corr_dir, **kwargs)
+    return _run_sharded("mBgExec", run, images_table, None, n_proc)
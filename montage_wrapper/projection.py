@@ -0,0 +1,243 @@
+"""
+Reprojection of images in Python using precomputed pixel overlap weights.
+
+Computing the overlap between input and output pixels is the expensive part
+of reprojecting an image, but for images that share the same WCS (e.g. the
+planes of a cube), it only needs to be done once. The weights computed by
+:func:`projection_weights` can then be applied to each image with
+:func:`apply_projection_weights`, which only requires two sparse
+matrix-vector products.
+
+As for mProjectPP, the overlap between pixels is computed in the pixel
+plane of the output image, where input pixels are approximated by
+quadrilaterals. Output pixel values are the mean of the overlapping input
+pixel values, weighted by the overlap areas, ignoring NaN values.
+"""
+
+import numpy
+
+from astropy.wcs import WCS
+
+__all__ = ['projection_weights', 'apply_projection_weights']
+
+# Number of input pixels to process at a time when computing the weights
+CHUNK_SIZE = 65536
+
+# Overlap areas (in output pixels) below which pixels are considered not to
+# overlap, to avoid spurious overlaps due to rounding errors
+AREA_THRESHOLD = 1e-8
+
+
+def _ramp_integral(u):
+    # Integral of max(u, 0)
+    u = numpy.maximum(u, 0.)
+    return 0.5 * u * u
+
+
+def _overlap_area(polygons, xmin, ymin):
+    '''
+    Compute the area of the intersection of polygons, given as an (N, M, 2)
+    array of vertices, with the unit squares whose lower left corners are
+    given by ``xmin`` and ``ymin``.
+
+    The area is computed by integrating the polygon outline along x, with y
+    clipped to the extent of the square, which avoids having to construct
+    the intersection polygons.
+    '''
+
+    xmin = xmin[:, numpy.newaxis]
+    ymin = ymin[:, numpy.newaxis]
+
+    x0 = polygons[:, :, 0]
+    y0 = polygons[:, :, 1]
+    x1 = numpy.roll(x0, -1, axis=1)
+    y1 = numpy.roll(y0, -1, axis=1)
+
+    # Slope of each edge (vertical edges do not contribute to the integral)
+    dx = x1 - x0
+    vertical = dx == 0.
+    slope = (y1 - y0) / numpy.where(vertical, 1., dx)
+    slope[vertical] = 0.
+
+    # Clip the edges to the extent of the square along x
+    xa = numpy.clip(x0, xmin, xmin + 1.)
+    xb = numpy.clip(x1, xmin, xmin + 1.)
+    ua = y0 + (xa - x0) * slope - ymin
+    ub = y0 + (xb - x0) * slope - ymin
+
+    # Mean value of the edge, clipped to [0, 1] along y, over [xa, xb]
+    du = ub - ua
+    flat = numpy.abs(du) < 1e-10
+    du_safe = numpy.where(flat, 1., du)
+    mean = (_ramp_integral(ub) - _ramp_integral(ua) -
+            _ramp_integral(ub - 1.) + _ramp_integral(ua - 1.)) / du_safe
+    mean_flat = numpy.clip(0.5 * (ua + ub), 0., 1.)
+    mean = numpy.where(flat, mean_flat, mean)
+
+    return numpy.abs(numpy.sum((xb - xa) * mean, axis=1))
+
+
+def _corners_in_output(wcs_in, wcs_out, shape_in, factor):
+    '''
+    Find the position of the corners of all input pixels in the output pixel
+    frame, as an (ny + 1, nx + 1, 2) array (or (ny, nx, 4, 2) if a drizzle
+    factor is used, since pixels then no longer share corners).
+    '''
+
+    from astropy.coordinates import SkyCoord
+    from astropy.wcs.utils import wcs_to_celestial_frame
+
+    ny, nx = shape_in
+
+    if factor is None:
+        x = numpy.arange(nx + 1) - 0.5
+        y = numpy.arange(ny + 1) - 0.5
+        x, y = numpy.meshgrid(x, y)
+    else:
+        yc, xc = numpy.mgrid[:ny, :nx]
+        offsets = 0.5 * factor * numpy.array([-1., 1., 1., -1.])
+        x = xc[:, :, numpy.newaxis] + offsets[numpy.newaxis, numpy.newaxis, :]
+        y = yc[:, :, numpy.newaxis] + numpy.roll(offsets, 1)[numpy.newaxis, numpy.newaxis, :]
+
+    lon, lat = wcs_in.wcs_pix2world(x, y, 0)
+
+    frame_in = wcs_to_celestial_frame(wcs_in)
+    frame_out = wcs_to_celestial_frame(wcs_out)
+    if not frame_in.is_equivalent_frame(frame_out):
+        coords = SkyCoord(lon, lat, unit='deg', frame=frame_in).transform_to(frame_out)
+        lon = coords.spherical.lon.degree
+        lat = coords.spherical.lat.degree
+
+    with numpy.errstate(invalid='ignore'):
+        xo, yo = wcs_out.wcs_world2pix(lon, lat, 0)
+
+    return numpy.concatenate([xo[..., numpy.newaxis], yo[..., numpy.newaxis]],
+                             axis=-1)
+
+
+def projection_weights(header_in, header_out, factor=None):
+    '''
+    Compute the overlap weights between the pixels of an input and output
+    image.
+
+    This requires scipy to be installed.
+
+    Parameters
+    ----------
+    header_in : :class:`~astropy.io.fits.Header`
+        Header of the input image. Only the celestial axes are used, so this
+        can also be the header of a cube.
+    header_out : :class:`~astropy.io.fits.Header`
+        Header of the output image.
+    factor : float, optional
+        Drizzle factor (see `~montage_wrapper.commands.mProject`)
+
+    Returns
+    -------
+    weights : `scipy.sparse.csr_matrix`
+        Sparse matrix with one row per output pixel and one column per input
+        pixel, giving the overlap area of the pixels in units of output
+        pixels.
+    '''
+
+    try:
+        from scipy import sparse
+    except ImportError:
+        raise ImportError("scipy is required to compute projection weights")
+
+    wcs_in = WCS(header_in).celestial
+    wcs_out = WCS(header_out).celestial
+
+    shape_in = (header_in['NAXIS2'], header_in['NAXIS1'])
+    shape_out = (header_out['NAXIS2'], header_out['NAXIS1'])
+    ny_out, nx_out = shape_out
+
+    corners = _corners_in_output(wcs_in, wcs_out, shape_in, factor)
+
+    if factor is None:
+        quads = numpy.concatenate([corners[:-1, :-1, numpy.newaxis],
+                                   corners[:-1, 1:, numpy.newaxis],
+                                   corners[1:, 1:, numpy.newaxis],
+                                   corners[1:, :-1, numpy.newaxis]], axis=2)
+    else:
+        quads = corners
+
+    quads = quads.reshape(-1, 4, 2)
+
+    rows, cols, values = [], [], []
+
+    for start in range(0, len(quads), CHUNK_SIZE):
+
+        quad = quads[start:start + CHUNK_SIZE]
+        index_in = numpy.arange(start, start + len(quad))
+
+        # Ignore input pixels that do not fall on the output projection
+        valid = numpy.all(numpy.isfinite(quad), axis=(1, 2))
+        quad = quad[valid]
+        index_in = index_in[valid]
+
+        # Range of output pixels overlapping the bounding box of each quad
+        xmin = numpy.clip(numpy.floor(quad[:, :, 0].min(axis=1) + 0.5), 0, nx_out).astype(int)
+        xmax = numpy.clip(numpy.floor(quad[:, :, 0].max(axis=1) + 0.5), -1, nx_out - 1).astype(int)
+        ymin = numpy.clip(numpy.floor(quad[:, :, 1].min(axis=1) + 0.5), 0, ny_out).astype(int)
+        ymax = numpy.clip(numpy.floor(quad[:, :, 1].max(axis=1) + 0.5), -1, ny_out - 1).astype(int)
+
+        width = numpy.maximum(xmax - xmin + 1, 0)
+        height = numpy.maximum(ymax - ymin + 1, 0)
+        n_candidates = width * height
+
+        # Expand into (input pixel, output pixel) candidate pairs
+        pair = numpy.repeat(numpy.arange(len(quad)), n_candidates)
+        if len(pair) == 0:
+            continue
+        offset = numpy.arange(len(pair)) - numpy.repeat(numpy.cumsum(n_candidates) - n_candidates, n_candidates)
+        xo = xmin[pair] + offset % width[pair]
+        yo = ymin[pair] + offset // width[pair]
+
+        area = _overlap_area(quad[pair], xo - 0.5, yo - 0.5)
+
+        keep = area > AREA_THRESHOLD
+        rows.append(yo[keep] * nx_out + xo[keep])
+        cols.append(index_in[pair[keep]])
+        values.append(area[keep])
+
+    if rows:
+        rows = numpy.concatenate(rows)
+        cols = numpy.concatenate(cols)
+        values = numpy.concatenate(values)
+
+    return sparse.csr_matrix((values, (rows, cols)),
+                             shape=(ny_out * nx_out, shape_in[0] * shape_in[1]))
+
+
+def apply_projection_weights(weights, data, shape_out):
+    '''
+    Reproject an image using weights computed by :func:`projection_weights`.
+
+    Parameters
+    ----------
+    weights : `scipy.sparse.csr_matrix`
+        The overlap weights between input and output pixels.
+    data : `numpy.ndarray`
+        The input image.
+    shape_out : tuple
+        The shape of the output image.
+
+    Returns
+    -------
+    data_out : `numpy.ndarray`
+        The reprojected image, with NaN values for pixels that do not
+        overlap any valid input pixels.
+    '''
+
+    data = numpy.asarray(data, dtype=float).ravel()
+    valid = numpy.isfinite(data)
+
+    total = weights.dot(numpy.where(valid, data, 0.))
+    norm = weights.dot(valid.astype(float))
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        data_out = total / norm
+    data_out[norm == 0.] = numpy.nan
+
+    return data_out.reshape(shape_out)
@@ -0,0 +1,96 @@
+from __future__ import print_function
+
+import subprocess
+import threading
+import time
+
+from astropy import log
+
+from . import status
+
+_state = threading.local()
+
+
+def execute(command):
+    '''
+    Run a command and wait for it to finish.
+
+    Both output streams are read concurrently, so commands that write a lot
+    to stdout or stderr (e.g. in debug mode) cannot block on a full pipe.
+
+    Parameters
+    ----------
+    command : list
+        The command to run, as a list of arguments.
+
+    Returns
+    -------
+    stdout, stderr : bytes
+        The output of the command.
+    returncode : int
+        The exit code of the command.
+    '''
+    p = subprocess.Popen(command, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    return stdout, stderr, p.returncode
+
+
+def check_output(name, stdout, stderr, returncode):
+    '''
+    Convert the output of a Montage command to a
+    :class:`~montage_wrapper.status.Struct`, raising an exception if the
+    command failed.
+    '''
+    if stderr:
+        raise Exception(stderr)
+    result = status.parse_struct(name, stdout.strip())
+    if result is None and returncode != 0:
+        raise status.MontageError("%s: exited with code %i" % (name, returncode))
+    return result
+
+
+def run(name, command):
+    '''
+    Run a Montage command and parse its output.
+
+    Parameters
+    ----------
+    name : str
+        The name of the Montage command, used in error messages.
+    command : list
+        The command to run, as a list of arguments.
+
+    Returns
+    -------
+    result : :class:`~montage_wrapper.status.Struct`
+        The status returned by the command.
+    '''
+    if getattr(_state, 'build_only', False):
+        return name, command
+    start = time.time()
+    stdout, stderr, returncode = execute(command)
+    log.debug("%s exited with code %i after %.2fs" % (name, returncode,
+                                                      time.time() - start))
+    return check_output(name, stdout, stderr, returncode)
+
+
+def build(function, *args, **kwargs):
+    '''
+    Return the name and arguments of the Montage command that a wrapper
+    function would run, without running it.
+
+    Parameters
+    ----------
+    function : function
+        One of the command wrappers from :mod:`montage_wrapper.commands`.
+
+    Notes
+    -----
+    Additional arguments are passed to ``function``.
+    '''
+    _state.build_only = True
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _state.build_only = False
@@ -0,0 +1,501 @@
+"""
+In-process spatial index over the footprints of the images in an image table.
+
+This provides the same kind of selection as mSubset, mCoverageCheck, and
+mOverlaps, but the table is only read once, and candidate images are found
+using a k-d tree over the unit vectors of the footprint centers (if scipy is
+installed), so that each query only needs to look at the images in the
+vicinity of the region of interest rather than at the whole table, and
+finding all overlapping pairs of images does not require comparing every
+image with every other one.
+
+Footprints are described by the four corners of the images (from the
+``corners`` option of mImgtbl, or otherwise computed from the WCS columns),
+and are treated as convex spherical polygons with great-circle edges. Regions
+covering a hemisphere or more (such as all-sky headers) can therefore not be
+used for queries.
+"""
+
+import numpy
+
+from astropy.io import fits
+from astropy.table import Table
+from astropy.wcs import WCS
+
+from . import fits_utils
+from . import status
+
+__all__ = ['FootprintIndex', 'RegionTooLargeError']
+
+CORNER_COLUMNS = [('ra1', 'dec1'), ('ra2', 'dec2'), ('ra3', 'dec3'),
+                  ('ra4', 'dec4')]
+
+# Footprints with radii larger than this factor times the median radius are
+# not put in the tree, but are always checked, so that a few very large
+# images do not increase the search radius for all queries.
+LARGE_FOOTPRINT_FACTOR = 10.
+
+# Number of points along each edge of a header used to define its footprint
+HEADER_EDGE_POINTS = 8
+
+# Number of candidate footprints to check at a time for exact overlap
+CHUNK_SIZE = 4096
+
+
+class RegionTooLargeError(ValueError):
+    '''
+    Raised when a query region covers a hemisphere or more, in which case it
+    cannot be treated as a convex polygon.
+    '''
+    pass
+
+
+def _unit_vectors(ra, dec):
+    ra = numpy.radians(ra)
+    dec = numpy.radians(dec)
+    return numpy.stack([numpy.cos(dec) * numpy.cos(ra),
+                        numpy.cos(dec) * numpy.sin(ra),
+                        numpy.sin(dec)], axis=-1)
+
+
+def _angle(a, b):
+    # Angle between unit vectors (in radians), accurate for small angles
+    return numpy.arctan2(numpy.linalg.norm(numpy.cross(a, b), axis=-1),
+                         numpy.sum(a * b, axis=-1))
+
+
+def _bounding_caps(polygons):
+    '''
+    Return the centers (as unit vectors) and the angular radii of caps
+    enclosing polygons given as (N, M, 3) arrays of vertex unit vectors.
+    '''
+    centers = polygons.sum(axis=1)
+    norm = numpy.linalg.norm(centers, axis=-1)
+    centers /= numpy.where(norm > 0, norm, 1.)[:, numpy.newaxis]
+    radii = _angle(polygons, centers[:, numpy.newaxis, :]).max(axis=1)
+    # Vertices spread evenly around the sphere (e.g. the outline of an
+    # all-sky header) do not define a center
+    radii[norm < 1e-10 * polygons.shape[1]] = numpy.pi
+    return centers, radii
+
+
+def _inside(polygons, points):
+    '''
+    Check whether points (N, K, 3) are inside convex polygons (N, M, 3),
+    irrespective of the orientation of the polygons. Returns an (N, K)
+    boolean array.
+    '''
+    normals = numpy.cross(polygons, numpy.roll(polygons, -1, axis=1))
+    side = numpy.einsum('nmi,nki->nkm', normals, points)
+    return numpy.all(side >= 0, axis=-1) | numpy.all(side <= 0, axis=-1)
+
+
+def _on_arc(a, b, normal, points):
+    return ((numpy.sum(numpy.cross(a, points) * normal, axis=-1) >= 0) &
+            (numpy.sum(numpy.cross(points, b) * normal, axis=-1) >= 0))
+
+
+def _edges_cross(polygons_a, polygons_b):
+    '''
+    Check whether any edge of polygons (N, M, 3) crosses any edge of
+    polygons (N, K, 3). Returns an (N,) boolean array.
+    '''
+
+    a0 = polygons_a[:, :, numpy.newaxis, :]
+    a1 = numpy.roll(polygons_a, -1, axis=1)[:, :, numpy.newaxis, :]
+    b0 = polygons_b[:, numpy.newaxis, :, :]
+    b1 = numpy.roll(polygons_b, -1, axis=1)[:, numpy.newaxis, :, :]
+
+    na = numpy.cross(a0, a1)
+    nb = numpy.cross(b0, b1)
+
+    # The great circles intersect at +/- t
+    t = numpy.cross(na, nb)
+    norm = numpy.linalg.norm(t, axis=-1)
+    valid = norm > 1e-15
+    t = t / numpy.where(valid, norm, 1.)[..., numpy.newaxis]
+
+    cross = numpy.zeros(valid.shape, dtype=bool)
+    for sign in (1., -1.):
+        p = sign * t
+        cross |= _on_arc(a0, a1, na, p) & _on_arc(b0, b1, nb, p)
+
+    return numpy.any(cross & valid, axis=(1, 2))
+
+
+def _polygons_overlap(polygons, region):
+    '''
+    Check whether convex polygons (N, M, 3) overlap the convex region
+    (K, 3), or pairwise with the convex regions (N, K, 3). Returns an (N,)
+    boolean array.
+    '''
+    overlap = numpy.zeros(len(polygons), dtype=bool)
+    for start in range(0, len(polygons), CHUNK_SIZE):
+        chunk = polygons[start:start + CHUNK_SIZE]
+        if region.ndim == 2:
+            chunk_region = numpy.broadcast_to(region, (len(chunk),) + region.shape)
+        else:
+            chunk_region = region[start:start + CHUNK_SIZE]
+        chunk_overlap = (numpy.any(_inside(chunk_region, chunk), axis=1) |
+                         numpy.any(_inside(chunk, chunk_region), axis=1))
+        # Edges only need to be checked if no vertex is inside the other polygon
+        undecided = ~chunk_overlap
+        chunk_overlap[undecided] = _edges_cross(chunk[undecided],
+                                                chunk_region[undecided])
+        overlap[start:start + CHUNK_SIZE] = chunk_overlap
+    return overlap
+
+
+def _arc_distance(a, b, point):
+    '''
+    Return the angular distance from a point (3,) to the great-circle arcs
+    going from a to b (both (..., 3)).
+    '''
+    normal = numpy.cross(a, b)
+    normal /= numpy.linalg.norm(normal, axis=-1)[..., numpy.newaxis]
+    # Closest point on the great circle
+    projected = point - numpy.sum(point * normal, axis=-1)[..., numpy.newaxis] * normal
+    norm = numpy.linalg.norm(projected, axis=-1)
+    projected /= numpy.where(norm > 0, norm, 1.)[..., numpy.newaxis]
+    distance = numpy.minimum(_angle(a, point), _angle(b, point))
+    on_arc = _on_arc(a, b, normal, projected) & (norm > 0)
+    return numpy.where(on_arc, _angle(projected, point), distance)
+
+
+def _box_polygon(ra, dec, width, height=None, rotation=0.):
+    '''
+    Return the corners of a box defined in the plane tangent to the sky at
+    (ra, dec), with the rotation measured from North to East.
+    '''
+
+    if height is None:
+        height = width
+
+    xi = 0.5 * numpy.radians(width) * numpy.array([1., -1., -1., 1.])
+    eta = 0.5 * numpy.radians(height) * numpy.array([-1., -1., 1., 1.])
+
+    theta = numpy.radians(rotation)
+    xi, eta = (xi * numpy.cos(theta) + eta * numpy.sin(theta),
+               -xi * numpy.sin(theta) + eta * numpy.cos(theta))
+
+    ra0 = numpy.radians(ra)
+    dec0 = numpy.radians(dec)
+
+    denom = numpy.cos(dec0) - eta * numpy.sin(dec0)
+    ra_corners = ra0 + numpy.arctan2(xi, denom)
+    dec_corners = numpy.arctan2(numpy.sin(dec0) + eta * numpy.cos(dec0),
+                                numpy.hypot(xi, denom))
+
+    return list(zip(numpy.degrees(ra_corners), numpy.degrees(dec_corners)))
+
+
+def _header_polygon(header):
+    '''
+    Return the outline of the area covered by a header, in Equatorial J2000
+    coordinates, sampled at several points along each edge.
+    '''
+
+    from astropy.coordinates import SkyCoord, FK5
+    from astropy.wcs.utils import wcs_to_celestial_frame
+
+    if not isinstance(header, fits.Header):
+        header = fits_utils.read_header_file(header)
+
+    wcs = WCS(header).celestial
+    nx, ny = header['NAXIS1'], header['NAXIS2']
+
+    t = numpy.linspace(0., 1., HEADER_EDGE_POINTS, endpoint=False)
+    x = numpy.concatenate([0.5 + nx * t, numpy.repeat(nx + 0.5, len(t)),
+                           nx + 0.5 - nx * t, numpy.repeat(0.5, len(t))])
+    y = numpy.concatenate([numpy.repeat(0.5, len(t)), 0.5 + ny * t,
+                           numpy.repeat(ny + 0.5, len(t)), ny + 0.5 - ny * t])
+
+    lon, lat = wcs.wcs_pix2world(x, y, 1)
+
+    coords = SkyCoord(lon, lat, unit='deg', frame=wcs_to_celestial_frame(wcs))
+    coords = coords.transform_to(FK5(equinox='J2000'))
+
+    return list(zip(coords.ra.degree, coords.dec.degree))
+
+
+def _wcs_corners(table):
+    '''
+    Compute the corners of the images in an image table from the WCS columns
+    (for tables created without the corners option), in Equatorial J2000
+    coordinates.
+    '''
+
+    from astropy.wcs.utils import wcs_to_celestial_frame
+    from .metadata import _to_equatorial
+
+    lon, lat, frames = [], [], []
+
+    for row in table:
+        wcs = WCS(naxis=2)
+        wcs.wcs.ctype = [row['ctype1'].strip(), row['ctype2'].strip()]
+        wcs.wcs.crval = [row['crval1'], row['crval2']]
+        wcs.wcs.crpix = [row['crpix1'], row['crpix2']]
+        wcs.wcs.cdelt = [row['cdelt1'], row['cdelt2']]
+        wcs.wcs.crota = [0., row['crota2']]
+        if 'equinox' in table.colnames:
+            wcs.wcs.equinox = row['equinox']
+        wcs.wcs.set()
+        nx, ny = row['naxis1'], row['naxis2']
+        x = numpy.array([0.5, nx + 0.5, nx + 0.5, 0.5])
+        y = numpy.array([0.5, 0.5, ny + 0.5, ny + 0.5])
+        row_lon, row_lat = wcs.wcs_pix2world(x, y, 1)
+        lon.append(row_lon)
+        lat.append(row_lat)
+        frames.append(wcs_to_celestial_frame(wcs))
+
+    if len(lon) == 0:
+        return numpy.zeros((0, 4)), numpy.zeros((0, 4))
+
+    ra, dec = _to_equatorial(numpy.array(lon).ravel(), numpy.array(lat).ravel(),
+                             numpy.repeat(frames, 4))
+
+    return ra.reshape(-1, 4), dec.reshape(-1, 4)
+
+
+class FootprintIndex(object):
+    '''
+    A spatial index over the footprints of the images in an image table.
+
+    Parameters
+    ----------
+    images_table : str or :class:`~astropy.table.Table`
+        Image metadata table. If the table does not include the corners of
+        the images (see the ``corners`` option of
+        :func:`~montage_wrapper.commands.mImgtbl`), these are computed from
+        the WCS columns.
+    '''
+
+    def __init__(self, images_table):
+
+        if isinstance(images_table, Table):
+            self.table = images_table
+        else:
+            self.table = Table.read(images_table, format='ascii.ipac')
+
+        if all(ra_col in self.table.colnames and dec_col in self.table.colnames
+               for ra_col, dec_col in CORNER_COLUMNS):
+            ra = numpy.array([self.table[ra_col] for ra_col, dec_col in CORNER_COLUMNS],
+                             dtype=float).T
+            dec = numpy.array([self.table[dec_col] for ra_col, dec_col in CORNER_COLUMNS],
+                              dtype=float).T
+        elif 'crval1' in self.table.colnames:
+            ra, dec = _wcs_corners(self.table)
+        else:
+            raise Exception("Image table should include either the image "
+                            "corners or the WCS columns")
+
+        self.polygons = _unit_vectors(ra, dec).reshape(len(self.table), 4, 3)
+
+        self.centers, self.radii = _bounding_caps(self.polygons)
+
+        if len(self.radii) > 0:
+            large = self.radii > LARGE_FOOTPRINT_FACTOR * numpy.median(self.radii)
+        else:
+            large = numpy.zeros(0, dtype=bool)
+        self._large = numpy.nonzero(large)[0]
+        self._small = numpy.nonzero(~large)[0]
+        self._max_radius = self.radii[self._small].max() if len(self._small) > 0 else 0.
+
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            self._tree = None
+        else:
+            self._tree = cKDTree(self.centers[self._small])
+
+    def __len__(self):
+        return len(self.table)
+
+    def _candidates(self, center, radius):
+        '''
+        Return the indices of the footprints whose bounding caps overlap the
+        cap with the given center (unit vector) and angular radius.
+        '''
+
+        search = radius + self._max_radius
+
+        if self._tree is not None and search < numpy.pi:
+            chord = 2. * numpy.sin(0.5 * search)
+            near = self._small[numpy.array(self._tree.query_ball_point(center, chord),
+                                           dtype=int)]
+        else:
+            near = self._small
+
+        candidates = numpy.sort(numpy.concatenate([near, self._large]))
+
+        close = _angle(self.centers[candidates], center) <= self.radii[candidates] + radius
+        return candidates[close]
+
+    def overlaps_polygon(self, polygon):
+        '''
+        Find the images overlapping a convex polygon given as a list of
+        (ra, dec) vertices in degrees.
+
+        Returns
+        -------
+        indices : `numpy.ndarray`
+            The indices of the matching rows in the table.
+
+        Raises
+        ------
+        RegionTooLargeError
+            If the polygon is not contained in a hemisphere.
+        '''
+        ra, dec = numpy.array(polygon, dtype=float).T
+        region = _unit_vectors(ra, dec)
+        center, radius = _bounding_caps(region[numpy.newaxis])
+        # The radius is NaN if some vertices are undefined, for example if the
+        # edges of a header fall outside the valid area of its projection
+        if not radius[0] < 0.5 * numpy.pi:
+            raise RegionTooLargeError("Regions covering a hemisphere or more "
+                                      "are not supported")
+        candidates = self._candidates(center[0], radius[0])
+        if len(candidates) == 0:
+            return candidates
+        return candidates[_polygons_overlap(self.polygons[candidates], region)]
+
+    def overlaps_box(self, ra, dec, width, height=None, rotation=0.):
+        '''
+        Find the images overlapping a box with a given center, width and
+        (optionally) height and rotation, all in degrees, as for
+        :func:`~montage_wrapper.commands_extra.mCoverageCheck`.
+        '''
+        return self.overlaps_polygon(_box_polygon(ra, dec, width,
+                                                  height=height,
+                                                  rotation=rotation))
+
+    def overlaps_circle(self, ra, dec, radius):
+        '''
+        Find the images overlapping a circle with a given center and radius,
+        all in degrees.
+        '''
+        center = _unit_vectors(ra, dec)
+        radius = numpy.radians(radius)
+        candidates = self._candidates(center, radius)
+        if len(candidates) == 0:
+            return candidates
+        polygons = self.polygons[candidates]
+        inside = _inside(polygons, numpy.broadcast_to(center, (len(polygons), 1, 3)))[:, 0]
+        distance = _arc_distance(polygons, numpy.roll(polygons, -1, axis=1),
+                                 center).min(axis=1)
+        return candidates[inside | (distance <= radius)]
+
+    def overlaps_header(self, header):
+        '''
+        Find the images overlapping the area covered by a header, given
+        either as a :class:`~astropy.io.fits.Header` or as the path to a
+        header template file, as for :func:`~montage_wrapper.commands.mSubset`.
+        Headers covering a hemisphere or more (for example all-sky CAR or AIT
+        headers) raise a `RegionTooLargeError`.
+        '''
+        return self.overlaps_polygon(_header_polygon(header))
+
+    def write_subset(self, indices, subset_table):
+        '''
+        Write the rows of the table with the given indices to a new image
+        table, which can be used by the Montage commands in the same way as
+        tables generated by mSubset.
+
+        Returns
+        -------
+        result : :class:`~montage_wrapper.status.Struct`
+            Status with the number of images in the full table (``count``)
+            and in the subset (``nmatches``), as for mSubset.
+        '''
+        with open(subset_table, 'w') as f:
+            self.table[numpy.sort(indices)].write(f, format='ascii.ipac')
+        return status.Struct("FootprintIndex",
+                             '[struct stat="OK", count=%i, nmatches=%i]'
+                             % (len(self.table), len(indices)))
+
+    def overlapping_pairs(self):
+        '''
+        Find all pairs of overlapping images in the table.
+
+        Returns
+        -------
+        first, second : `numpy.ndarray`
+            The indices of the images in each pair, with ``first < second``,
+            sorted in the same order as mOverlaps.
+        '''
+
+        n = len(self.table)
+
+        if self._tree is not None:
+            chord = 2. * numpy.sin(min(self._max_radius, 0.5 * numpy.pi))
+            pairs = self._tree.query_pairs(chord, output_type='ndarray')
+            pairs = [self._small[pairs]]
+            # Large footprints are paired with all other footprints
+            for large in self._large:
+                others = numpy.delete(numpy.arange(n), large)
+                pairs.append(numpy.column_stack([numpy.repeat(large, n - 1), others]))
+            pairs = numpy.concatenate(pairs).reshape(-1, 2)
+            pairs.sort(axis=1)
+            pairs = numpy.unique(pairs, axis=0)
+            first, second = pairs[:, 0], pairs[:, 1]
+        else:
+            first, second = [], []
+            for start in range(0, n, CHUNK_SIZE):
+                index = numpy.arange(start, min(start + CHUNK_SIZE, n))
+                cos_angle = self.centers[index].dot(self.centers.T)
+                i, j = numpy.nonzero(cos_angle >= numpy.cos(2 * self._max_radius))
+                keep = index[i] < j
+                first.append(index[i][keep])
+                second.append(j[keep])
+            for large in self._large:
+                others = numpy.arange(n)
+                first.append(numpy.minimum(large, others))
+                second.append(numpy.maximum(large, others))
+            pairs = numpy.column_stack([numpy.concatenate(first).astype(int),
+                                        numpy.concatenate(second).astype(int)])
+            pairs = numpy.unique(pairs[pairs[:, 0] < pairs[:, 1]], axis=0)
+            first, second = pairs[:, 0], pairs[:, 1]
+
+        if len(first) == 0:
+            return first, second
+
+        close = (_angle(self.centers[first], self.centers[second]) <=
+                 self.radii[first] + self.radii[second])
+        first, second = first[close], second[close]
+
+        overlap = _polygons_overlap(self.polygons[first], self.polygons[second])
+
+        return first[overlap], second[overlap]
+
+    def write_diffs(self, first, second, diffs_table):
+        '''
+        Write a table of overlapping image pairs in the format produced by
+        mOverlaps, which can be used by mDiffExec and mFitExec.
+
+        Returns
+        -------
+        result : :class:`~montage_wrapper.status.Struct`
+            Status with the number of overlapping pairs (``count``), as for
+            mOverlaps.
+        '''
+
+        if 'cntr' in self.table.colnames:
+            cntr = numpy.asarray(self.table['cntr'], dtype=int)
+        else:
+            cntr = numpy.arange(len(self.table))
+
+        fname = numpy.array([str(name).strip() for name in self.table['fname']])
+
+        diffs = Table()
+        diffs['cntr1'] = cntr[first].astype(numpy.int32)
+        diffs['cntr2'] = cntr[second].astype(numpy.int32)
+        diffs['plus'] = fname[first] if len(first) > 0 else numpy.array([], dtype=str)
+        diffs['minus'] = fname[second] if len(second) > 0 else numpy.array([], dtype=str)
+        diffs['diff'] = ['diff.%06i.%06i.fits' % (i, j)
+                         for i, j in zip(cntr[first], cntr[second])]
+
+        with open(diffs_table, 'w') as f:
+            diffs.write(f, format='ascii.ipac')
+
+        return status.Struct("FootprintIndex",
+                             '[struct stat="OK", count=%i]' % len(first))
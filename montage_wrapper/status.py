@@ -41,6 +41,20 @@ def parse_struct(command, string):
         return
 
 
+def make_struct(command, values):
+    '''
+    Create a Struct from a dictionary of values (which should include
+    ``stat``).
+    '''
+    items = []
+    for key, value in values.items():
+        if isinstance(value, (int, float)):
+            items.append('%s=%s' % (key, value))
+        else:
+            items.append('%s="%s"' % (key, value))
+    return Struct(command, '[struct ' + ', '.join(items) + ']')
+
+
 class Struct(object):
 
     def __init__(self, command, string):
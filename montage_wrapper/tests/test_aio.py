@@ -0,0 +1,32 @@
+import sys
+
+from astropy.tests.helper import pytest
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 5),
+                                reason="asyncio wrappers require Python 3.5+")
+
+
+def test_concurrent():
+
+    import asyncio
+    from .. import aio
+
+    loop = asyncio.get_event_loop()
+
+    tasks = [aio.mHdr('M31', 0.1 * (i + 1), 'test_aio_{0}.hdr'.format(i))
+             for i in range(4)]
+    stats = loop.run_until_complete(asyncio.gather(*tasks))
+    for stat in stats:
+        assert stat.stat == 'OK'
+
+
+def test_error():
+
+    import asyncio
+    from .. import aio
+    from ..status import MontageError
+
+    loop = asyncio.get_event_loop()
+
+    with pytest.raises(MontageError):
+        loop.run_until_complete(aio.mHdrCheck('does_not_exist.fits'))
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from astropy.io import fits
+from astropy.table import Table
+from astropy.tests.helper import pytest
+
+from ..background import fit_diffs, model_background
+
+
+class TestModelBackground(object):
+
+    def setup_method(self, method):
+
+        np.random.seed(12345)
+
+        self.tmpdir = tempfile.mkdtemp()
+
+        # A 3x3 grid of overlapping images, plus an isolated image, with
+        # random background planes
+        self.n_images = 10
+        self.planes = np.random.normal(0., [1e-3, 1e-3, 1.], (self.n_images, 3))
+
+        images = Table()
+        images['cntr'] = np.arange(self.n_images)
+        images['fname'] = ['image_%02i.fits' % i for i in range(self.n_images)]
+        self.images = os.path.join(self.tmpdir, 'images.tbl')
+        images.write(self.images, format='ascii.ipac')
+
+        pairs = []
+        for i in range(9):
+            if i % 3 < 2:
+                pairs.append((i, i + 1))
+            if i < 6:
+                pairs.append((i, i + 3))
+
+        fits = Table()
+        fits['plus'] = [p for p, m in pairs]
+        fits['minus'] = [m for p, m in pairs]
+        for j, name in enumerate('abc'):
+            fits[name] = [self.planes[p, j] - self.planes[m, j] for p, m in pairs]
+        xmin = np.array([(p % 3) * 100. + 80. for p, m in pairs])
+        ymin = np.array([(p // 3) * 100. + 80. for p, m in pairs])
+        fits['xmin'] = xmin
+        fits['xmax'] = xmin + 20.
+        fits['ymin'] = ymin
+        fits['ymax'] = ymin + 20.
+        fits['npixel'] = [400] * len(pairs)
+        self.fits = os.path.join(self.tmpdir, 'fits.tbl')
+        fits.write(self.fits, format='ascii.ipac')
+
+        self.corrections = os.path.join(self.tmpdir, 'corrections.tbl')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    @pytest.mark.parametrize('method', ['direct', 'lsqr'])
+    def test_planes(self, method):
+        s = model_background(self.images, self.fits, self.corrections, method=method)
+        assert s.count == 10
+        assert s.nfits == 12
+        t = Table.read(self.corrections, format='ascii.ipac')
+        assert list(t['id']) == list(range(self.n_images))
+        solution = np.array([t['a'], t['b'], t['c']]).T
+        # The corrections are only defined up to a common plane for the
+        # grid, and the isolated image is not corrected
+        offset = solution[:9] - self.planes[:9]
+        assert_allclose(offset, offset[0:1].repeat(9, axis=0), atol=1e-6)
+        assert_allclose(np.sum(solution[:9], axis=0), 0., atol=1e-6)
+        assert_allclose(solution[9], 0.)
+
+    def test_level_only(self):
+        model_background(self.images, self.fits, self.corrections, level_only=True)
+        t = Table.read(self.corrections, format='ascii.ipac')
+        assert np.all(t['a'] == 0.)
+        assert np.all(t['b'] == 0.)
+        assert_allclose(np.sum(t['c'][:9]), 0., atol=1e-6)
+
+
+class TestFitDiffs(object):
+
+    def setup_method(self, method):
+
+        self.tmpdir = tempfile.mkdtemp()
+
+        diffs = Table()
+        diffs['cntr1'] = [0, 0, 1]
+        diffs['cntr2'] = [1, 2, 2]
+        diffs['plus'] = ['p0.fits', 'p0.fits', 'p1.fits']
+        diffs['minus'] = ['p1.fits', 'p2.fits', 'p2.fits']
+        diffs['diff'] = ['diff.000000.000001.fits', 'diff.000000.000002.fits',
+                         'diff.000001.000002.fits']
+        self.diffs = os.path.join(self.tmpdir, 'diffs.tbl')
+        diffs.write(self.diffs, format='ascii.ipac')
+
+        # Difference images following a plane, with NaN values outside the
+        # overlap and a border of outliers
+        self.planes = [(0.01, -0.02, 3.), (-0.005, 0.001, -1.)]
+        for (a, b, c), fname in zip(self.planes, diffs['diff'][:2]):
+            header = fits.Header()
+            header['CRPIX1'] = 20.5
+            header['CRPIX2'] = -4.5
+            x = np.arange(1, 41) - 20.5
+            y = np.arange(1, 31) + 4.5
+            data = a * x[np.newaxis, :] + b * y[:, np.newaxis] + c
+            data[:, :5] = np.nan
+            data[:2, :] = 1000.
+            data[-2:, :] = 1000.
+            data[:, -2:] = 1000.
+            fits.writeto(os.path.join(self.tmpdir, fname), data, header)
+
+        # The last difference image does not overlap
+        header = fits.Header()
+        header['CRPIX1'] = 1.
+        header['CRPIX2'] = 1.
+        fits.writeto(os.path.join(self.tmpdir, diffs['diff'][2]),
+                     np.nan * np.zeros((10, 10)), header)
+
+        self.fits = os.path.join(self.tmpdir, 'fits.tbl')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    @pytest.mark.parametrize('subsample', [1, 3])
+    def test_planes(self, subsample):
+        s = fit_diffs(self.diffs, self.fits, self.tmpdir, border=2,
+                      subsample=subsample, n_workers=2)
+        assert s.count == 2
+        assert s.failed == 1
+        t = Table.read(self.fits, format='ascii.ipac')
+        assert list(t['plus']) == [0, 0]
+        assert list(t['minus']) == [1, 2]
+        assert_allclose(np.array([t['a'], t['b'], t['c']]).T, self.planes, atol=1e-10)
+        assert_allclose(t['rms'], 0., atol=1e-10)
+        assert_allclose(t['xmin'], 6 - 20.5)
+        assert_allclose(t['ymax'], 28 + 4.5, atol=subsample)
+        if subsample == 1:
+            assert_allclose(t['npixel'], 33 * 26)
+
+    def test_border(self):
+        fit_diffs(self.diffs, self.fits, self.tmpdir)
+        t = Table.read(self.fits, format='ascii.ipac')
+        assert np.all(t['rms'] > 1)
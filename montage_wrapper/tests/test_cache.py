@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from astropy.io import fits
+
+from ..cache import ProjectionCache
+
+
+HEADER = """SIMPLE  = T
+BITPIX  = -64
+NAXIS   = 2
+NAXIS1  = 10
+NAXIS2  = 10
+CTYPE1  = 'RA---TAN'
+CTYPE2  = 'DEC--TAN'
+CRVAL1  = 10.
+CRVAL2  = 20.
+CRPIX1  = 5.5
+CRPIX2  = 5.5
+CDELT1  = -0.01
+CDELT2  = 0.01
+END
+"""
+
+
+class TestProjectionCache(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.header = os.path.join(self.tmpdir, 'header.hdr')
+        with open(self.header, 'w') as f:
+            f.write(HEADER)
+        self.image = os.path.join(self.tmpdir, 'image.fits')
+        fits.writeto(self.image, np.zeros((10, 10)))
+        self.cache = ProjectionCache(os.path.join(self.tmpdir, 'cache'))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def write_projected(self, name, value=1.):
+        filename = os.path.join(self.tmpdir, name)
+        fits.writeto(filename, np.zeros((10, 10)) + value)
+        fits.writeto(filename.replace('.fits', '_area.fits'), np.ones((10, 10)))
+        return filename
+
+    def test_key(self):
+        key = self.cache.key(self.image, self.header)
+        assert key == self.cache.key(self.image, self.header)
+        assert key != self.cache.key(self.image, self.header, hdu=1)
+        assert key != self.cache.key(self.image, self.header, exact=True)
+        # Comments in the header do not change the key
+        with open(self.header, 'w') as f:
+            f.write(HEADER.replace("END", "COMMENT a comment\nEND"))
+        assert key == ProjectionCache(self.cache.directory).key(self.image, self.header)
+
+    def test_fetch_store(self):
+        key = self.cache.key(self.image, self.header)
+        out = os.path.join(self.tmpdir, 'out.fits')
+        assert not self.cache.fetch(key, out)
+        self.cache.store(key, self.write_projected('projected.fits', 3.))
+        assert self.cache.fetch(key, out)
+        assert np.all(fits.getdata(out) == 3.)
+        assert os.path.exists(os.path.join(self.tmpdir, 'out_area.fits'))
+
+    def test_evict(self):
+        keys = []
+        for i in range(3):
+            keys.append(self.cache.key(self.image, self.header, hdu=i))
+            self.cache.store(keys[-1], self.write_projected('p%i.fits' % i))
+        size = self.cache.size()
+        # Mark the first entry as the most recently used
+        time.sleep(0.01)
+        self.cache.fetch(keys[0], os.path.join(self.tmpdir, 'out.fits'))
+        self.cache.evict(size * 2 // 3)
+        assert len(self.cache._entries()) == 2
+        assert self.cache.fetch(keys[0], os.path.join(self.tmpdir, 'out.fits'))
+        assert not self.cache.fetch(keys[1], os.path.join(self.tmpdir, 'out.fits'))
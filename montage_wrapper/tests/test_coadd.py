@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from astropy.io import fits
+from astropy.table import Table
+
+from ..coadd import add_frames
+
+
+HEADER = """SIMPLE  = T
+BITPIX  = -64
+NAXIS   = 2
+NAXIS1  = 30
+NAXIS2  = 20
+CTYPE1  = 'RA---TAN'
+CTYPE2  = 'DEC--TAN'
+CRVAL1  = 10.
+CRVAL2  = 20.
+CRPIX1  = 15.5
+CRPIX2  = 10.5
+CDELT1  = -0.01
+CDELT2  = 0.01
+END
+"""
+
+
+class TestAddFrames(object):
+
+    def setup_method(self, method):
+
+        self.tmpdir = tempfile.mkdtemp()
+
+        self.header = os.path.join(self.tmpdir, 'header.hdr')
+        with open(self.header, 'w') as f:
+            f.write(HEADER)
+
+        # Two overlapping 10x10 frames, at offsets (2, 3) and (8, 5) in the
+        # output image
+        self.offsets = [(2, 3), (8, 5)]
+        t = Table()
+        t['cntr'] = [0, 1]
+        t['naxis1'] = [10, 10]
+        t['naxis2'] = [10, 10]
+        t['crpix1'] = [15.5 - x for x, y in self.offsets]
+        t['crpix2'] = [10.5 - y for x, y in self.offsets]
+        t['fname'] = ['a.fits', 'b.fits']
+        self.table = os.path.join(self.tmpdir, 'images.tbl')
+        t.write(self.table, format='ascii.ipac')
+
+        for i, row in enumerate(t):
+            header = fits.Header()
+            header['CRPIX1'] = row['crpix1']
+            header['CRPIX2'] = row['crpix2']
+            data = np.zeros((10, 10)) + i + 1.
+            data[0, 0] = np.nan
+            area = np.ones((10, 10)) * (i + 1)
+            fits.writeto(os.path.join(self.tmpdir, row['fname']), data, header)
+            fits.writeto(os.path.join(self.tmpdir, row['fname'].replace('.fits', '_area.fits')),
+                         area, header)
+
+        c = Table()
+        c['id'] = [1]
+        c['a'] = [0.5]
+        c['b'] = [0.]
+        c['c'] = [2.]
+        self.corrections = os.path.join(self.tmpdir, 'corrections.tbl')
+        c.write(self.corrections, format='ascii.ipac')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_mean(self):
+
+        out = os.path.join(self.tmpdir, 'mosaic.fits')
+        add_frames(self.table, self.header, out, img_dir=self.tmpdir,
+                   corrections_table=self.corrections, exact=True,
+                   chunk_rows=3, n_workers=2)
+
+        data = fits.getdata(out)
+        area = fits.getdata(out.replace('.fits', '_area.fits'))
+        assert data.shape == (20, 30)
+
+        # Pixel only covered by the first frame
+        assert_allclose(data[3, 3], 1.)
+        assert_allclose(area[3, 3], 1.)
+        # Pixel covered by both frames, in column 2 of the second frame
+        # (x = 3 - 7.5 relative to its reference pixel)
+        b = 2. - (0.5 * (3 - 7.5) + 2.)
+        assert_allclose(data[6, 10], (1. + 2 * b) / 3.)
+        assert_allclose(area[6, 10], 3.)
+        # NaN pixel of the first frame, and pixel not covered by any frame
+        assert_allclose(data[3, 2], np.nan)
+        assert_allclose(area[3, 2], 0.)
+        assert_allclose(data[0, 0], np.nan)
+
+    def test_trim(self):
+        out = os.path.join(self.tmpdir, 'mosaic.fits')
+        add_frames(self.table, self.header, out, img_dir=self.tmpdir,
+                   combine='count', bitpix=-32)
+        data = fits.getdata(out)
+        assert data.shape == (12, 16)
+        assert data.dtype.itemsize == 4
+        assert np.nanmax(data) == 2
+        assert fits.getheader(out)['CRPIX1'] == 15.5 - 2
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from astropy.io import fits
+from astropy.tests.helper import pytest
+
+from .. import fits_utils
+
+
+@pytest.mark.parametrize('bitpix', [8, 16, 32, 64])
+def test_to_bitpix_scaled(bitpix):
+    # Values outside the range of the integer types
+    data = np.array([-3., 1.5e5, np.nan, 300.7])
+    bscale, bzero = fits_utils.integer_scaling(-3., 1.5e5, bitpix)
+    raw = fits_utils.to_bitpix(data, bitpix, bscale=bscale, bzero=bzero)
+    assert raw[2] == fits_utils.BLANK_VALUES[bitpix]
+    valid = [0, 1, 3]
+    assert_allclose(bzero + bscale * raw[valid].astype(float), data[valid],
+                    atol=bscale)
+
+
+@pytest.mark.parametrize('bitpix', [8, 16])
+def test_to_bitpix_out_of_range(bitpix):
+    with pytest.raises(ValueError) as exc:
+        fits_utils.to_bitpix(np.array([300.7, 1.5e5]), bitpix)
+    assert 'out of range' in str(exc.value)
+
+
+class TestConvertImage(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    @pytest.mark.parametrize('bitpix', [8, 16])
+    def test_convert_cube_to_integer(self, bitpix):
+        data = np.random.uniform(-1e5, 1.5e5, (3, 10, 20))
+        data[1, 2, 3] = np.nan
+        in_image = os.path.join(self.tmpdir, 'in.fits')
+        out_image = os.path.join(self.tmpdir, 'out.fits')
+        header = fits.Header()
+        header['CRPIX1'] = 3.
+        fits.writeto(in_image, data, header)
+        fits_utils.convert_image(in_image, out_image, bitpix, chunk_rows=7)
+        # The raw values are checked, since Astropy does not apply BLANK = 0
+        with fits.open(out_image, do_not_scale_image_data=True) as hdulist:
+            header = hdulist[0].header
+            raw = hdulist[0].data
+            assert header['BITPIX'] == bitpix
+            assert header['CRPIX1'] == 3.
+            assert header['BLANK'] == fits_utils.BLANK_VALUES[bitpix]
+            assert raw[1, 2, 3] == header['BLANK']
+            valid = ~np.isnan(data)
+            assert np.all(raw[valid] != header['BLANK'])
+            assert_allclose(header['BZERO'] + header['BSCALE'] * raw[valid].astype(float),
+                            data[valid], atol=header['BSCALE'])
+
+    @pytest.mark.parametrize('bitpix', [16, -32])
+    def test_convert_same_bitpix(self, bitpix):
+        in_image = os.path.join(self.tmpdir, 'in.fits')
+        out_image = os.path.join(self.tmpdir, 'out.fits')
+        hdu = fits.PrimaryHDU(np.arange(12.).reshape((3, 4)))
+        if bitpix > 0:
+            hdu.data = hdu.data.astype(np.int16)
+            hdu.data[1, 1] = -32768
+            hdu.header['BLANK'] = -32768
+        else:
+            hdu.data = hdu.data.astype(np.float32)
+            hdu.data[1, 1] = np.nan
+        hdu.writeto(in_image)
+        fits_utils.convert_image(in_image, out_image, bitpix)
+        # The image is copied as it is, so BLANK and NaN values are unchanged
+        with open(in_image, 'rb') as f_in:
+            with open(out_image, 'rb') as f_out:
+                assert f_in.read() == f_out.read()
+        with fits.open(out_image) as hdulist:
+            assert np.isnan(hdulist[0].data[1, 1])
@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from astropy.io import fits
+from astropy.table import Table
+from astropy.wcs import WCS
+
+from ..metadata import build_image_table
+
+
+def write_image(filename, ctype=("RA---TAN", "DEC--TAN"), crval=(10., 20.)):
+    w = WCS(naxis=2)
+    w.wcs.crpix = [10.5, 5.5]
+    w.wcs.cdelt = [-0.01, 0.01]
+    w.wcs.crval = list(crval)
+    w.wcs.ctype = list(ctype)
+    header = w.to_header()
+    header['EXPTIME'] = 3.5
+    fits.writeto(filename, np.zeros((10, 20)), header)
+
+
+class TestBuildImageTable(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.raw = os.path.join(self.tmpdir, 'raw')
+        os.makedirs(os.path.join(self.raw, 'sub'))
+        write_image(os.path.join(self.raw, 'a.fits'))
+        write_image(os.path.join(self.raw, 'a_area.fits'))
+        write_image(os.path.join(self.raw, 'sub', 'b.fits'),
+                    ctype=("GLON-TAN", "GLAT-TAN"), crval=(120., 30.))
+        with open(os.path.join(self.raw, 'bad.fits'), 'w') as f:
+            f.write('not a FITS file')
+        self.table = os.path.join(self.tmpdir, 'images.tbl')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_basic(self):
+        s = build_image_table(self.raw, self.table, corners=True)
+        assert s.count == 1
+        assert s.badfits == 1
+        t = Table.read(self.table, format='ascii.ipac')
+        assert list(t['fname']) == ['a.fits']
+        assert_allclose(t['ra'], 10.)
+        assert_allclose(t['dec'], 20.)
+        assert_allclose(t['cdelt1'], -0.01)
+        assert t['naxis1'][0] == 20
+        assert t['naxis2'][0] == 10
+        assert_allclose(t['ra1'], 10.1064, atol=1e-4)
+        assert_allclose(t['dec3'], 20.0500, atol=1e-4)
+
+    def test_recursive(self):
+        s = build_image_table(self.raw, self.table, recursive=True,
+                              include_area=True)
+        assert s.count == 3
+        t = Table.read(self.table, format='ascii.ipac')
+        assert sorted(t['fname']) == ['a.fits', 'a_area.fits', 'sub/b.fits']
+        # Galactic positions are converted to Equatorial J2000
+        b = t[t['fname'] == 'sub/b.fits'][0]
+        assert_allclose([b['ra'], b['dec']], [234.0495, 86.1432], atol=1e-3)
+
+    def test_fieldlist(self):
+        fieldlist = os.path.join(self.tmpdir, 'fieldlist.txt')
+        with open(fieldlist, 'w') as f:
+            f.write("EXPTIME double 10\n")
+        build_image_table(self.raw, self.table, fieldlist=fieldlist)
+        t = Table.read(self.table, format='ascii.ipac')
+        assert_allclose(t['exptime'], 3.5)
+
+    def test_index(self, monkeypatch):
+
+        from .. import metadata
+
+        read = []
+        read_headers = metadata._read_headers
+
+        def logging_read_headers(path):
+            read.append(os.path.basename(path))
+            return read_headers(path)
+
+        monkeypatch.setattr(metadata, '_read_headers', logging_read_headers)
+
+        index = os.path.join(self.tmpdir, 'index.db')
+
+        build_image_table(self.raw, self.table, corners=True, index=index)
+        assert sorted(read) == ['a.fits', 'bad.fits']
+        with open(self.table) as f:
+            expected = f.read()
+
+        # Only new files are read again
+        del read[:]
+        write_image(os.path.join(self.raw, 'c.fits'), crval=(11., 20.))
+        s = build_image_table(self.raw, self.table, corners=True, index=index)
+        assert read == ['c.fits']
+        assert s.count == 2
+        assert s.badfits == 1
+
+        # Removed files are no longer included
+        del read[:]
+        os.remove(os.path.join(self.raw, 'c.fits'))
+        build_image_table(self.raw, self.table, corners=True, index=index)
+        assert read == []
+        with open(self.table) as f:
+            assert f.read() == expected
+
+    def test_index_shared(self, monkeypatch):
+
+        # The same index can be used for several directories, even if they
+        # contain files with the same name, size, and modification time
+
+        from .. import metadata
+
+        read = []
+        read_headers = metadata._read_headers
+
+        def logging_read_headers(path):
+            read.append(path)
+            return read_headers(path)
+
+        monkeypatch.setattr(metadata, '_read_headers', logging_read_headers)
+
+        index = os.path.join(self.tmpdir, 'index.db')
+
+        directories = []
+        for name, crval in [('dir_a', (10., 20.)), ('dir_b', (30., 40.))]:
+            directory = os.path.join(self.tmpdir, name)
+            os.mkdir(directory)
+            filename = os.path.join(directory, 'frame.fits')
+            write_image(filename, crval=crval)
+            os.utime(filename, (1e9, 1e9))
+            directories.append(directory)
+
+        for directory, ra in zip(directories, [10., 30.]):
+            build_image_table(directory, self.table, index=index)
+            t = Table.read(self.table, format='ascii.ipac')
+            assert list(t['fname']) == ['frame.fits']
+            assert_allclose(t['crval1'], ra)
+            assert_allclose(t['ra'], ra)
+        assert len(read) == 2
+
+        # Scanning one directory does not remove the entries for the other
+        del read[:]
+        for directory in directories:
+            build_image_table(directory, self.table, index=index)
+        assert read == []
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from astropy.table import Table
+
+from ..pool import _split_table, _merge_tables, _merge_status
+from ..status import Struct
+
+
+class TestShards(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.table = os.path.join(self.tmpdir, 'images.tbl')
+        t = Table()
+        t['cntr'] = np.arange(10)
+        t['fname'] = ['image_%02i.fits' % i for i in range(10)]
+        t.write(self.table, format='ascii.ipac')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_split_merge(self):
+        shards = _split_table(self.table, 4, self.tmpdir)
+        assert len(shards) == 4
+        assert [len(Table.read(shard, format='ascii.ipac')) for shard in shards] == [2, 3, 2, 3]
+        merged = os.path.join(self.tmpdir, 'merged.tbl')
+        _merge_tables(shards, merged)
+        with open(self.table) as f1, open(merged) as f2:
+            assert f1.read() == f2.read()
+
+    def test_split_restart(self):
+        shards = _split_table(self.table, 20, self.tmpdir, start=7)
+        assert len(shards) == 3
+        assert Table.read(shards[0], format='ascii.ipac')['cntr'][0] == 7
+
+
+def test_merge_status():
+    s1 = Struct("mProjExec", '[struct stat="OK", count=3, failed=1, nooverlap=0]')
+    s2 = Struct("mProjExec", '[struct stat="OK", count=4, failed=0, nooverlap=2]')
+    s = _merge_status("mProjExec", [s1, s2])
+    assert s.stat == "OK"
+    assert s.count == 7
+    assert s.failed == 1
+    assert s.nooverlap == 2
@@ -0,0 +1,59 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from astropy.wcs import WCS
+from astropy.tests.helper import pytest
+
+from ..projection import projection_weights, apply_projection_weights
+
+try:
+    import scipy
+except ImportError:
+    HAS_SCIPY = False
+else:
+    HAS_SCIPY = True
+
+
+def make_header(n, cdelt, crpix=None, rotation=0.):
+    w = WCS(naxis=2)
+    w.wcs.crpix = crpix or [n / 2. + 0.5, n / 2. + 0.5]
+    w.wcs.cdelt = [-cdelt, cdelt]
+    w.wcs.crval = [10., 20.]
+    w.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    w.wcs.crota = [0, rotation]
+    header = w.to_header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = n
+    header['NAXIS2'] = n
+    return header
+
+
+@pytest.mark.skipif("not HAS_SCIPY")
+def test_identity():
+    header = make_header(30, 0.01)
+    weights = projection_weights(header, header)
+    data = np.random.random((30, 30))
+    assert_allclose(apply_projection_weights(weights, data, (30, 30)), data)
+
+
+@pytest.mark.skipif("not HAS_SCIPY")
+def test_shift():
+    header_in = make_header(30, 0.01)
+    header_out = make_header(30, 0.01, crpix=[16.5, 15.5])
+    weights = projection_weights(header_in, header_out)
+    data = np.random.random((30, 30))
+    data[3, 4] = np.nan
+    result = apply_projection_weights(weights, data, (30, 30))
+    assert np.all(np.isnan(result[:, 0]))
+    assert_allclose(result[:, 1:], data[:, :-1])
+
+
+@pytest.mark.skipif("not HAS_SCIPY")
+def test_area_conservation():
+    header_in = make_header(30, 0.01)
+    header_out = make_header(150, 0.004, rotation=30.)
+    weights = projection_weights(header_in, header_out)
+    area = np.asarray(weights.sum(axis=0)).ravel()
+    assert_allclose(area, (0.01 / 0.004) ** 2, rtol=1e-3)
+    result = apply_projection_weights(weights, np.ones((30, 30)), (150, 150))
+    assert_allclose(result[~np.isnan(result)], 1.)
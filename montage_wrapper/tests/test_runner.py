@@ -0,0 +1,75 @@
+import sys
+import threading
+
+from .. import runner
+from ..commands import mAdd, mDiffFitExec
+
+# A child process writing more than a pipe buffer to both streams, which
+# would deadlock if the streams were not read concurrently
+LARGE_OUTPUT = ("import sys; "
+                "sys.stdout.write('o' * 2000000); sys.stdout.flush(); "
+                "sys.stderr.write('e' * 2000000); sys.stderr.flush(); "
+                "sys.stdout.write('o' * 2000000); sys.stdout.flush()")
+
+
+def test_execute_large_output():
+    stdout, stderr, returncode = runner.execute([sys.executable, '-c', LARGE_OUTPUT])
+    assert returncode == 0
+    assert stdout == b'o' * 4000000
+    assert stderr == b'e' * 2000000
+
+
+def test_run_large_output():
+    command = ("import sys; sys.stdout.write('o' * 2000000 + '\\n'); "
+               "sys.stdout.write('[struct stat=\"OK\", count=3]\\n')")
+    result = runner.run('test', [sys.executable, '-c', command])
+    assert result[-1].stat == 'OK'
+    assert result[-1].count == 3
+
+
+def test_build():
+    name, command = runner.build(mAdd, 'images.tbl', 'header.hdr', 'out.fits',
+                                 exact=True)
+    assert name == 'mAdd'
+    assert command == ['mAdd', '-e', 'images.tbl', 'header.hdr', 'out.fits']
+    # The build-only mode is switched off again once the command is built
+    assert not runner._state.build_only
+
+
+def test_build_diff_fit_exec():
+    # Positional arguments keep their original meaning, and the current form
+    # of the command is used if a header template is given
+    name, command = runner.build(mDiffFitExec, 'diffs.tbl', 'fits.tbl', 'diffs')
+    assert command == ['mDiffFitExec', 'diffs.tbl', 'fits.tbl', 'diffs']
+    name, command = runner.build(mDiffFitExec, 'diffs.tbl', 'fits.tbl', 'diffs',
+                                 template_header='header.hdr', proj_dir='projected')
+    assert command == ['mDiffFitExec', '-p', 'projected', 'diffs.tbl',
+                       'header.hdr', 'diffs', 'fits.tbl']
+
+
+def test_build_thread_local():
+
+    # While one thread is building a command, commands run from other
+    # threads should still be run
+
+    building = threading.Event()
+    done = threading.Event()
+
+    def slow_wrapper():
+        building.set()
+        done.wait(10)
+        return runner.run('test', ['never-run'])
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(runner.build(slow_wrapper)))
+    thread.start()
+    try:
+        assert building.wait(10)
+        command = "print('[struct stat=\"OK\", count=1]')"
+        result = runner.run('test', [sys.executable, '-c', command])
+        assert result.stat == 'OK'
+    finally:
+        done.set()
+        thread.join()
+
+    assert results == [('test', ['never-run'])]
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from astropy.table import Table
+from astropy.wcs import WCS
+from astropy.tests.helper import pytest
+
+from ..spatial import FootprintIndex, RegionTooLargeError, _box_polygon
+
+
+def make_table():
+    # A 10x10 grid of 0.5x0.5 degree images, spaced by 1 degree
+    ra, dec = np.meshgrid(np.arange(10.), np.arange(10.))
+    ra, dec = ra.ravel(), dec.ravel()
+    t = Table()
+    t['cntr'] = np.arange(len(ra))
+    corners = np.array([_box_polygon(r, d, 0.5) for r, d in zip(ra, dec)])
+    for i in range(4):
+        t['ra%i' % (i + 1)] = corners[:, i, 0]
+        t['dec%i' % (i + 1)] = corners[:, i, 1]
+    t['fname'] = ['image_%02i.fits' % i for i in range(len(ra))]
+    return t
+
+
+def make_header(ra, dec, n, cdelt, projection='TAN', ny=None):
+    ny = n if ny is None else ny
+    w = WCS(naxis=2)
+    w.wcs.crpix = [n / 2. + 0.5, ny / 2. + 0.5]
+    w.wcs.cdelt = [-cdelt, cdelt]
+    w.wcs.crval = [ra, dec]
+    w.wcs.ctype = ["RA---" + projection, "DEC--" + projection]
+    header = w.to_header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = n
+    header['NAXIS2'] = ny
+    return header
+
+
+def test_circle():
+    index = FootprintIndex(make_table())
+    assert list(index.overlaps_circle(5., 5., 0.1)) == [55]
+    assert list(index.overlaps_circle(5.5, 5., 0.3)) == [55, 56]
+    assert len(index.overlaps_circle(5.5, 5.5, 0.3)) == 0
+
+
+def test_box():
+    index = FootprintIndex(make_table())
+    assert list(index.overlaps_box(5.5, 5., 1.2, 0.2)) == [55, 56]
+    assert len(index.overlaps_box(5.5, 5.5, 0.4)) == 0
+    # Rotating the box by 45 degrees makes it reach the corners of the images
+    assert len(index.overlaps_box(5.5, 5.5, 0.9, rotation=45.)) == 4
+
+
+def test_polygon():
+    index = FootprintIndex(make_table())
+    polygon = [(1.1, 1.1), (3.1, 1.1), (3.1, 1.4), (1.1, 1.4)]
+    assert list(index.overlaps_polygon(polygon)) == [11, 12, 13]
+
+
+def test_header_subset():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        index = FootprintIndex(make_table())
+        indices = index.overlaps_header(make_header(2.5, 2.5, 100, 0.01))
+        assert sorted(indices) == [22, 23, 32, 33]
+        subset_table = os.path.join(tmpdir, 'subset.tbl')
+        s = index.write_subset(indices, subset_table)
+        assert s.count == 100
+        assert s.nmatches == 4
+        t = Table.read(subset_table, format='ascii.ipac')
+        assert list(t['fname']) == ['image_22.fits', 'image_23.fits',
+                                    'image_32.fits', 'image_33.fits']
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize(('projection', 'n', 'ny'),
+                         [('CAR', 360, 180), ('CAR', 200, 100), ('AIT', 360, 180)])
+def test_header_too_large(projection, n, ny):
+    # Headers covering a hemisphere or more, including all-sky headers with
+    # corners outside the projection, cannot be used as convex polygons
+    index = FootprintIndex(make_table())
+    with pytest.raises(RegionTooLargeError):
+        index.overlaps_header(make_header(0., 0., n, 1., projection=projection, ny=ny))
+    # Smaller headers on the same projections are fine
+    indices = index.overlaps_header(make_header(2.5, 2.5, 100, 0.01, projection=projection))
+    assert sorted(indices) == [22, 23, 32, 33]
+
+
+def test_overlapping_pairs():
+    t = make_table()
+    # Add an image overlapping the four images around (5.5, 5.5)
+    t.add_row([100] + [x for pair in _box_polygon(5.5, 5.5, 1.2) for x in pair] +
+              ['image_100.fits'])
+    index = FootprintIndex(t)
+    first, second = index.overlapping_pairs()
+    assert list(zip(first, second)) == [(55, 100), (56, 100), (65, 100), (66, 100)]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        diffs_table = os.path.join(tmpdir, 'diffs.tbl')
+        s = index.write_diffs(first, second, diffs_table)
+        assert s.count == 4
+        diffs = Table.read(diffs_table, format='ascii.ipac')
+        assert diffs.colnames == ['cntr1', 'cntr2', 'plus', 'minus', 'diff']
+        assert diffs['plus'][0] == 'image_55.fits'
+        assert diffs['minus'][0] == 'image_100.fits'
+        assert diffs['diff'][0] == 'diff.000055.000100.fits'
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_wcs_columns():
+    # Tables without corners use the WCS columns
+    t = Table()
+    t['cntr'] = [0, 1, 2]
+    t['ctype1'] = ['RA---TAN'] * 3
+    t['ctype2'] = ['DEC--TAN'] * 3
+    t['crval1'] = [10., 10.5, 12.]
+    t['crval2'] = [20., 20., 20.]
+    t['crpix1'] = [50.5] * 3
+    t['crpix2'] = [50.5] * 3
+    t['cdelt1'] = [-0.01] * 3
+    t['cdelt2'] = [0.01] * 3
+    t['crota2'] = [0.] * 3
+    t['naxis1'] = [100] * 3
+    t['naxis2'] = [100] * 3
+    t['fname'] = ['a.fits', 'b.fits', 'c.fits']
+    first, second = FootprintIndex(t).overlapping_pairs()
+    assert list(zip(first, second)) == [(0, 1)]
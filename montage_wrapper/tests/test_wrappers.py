@@ -1,4 +1,7 @@
 import os
+import glob
+import json
+import errno
 import shutil
 import tempfile
 from hashlib import md5
@@ -9,7 +12,10 @@ from astropy.wcs import WCS
 from astropy.io import fits
 from astropy.tests.helper import pytest
 
-from .. import mosaic
+from .. import mosaic, reproject, reproject_cube, reproject_array, reproject_hdu
+from .. import update_mosaic, mImgtbl, mMakeHdr
+from .. import wrappers
+from ..status import MontageError
 
 
 class TestMosaic(object):
@@ -54,6 +60,57 @@ class TestMosaic(object):
             assert_allclose(np.std(valid), 0.12658458001333581, rtol=5e-6)
             assert_allclose(np.mean(valid), 0.4995945318627074, rtol=5e-6)
             assert_allclose(np.median(valid), 0.5003376603126526, rtol=5e-6)
+        # Frames are combined directly in the output BITPIX, without a 64-bit
+        # intermediate mosaic
+        assert sorted(os.listdir(os.path.join(self.tmpdir, 'mosaic'))) == \
+            ['images_projected.tbl', 'mosaic.fits', 'mosaic_area.fits']
+        for filename in ['mosaic.fits', 'mosaic_area.fits']:
+            assert fits.getval(os.path.join(self.tmpdir, 'mosaic', filename), 'BITPIX') == -32
+
+    def test_mosaic_resume(self):
+        work_dir = os.path.join(self.tmpdir, 'work_resume')
+        output_dir = os.path.join(self.tmpdir, 'mosaic_resume')
+        mosaic(os.path.join(self.tmpdir, 'raw'), output_dir,
+               background_match=True, work_dir=work_dir, cleanup=False,
+               resume=True)
+        stats_mtime = os.path.getmtime(os.path.join(work_dir, 'stats.tbl'))
+        # Resuming skips all the stages whose outputs are still present
+        os.remove(os.path.join(output_dir, 'mosaic.fits'))
+        mosaic(os.path.join(self.tmpdir, 'raw'), output_dir,
+               background_match=True, work_dir=work_dir, cleanup=False,
+               resume=True)
+        assert os.path.exists(os.path.join(output_dir, 'mosaic.fits'))
+        assert os.path.getmtime(os.path.join(work_dir, 'stats.tbl')) == stats_mtime
+
+    def test_mosaic_resume_changed_header(self):
+        work_dir = os.path.join(self.tmpdir, 'work_resume_header')
+        output_dir = os.path.join(self.tmpdir, 'mosaic_resume_header')
+        header_1 = os.path.join(self.tmpdir, 'resume_1.hdr')
+        header_2 = os.path.join(self.tmpdir, 'resume_2.hdr')
+        mImgtbl(os.path.join(self.tmpdir, 'raw'), os.path.join(self.tmpdir, 'resume_images.tbl'))
+        mMakeHdr(os.path.join(self.tmpdir, 'resume_images.tbl'), header_1)
+        header = fits.Header.fromtextfile(header_1)
+        header['CRVAL1'] += 0.1
+        header.totextfile(header_2)
+        mosaic(os.path.join(self.tmpdir, 'raw'), output_dir, header=header_1,
+               work_dir=work_dir, cleanup=False, resume=True)
+        # Simulate an interrupted projection, which left a stats table behind
+        marker_file = os.path.join(work_dir, 'checkpoints', 'project_frames.json')
+        with open(marker_file) as f:
+            marker = json.load(f)
+        marker['complete'] = False
+        with open(marker_file, 'w') as f:
+            json.dump(marker, f)
+        # Resuming with a different header should project all frames again
+        mosaic(os.path.join(self.tmpdir, 'raw'), output_dir, header=header_2,
+               work_dir=work_dir, cleanup=False, resume=True)
+        expected_dir = os.path.join(self.tmpdir, 'mosaic_resume_header_expected')
+        mosaic(os.path.join(self.tmpdir, 'raw'), expected_dir, header=header_2)
+        with fits.open(os.path.join(output_dir, 'mosaic.fits')) as hdulist:
+            assert_allclose(hdulist[0].header['CRVAL1'], header['CRVAL1'])
+            data = hdulist[0].data
+        expected = fits.getdata(os.path.join(expected_dir, 'mosaic.fits'))
+        np.testing.assert_array_equal(data, expected)
 
     def test_mosaic_background_match(self):
         mosaic(os.path.join(self.tmpdir, 'raw'),os.path.join(self.tmpdir, 'mosaic_bkgmatch'), background_match=True)
@@ -66,3 +123,719 @@ class TestMosaic(object):
         #     assert_allclose(np.std(valid), 0.12661606622654725)
         #     assert_allclose(np.mean(valid), 0.4994805202294361)
         #     assert_allclose(np.median(valid), 0.5002447366714478)
+
+    def test_mosaic_background_match_keep_diffs(self):
+        work_dir = os.path.join(self.tmpdir, 'work_keep_diffs')
+        mosaic(os.path.join(self.tmpdir, 'raw'), os.path.join(self.tmpdir, 'mosaic_keep_diffs'),
+               background_match=True, keep_diffs=True, work_dir=work_dir, cleanup=False)
+        assert len(glob.glob(os.path.join(work_dir, 'diffs', '*.fits'))) > 0
+        assert os.path.exists(os.path.join(work_dir, 'fits.tbl'))
+
+    def test_mosaic_background_match_lazy(self):
+        work_dir = os.path.join(self.tmpdir, 'work_lazy')
+        output_dir = os.path.join(self.tmpdir, 'mosaic_lazy')
+        mosaic(os.path.join(self.tmpdir, 'raw'), output_dir, background_match=True,
+               lazy_corrections=True, work_dir=work_dir, cleanup=False)
+        assert not os.path.exists(os.path.join(work_dir, 'corrected'))
+        assert os.path.exists(os.path.join(output_dir, 'corrections.tbl'))
+        with fits.open(os.path.join(output_dir, 'mosaic.fits')) as hdulist:
+            assert hdulist[0].header['BITPIX'] == -32
+
+    def test_mosaic_background_match_lazy_cleanup(self):
+        work_dir = os.path.join(self.tmpdir, 'work_lazy_cleanup')
+        output_dir = os.path.join(self.tmpdir, 'mosaic_lazy_cleanup')
+        mosaic(os.path.join(self.tmpdir, 'raw'), output_dir, background_match=True,
+               lazy_corrections=True, work_dir=work_dir)
+        assert not os.path.exists(work_dir)
+        assert os.path.exists(os.path.join(output_dir, 'mosaic.fits'))
+
+    def test_update_mosaic(self):
+        raw_dir = os.path.join(self.tmpdir, 'raw')
+        header = os.path.join(self.tmpdir, 'update.hdr')
+        images_tbl = os.path.join(self.tmpdir, 'update.tbl')
+        mImgtbl(raw_dir, images_tbl)
+        mMakeHdr(images_tbl, header)
+        mosaic(raw_dir, os.path.join(self.tmpdir, 'mosaic_full'),
+               header=header, exact_size=True)
+        # Mosaic all but the last three frames, then add them, and add and
+        # remove another frame
+        part_dir = os.path.join(self.tmpdir, 'raw_part')
+        os.mkdir(part_dir)
+        in_images = sorted(glob.glob(os.path.join(raw_dir, '*.fits')))
+        for in_image in in_images[:-3]:
+            os.symlink(in_image, os.path.join(part_dir, os.path.basename(in_image)))
+        work_dir = os.path.join(self.tmpdir, 'work_update')
+        output_dir = os.path.join(self.tmpdir, 'mosaic_update')
+        mosaic(part_dir, output_dir, header=header, exact_size=True,
+               work_dir=work_dir, cleanup=False)
+        projected_dir = os.path.join(work_dir, 'projected')
+        update_mosaic(output_dir, projected_dir, new_images=in_images[-3:],
+                      removed_images=[os.path.basename(in_images[0])])
+        update_mosaic(output_dir, projected_dir, new_images=in_images[:1])
+        for filename in ['mosaic.fits', 'mosaic_area.fits']:
+            expected = fits.getdata(os.path.join(self.tmpdir, 'mosaic_full', filename))
+            actual = fits.getdata(os.path.join(output_dir, filename))
+            assert_allclose(actual, expected, rtol=1e-5)
+
+    def test_mosaic_tiles(self):
+        raw_dir = os.path.join(self.tmpdir, 'raw')
+        header = os.path.join(self.tmpdir, 'tiles.hdr')
+        images_tbl = os.path.join(self.tmpdir, 'tiles.tbl')
+        mImgtbl(raw_dir, images_tbl)
+        mMakeHdr(images_tbl, header)
+        mosaic(raw_dir, os.path.join(self.tmpdir, 'mosaic_untiled'),
+               header=header, exact_size=True)
+        work_dir = os.path.join(self.tmpdir, 'work_stitched')
+        mosaic(raw_dir, os.path.join(self.tmpdir, 'mosaic_stitched'),
+               header=header, tiles=(3, 2), parallel='processes', n_proc=4,
+               work_dir=work_dir)
+        assert not os.path.exists(work_dir)
+        assert sorted(os.listdir(os.path.join(self.tmpdir, 'mosaic_stitched'))) == \
+            ['images_projected.tbl', 'mosaic.fits', 'mosaic_area.fits']
+        work_dir = os.path.join(self.tmpdir, 'work_tiled')
+        mosaic(raw_dir, os.path.join(self.tmpdir, 'mosaic_tiled'),
+               header=header, tiles=(3, 2), stitch_tiles=False, work_dir=work_dir)
+        assert not os.path.exists(work_dir)
+        expected = fits.getdata(os.path.join(self.tmpdir, 'mosaic_untiled', 'mosaic.fits'))
+        actual = fits.getdata(os.path.join(self.tmpdir, 'mosaic_stitched', 'mosaic.fits'))
+        assert_allclose(actual, expected)
+        tiles = glob.glob(os.path.join(self.tmpdir, 'mosaic_tiled', 'mosaic_*_*.fits'))
+        assert len(tiles) == 12
+
+    def test_reproject_parallel(self):
+        in_images = sorted(glob.glob(os.path.join(self.tmpdir, 'raw', '*.fits')))[:4]
+        out_images = [os.path.join(self.tmpdir, 'reprojected_{0}.fits'.format(i))
+                      for i in range(len(in_images))]
+        reproject(in_images, out_images, north_aligned=True, n_workers=4)
+        for out_image in out_images:
+            assert os.path.exists(out_image)
+
+    def _make_cube(self):
+        in_image = os.path.join(self.tmpdir, 'raw', 'test_00_00.fits')
+        header = fits.getheader(in_image)
+        header_file = os.path.join(self.tmpdir, 'cube_target.hdr')
+        cube_file = os.path.join(self.tmpdir, 'cube.fits')
+        if not os.path.exists(cube_file):
+            with open(header_file, 'w') as f:
+                f.write(header.tostring(sep='\n', padding=False) + '\n')
+            cube = fits.PrimaryHDU(np.random.random((5, 100, 100)), header=header)
+            cube.header['CTYPE3'] = 'VELO-LSR'
+            cube.writeto(cube_file)
+        return cube_file, header_file
+
+    def test_reproject_cube_parallel(self):
+        cube_file, header_file = self._make_cube()
+        out_serial = os.path.join(self.tmpdir, 'cube_serial.fits')
+        out_parallel = os.path.join(self.tmpdir, 'cube_parallel.fits')
+        reproject_cube(cube_file, out_serial, header=header_file)
+        reproject_cube(cube_file, out_parallel, header=header_file, n_workers=3)
+        data_serial = fits.getdata(out_serial)
+        data_parallel = fits.getdata(out_parallel)
+        assert data_parallel.shape == (5, 100, 100)
+        np.testing.assert_array_equal(data_serial, data_parallel)
+
+    def test_reproject_cube_bitpix(self):
+        cube_file, header_file = self._make_cube()
+        out_image = os.path.join(self.tmpdir, 'cube_float32.fits')
+        reproject_cube(cube_file, out_image, header=header_file, bitpix=-32)
+        with fits.open(out_image) as hdulist:
+            assert hdulist[0].header['BITPIX'] == -32
+            assert hdulist[0].header['NAXIS3'] == 5
+            assert hdulist[0].data.shape == (5, 100, 100)
+
+    def test_reproject_cube_bitpix_integer(self):
+        cube_file, header_file = self._make_cube()
+        # Values that do not fit in 16-bit integers have to be scaled
+        cube = fits.open(cube_file)[0]
+        cube.data = cube.data * 3e5 - 1e5
+        scaled_file = os.path.join(self.tmpdir, 'cube_scaled.fits')
+        cube.writeto(scaled_file)
+        out_float = os.path.join(self.tmpdir, 'cube_scaled_float.fits')
+        out_int = os.path.join(self.tmpdir, 'cube_scaled_int16.fits')
+        reproject_cube(scaled_file, out_float, header=header_file, plan=True)
+        reproject_cube(scaled_file, out_int, header=header_file, plan=True,
+                       bitpix=16)
+        with fits.open(out_int) as hdulist:
+            assert hdulist[0].header['BITPIX'] == 16
+            bscale = hdulist[0].header['BSCALE']
+            data_int = hdulist[0].data
+        data_float = fits.getdata(out_float)
+        np.testing.assert_array_equal(np.isnan(data_int), np.isnan(data_float))
+        valid = ~np.isnan(data_float)
+        assert_allclose(data_int[valid], data_float[valid], atol=bscale)
+
+    def test_reproject_cube_channels(self):
+        cube_file, header_file = self._make_cube()
+        out_all = os.path.join(self.tmpdir, 'cube_channels_all.fits')
+        out_subset = os.path.join(self.tmpdir, 'cube_channels_subset.fits')
+        reproject_cube(cube_file, out_all, header=header_file)
+        reproject_cube(cube_file, out_subset, header=header_file,
+                       channels=slice(1, 5, 2))
+        data_all = fits.getdata(out_all)
+        data_subset = fits.getdata(out_subset)
+        assert data_subset.shape == (2, 100, 100)
+        np.testing.assert_array_equal(data_subset, data_all[1:5:2])
+
+    def test_reproject_cube_plan(self):
+        cube_file, header_file = self._make_cube()
+        out_montage = os.path.join(self.tmpdir, 'cube_montage.fits')
+        out_plan = os.path.join(self.tmpdir, 'cube_plan.fits')
+        reproject_cube(cube_file, out_montage, header=header_file)
+        reproject_cube(cube_file, out_plan, header=header_file, plan=True)
+        data_montage = fits.getdata(out_montage)
+        data_plan = fits.getdata(out_plan)
+        assert data_plan.shape == data_montage.shape
+        valid = ~np.isnan(data_montage) & ~np.isnan(data_plan)
+        assert_allclose(data_plan[valid], data_montage[valid], rtol=1e-3)
+
+    def test_reproject_exact_size(self):
+        cube_file, header_file = self._make_cube()
+        in_image = os.path.join(self.tmpdir, 'raw', 'test_01_01.fits')
+        out_image = os.path.join(self.tmpdir, 'reprojected_exact.fits')
+        reproject(in_image, out_image, header=header_file, exact_size=True)
+        with fits.open(out_image) as hdulist:
+            assert hdulist[0].data.shape == (100, 100)
+            assert hdulist[0].header['CRPIX1'] == 50.5
+            assert hdulist[0].header['CRPIX2'] == 50.5
+
+    def test_reproject_array(self):
+        cube_file, header_file = self._make_cube()
+        in_image = os.path.join(self.tmpdir, 'raw', 'test_01_01.fits')
+        data, header = fits.getdata(in_image, header=True)
+        out_data, out_header = reproject_array(data, header, header=header_file,
+                                               exact_size=True)
+        assert out_data.shape == (100, 100)
+        assert out_header['NAXIS1'] == 100
+        out_hdu = reproject_hdu(fits.PrimaryHDU(data, header), header=header_file,
+                                exact_size=True)
+        np.testing.assert_array_equal(out_hdu.data, out_data)
+
+
+class TestMoveImage(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    @pytest.mark.parametrize('bitpix', [None, 16, -32])
+    def test_same_bitpix(self, monkeypatch, bitpix):
+
+        # The image should be renamed without being converted or rewritten
+
+        def fail(*args, **kwargs):
+            raise AssertionError("The image should not be rewritten")
+
+        monkeypatch.setattr(wrappers.m, 'mConvert', fail)
+        monkeypatch.setattr(wrappers.fits_utils, 'convert_image', fail)
+        monkeypatch.setattr(wrappers.fits_utils, 'crop_to_header', fail)
+
+        in_image = os.path.join(self.tmpdir, 'in.fits')
+        out_image = os.path.join(self.tmpdir, 'out.fits')
+        if bitpix is not None and bitpix > 0:
+            data = np.arange(12, dtype=np.int16).reshape((3, 4))
+            data[1, 1] = -32768
+            hdu = fits.PrimaryHDU(data)
+            hdu.header['BLANK'] = -32768
+        else:
+            data = np.arange(12, dtype=np.float32).reshape((3, 4))
+            data[1, 1] = np.nan
+            hdu = fits.PrimaryHDU(data)
+        hdu.writeto(in_image)
+        with open(in_image, 'rb') as f:
+            contents = f.read()
+
+        wrappers._move_image(in_image, out_image, bitpix=bitpix)
+
+        assert not os.path.exists(in_image)
+        with open(out_image, 'rb') as f:
+            assert f.read() == contents
+        with fits.open(out_image) as hdulist:
+            assert np.isnan(hdulist[0].data[1, 1])
+
+
+class TestScratchDir(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.scratch_dir = os.path.join(self.tmpdir, 'scratch')
+        os.mkdir(self.scratch_dir)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_free_space(self, monkeypatch):
+        monkeypatch.setattr(wrappers, 'SCRATCH_DIRS', [self.scratch_dir])
+        assert wrappers._get_scratch_dir(1024) == self.scratch_dir
+        assert wrappers._get_scratch_dir(2 ** 70) is None
+
+    def test_scratch_size(self, monkeypatch):
+
+        # The space needed depends on the size of the header template, which
+        # can be much larger than the input image
+
+        header = fits.Header()
+        header['NAXIS'] = 2
+        header['NAXIS1'] = 1000
+        header['NAXIS2'] = 500
+        header_file = os.path.join(self.tmpdir, 'header.hdr')
+        wrappers.fits_utils.write_header_file(header, header_file)
+
+        data = np.zeros((10, 20))
+        assert wrappers._scratch_size(data) == 8 * 200 * (1 + wrappers.SCRATCH_COPIES)
+        assert wrappers._scratch_size(data, header_file) == \
+            8 * (200 + 500000 * wrappers.SCRATCH_COPIES)
+
+        sizes = []
+
+        def fake_get_scratch_dir(n_bytes=0):
+            sizes.append(n_bytes)
+            return None
+
+        monkeypatch.setattr(wrappers, '_get_scratch_dir', fake_get_scratch_dir)
+        monkeypatch.setattr(wrappers, '_reproject_array', lambda *args, **kwargs: None)
+        reproject_array(data, fits.Header(), header=header_file)
+        assert sizes == [wrappers._scratch_size(data, header_file)]
+
+    def test_reproject_array_fallback(self, monkeypatch):
+
+        # Simulate a scratch directory which fills up during reprojection
+
+        work_dirs = []
+
+        def fake_reproject(in_image, out_image, **kwargs):
+            work_dirs.append(os.path.dirname(os.path.dirname(out_image)))
+            if out_image.startswith(self.scratch_dir):
+                raise IOError(errno.ENOSPC, "No space left on device")
+            shutil.copy(in_image, out_image)
+
+        monkeypatch.setattr(wrappers, 'SCRATCH_DIRS', [self.scratch_dir])
+        monkeypatch.setattr(wrappers, 'reproject', fake_reproject)
+
+        data = np.arange(12.).reshape((3, 4))
+        out_data, out_header = reproject_array(data, fits.Header())
+
+        np.testing.assert_array_equal(out_data, data)
+        assert work_dirs == [self.scratch_dir, tempfile.gettempdir()]
+        assert os.listdir(self.scratch_dir) == []
+
+
+class TestReprojectArray(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_header_template(self, monkeypatch):
+
+        # The header template is passed on to reproject, separately from the
+        # header of the input image
+
+        templates = []
+
+        def fake_reproject(in_image, out_image, header=None, **kwargs):
+            templates.append(header)
+            assert fits.getval(in_image, 'OBJECT') == 'test'
+            shutil.copy(in_image, out_image)
+
+        monkeypatch.setattr(wrappers, 'reproject', fake_reproject)
+
+        data = np.arange(12.).reshape((3, 4))
+        in_header = fits.Header()
+        in_header['OBJECT'] = 'test'
+
+        template = fits.Header()
+        template['NAXIS'] = 2
+        template['NAXIS1'] = 4
+        template['NAXIS2'] = 3
+        header_file = os.path.join(self.tmpdir, 'template.hdr')
+        wrappers.fits_utils.write_header_file(template, header_file)
+
+        out_data, out_header = reproject_array(data, in_header, header=header_file)
+        np.testing.assert_array_equal(out_data, data)
+        out_hdu = reproject_hdu(fits.PrimaryHDU(data, in_header), header=header_file)
+        np.testing.assert_array_equal(out_hdu.data, data)
+        assert templates == [header_file, header_file]
+
+
+class TestProjectAuto(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.calls = []
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, ctype='TAN', distortion=False, extension=False):
+        header = fits.Header()
+        header['CTYPE1'] = 'RA---' + ctype
+        header['CTYPE2'] = 'DEC--' + ctype
+        header['CRVAL1'] = 10.
+        header['CRVAL2'] = 20.
+        header['CRPIX1'] = 5.
+        header['CRPIX2'] = 5.
+        header['CDELT1'] = -0.01
+        header['CDELT2'] = 0.01
+        if distortion:
+            header['PV2_1'] = 0.1
+        in_image = os.path.join(self.tmpdir, 'in_%s.fits' % ctype)
+        if extension:
+            # Multi-extension file with an empty primary HDU
+            fits.HDUList([fits.PrimaryHDU(),
+                          fits.ImageHDU(np.zeros((10, 10)), header)]).writeto(in_image)
+        else:
+            fits.writeto(in_image, np.zeros((10, 10)), header)
+        header['NAXIS'] = 2
+        header['NAXIS1'] = 10
+        header['NAXIS2'] = 10
+        header_file = os.path.join(self.tmpdir, 'header_%s.hdr' % ctype)
+        with open(header_file, 'w') as f:
+            f.write(header.tostring(sep='\n', padding=False) + '\nEND\n')
+        return in_image, header_file
+
+    def _patch(self, monkeypatch, pp_fails=False):
+
+        def fake_mProjectPP(*args, **kwargs):
+            self.calls.append('mProjectPP')
+            if pp_fails:
+                raise MontageError("mProjectPP: failed")
+
+        def fake_mProject(*args, **kwargs):
+            self.calls.append('mProject')
+
+        monkeypatch.setattr(wrappers.m, 'mProjectPP', fake_mProjectPP)
+        monkeypatch.setattr(wrappers.m, 'mProject', fake_mProject)
+        monkeypatch.setattr(wrappers, '_PLANE_TO_PLANE_FAILED', set())
+
+    def test_plane_to_plane_supported(self):
+        header = fits.Header()
+        header['CTYPE1'] = 'RA---TAN-SIP'
+        header['CTYPE2'] = 'DEC--TAN-SIP'
+        assert wrappers._plane_to_plane_supported(header)
+        header['PV2_1'] = 0.1
+        assert not wrappers._plane_to_plane_supported(header)
+        header = fits.Header()
+        header['CTYPE1'] = 'GLON-CAR'
+        header['CTYPE2'] = 'GLAT-CAR'
+        assert not wrappers._plane_to_plane_supported(header)
+
+    @pytest.mark.parametrize(('ctype', 'distortion'), [('CAR', False), ('TAN', True)])
+    def test_unsupported_header(self, monkeypatch, ctype, distortion):
+        # mProject is selected up front for headers mProjectPP cannot handle
+        self._patch(monkeypatch)
+        in_image, header_file = self._write(ctype, distortion=distortion)
+        wrappers.mProject_auto(in_image, os.path.join(self.tmpdir, 'out.fits'),
+                               header_file)
+        assert self.calls == ['mProject']
+
+    @pytest.mark.parametrize('hdu', [None, 1])
+    def test_extension(self, monkeypatch, hdu):
+        # The WCS of the image extension is used to select mProjectPP
+        self._patch(monkeypatch)
+        in_image, header_file = self._write(extension=True)
+        wrappers.mProject_auto(in_image, os.path.join(self.tmpdir, 'out.fits'),
+                               header_file, hdu=hdu)
+        assert self.calls == ['mProjectPP']
+
+    def test_failure_cache(self, monkeypatch):
+        self._patch(monkeypatch, pp_fails=True)
+        in_image, header_file = self._write()
+        out_image = os.path.join(self.tmpdir, 'out.fits')
+        wrappers.mProject_auto(in_image, out_image, header_file)
+        assert self.calls == ['mProjectPP', 'mProject']
+        # The failure is remembered, so mProjectPP is not retried
+        wrappers.mProject_auto(in_image, out_image, header_file)
+        assert self.calls == ['mProjectPP', 'mProject', 'mProject']
+        assert len(wrappers._PLANE_TO_PLANE_FAILED) == 1
+
+    def test_success_not_cached(self, monkeypatch):
+        self._patch(monkeypatch)
+        in_image, header_file = self._write()
+        out_image = os.path.join(self.tmpdir, 'out.fits')
+        wrappers.mProject_auto(in_image, out_image, header_file)
+        wrappers.mProject_auto(in_image, out_image, header_file)
+        assert self.calls == ['mProjectPP', 'mProjectPP']
+
+
+class TestCheckpoints(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def _interrupt(self, fingerprint):
+
+        def interrupted():
+            raise KeyboardInterrupt()
+
+        checkpoints = wrappers._Checkpoints(self.tmpdir, resume=True)
+        with pytest.raises(KeyboardInterrupt):
+            checkpoints.run('stage', interrupted, fingerprint)
+
+    def _resume(self, fingerprint):
+        checkpoints = wrappers._Checkpoints(self.tmpdir, resume=True)
+        return checkpoints.run('stage',
+                               lambda: checkpoints.interrupted('stage', fingerprint),
+                               fingerprint)
+
+    def test_interrupted(self):
+        self._interrupt('a')
+        assert self._resume('a')
+        # The stage completed, so it is no longer interrupted
+        assert self._resume('a') is None
+
+    def test_interrupted_changed_inputs(self):
+        self._interrupt('a')
+        assert not self._resume('b')
+
+
+class TestCleanup(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_update_mosaic_error(self):
+
+        # The work directory should be removed even if the update fails
+
+        from astropy.table import Table
+
+        output_dir = os.path.join(self.tmpdir, 'mosaic')
+        os.mkdir(output_dir)
+        for name in ['mosaic.fits', 'mosaic_area.fits']:
+            fits.writeto(os.path.join(output_dir, name), np.zeros((10, 20)))
+        Table({'cntr': [0], 'fname': ['a.fits']}).write(
+            os.path.join(output_dir, 'images_projected.tbl'), format='ascii.ipac')
+
+        work_dir = os.path.join(self.tmpdir, 'work')
+        with pytest.raises(MontageError):
+            update_mosaic(output_dir, self.tmpdir, removed_images=['b.fits'],
+                          work_dir=work_dir)
+        assert not os.path.exists(work_dir)
+
+    def test_mosaic_error(self, monkeypatch):
+
+        # The work directory should be removed if the mosaic fails, unless it
+        # is needed to resume the mosaic
+
+        input_dir = os.path.join(self.tmpdir, 'raw')
+        os.mkdir(input_dir)
+        fits.writeto(os.path.join(input_dir, 'a.fits'), np.zeros((10, 20)))
+        output_dir = os.path.join(self.tmpdir, 'mosaic')
+        os.mkdir(output_dir)
+
+        work_dir = os.path.join(self.tmpdir, 'work')
+        with pytest.raises(IOError):
+            mosaic(input_dir, output_dir, work_dir=work_dir)
+        assert not os.path.exists(work_dir)
+
+        def fail(*args, **kwargs):
+            raise MontageError("Failed")
+
+        monkeypatch.setattr(wrappers, '_image_table', fail)
+        with pytest.raises(MontageError):
+            mosaic(input_dir, output_dir, work_dir=work_dir, resume=True)
+        assert os.path.exists(work_dir)
+
+
+    def test_reproject_cube_error(self, monkeypatch):
+
+        # The work directory and the partial output cube should be removed if
+        # one of the planes fails
+
+        w = WCS(naxis=3)
+        w.wcs.crpix = [10.5, 6.5, 1.]
+        w.wcs.cdelt = [-0.01, 0.01, 1.]
+        w.wcs.crval = [10., 20., 0.]
+        w.wcs.ctype = ["RA---TAN", "DEC--TAN", "FREQ"]
+        in_image = os.path.join(self.tmpdir, 'cube.fits')
+        fits.writeto(in_image, np.zeros((3, 12, 20)), w.to_header())
+        header = w.celestial.to_header()
+        header['NAXIS'] = 2
+        header['NAXIS1'] = 20
+        header['NAXIS2'] = 12
+        header_hdr = os.path.join(self.tmpdir, 'header.hdr')
+        wrappers.fits_utils.write_header_file(header, header_hdr)
+
+        planes = []
+
+        def fake_reproject_array(data, in_header, **kwargs):
+            planes.append(data)
+            if len(planes) == 2:
+                raise MontageError("Failed")
+            return np.zeros((12, 20)), header
+
+        mkdtemp = tempfile.mkdtemp
+        monkeypatch.setattr(wrappers.tempfile, 'mkdtemp',
+                            lambda: mkdtemp(dir=self.tmpdir))
+        monkeypatch.setattr(wrappers, 'reproject_array', fake_reproject_array)
+
+        out_image = os.path.join(self.tmpdir, 'out.fits')
+        with pytest.raises(MontageError):
+            reproject_cube(in_image, out_image, header=header_hdr)
+        assert len(planes) == 2
+        assert sorted(os.listdir(self.tmpdir)) == ['cube.fits', 'header.hdr']
+
+
+class TestStitchTiles(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        w = WCS(naxis=2)
+        w.wcs.crpix = [10.5, 6.5]
+        w.wcs.cdelt = [-0.01, 0.01]
+        w.wcs.crval = [10., 20.]
+        w.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+        self.header = w.to_header()
+        self.header['NAXIS'] = 2
+        self.header['NAXIS1'] = 20
+        self.header['NAXIS2'] = 12
+        self.header_hdr = os.path.join(self.tmpdir, 'header.hdr')
+        wrappers.fits_utils.write_header_file(self.header, self.header_hdr)
+        self.data = np.random.random((12, 20))
+        self.area = np.random.random((12, 20))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def write_image(self, filename, x0=0, y0=0, nx=20, ny=12):
+        header = self.header.copy()
+        header['CRPIX1'] -= x0
+        header['CRPIX2'] -= y0
+        fits.writeto(filename, self.data[y0:y0 + ny, x0:x0 + nx], header)
+        fits.writeto(filename[:-5] + '_area.fits', self.area[y0:y0 + ny, x0:x0 + nx], header)
+
+    @pytest.mark.parametrize('bitpix', [-32, -64])
+    def test_stitch_tiles(self, bitpix):
+        tile_images = []
+        for ix, (x0, nx) in enumerate([(0, 8), (8, 12)]):
+            for iy, (y0, ny) in enumerate([(0, 5), (5, 7)]):
+                tile_image = os.path.join(self.tmpdir, 'mosaic_%i_%i.fits' % (ix, iy))
+                self.write_image(tile_image, x0, y0, nx, ny)
+                tile_images.append(tile_image)
+        out_image = os.path.join(self.tmpdir, 'mosaic.fits')
+        wrappers._stitch_tiles(tile_images, self.header_hdr, out_image, bitpix=bitpix)
+        for filename, expected in [(out_image, self.data),
+                                   (out_image[:-5] + '_area.fits', self.area)]:
+            with fits.open(filename) as hdulist:
+                assert hdulist[0].header['BITPIX'] == bitpix
+                assert_allclose(hdulist[0].data, expected, rtol=1e-6)
+
+    def test_move_with_area(self):
+        in_image = os.path.join(self.tmpdir, 'mosaic64.fits')
+        out_image = os.path.join(self.tmpdir, 'mosaic.fits')
+        self.write_image(in_image)
+        wrappers._move_with_area(in_image, out_image, bitpix=-32)
+        assert not os.path.exists(in_image)
+        assert not os.path.exists(in_image[:-5] + '_area.fits')
+        for filename, expected in [(out_image, self.data),
+                                   (out_image[:-5] + '_area.fits', self.area)]:
+            with fits.open(filename) as hdulist:
+                assert hdulist[0].header['BITPIX'] == -32
+                assert_allclose(hdulist[0].data, expected, rtol=1e-6)
+
+
+class TestResumeCache(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.raw_dir = os.path.join(self.tmpdir, 'raw')
+        os.mkdir(self.raw_dir)
+        w = WCS(naxis=2)
+        w.wcs.crpix = [10.5, 6.5]
+        w.wcs.cdelt = [-0.01, 0.01]
+        w.wcs.crval = [10., 20.]
+        w.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+        header = w.to_header()
+        for i in range(3):
+            fits.writeto(os.path.join(self.raw_dir, 'image_%i.fits' % i),
+                         np.random.random((12, 20)), header)
+        header['NAXIS'] = 2
+        header['NAXIS1'] = 20
+        header['NAXIS2'] = 12
+        self.header = os.path.join(self.tmpdir, 'header.hdr')
+        wrappers.fits_utils.write_header_file(header, self.header)
+        self.projected = []
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def fake_mProject_auto(self, in_image, out_image, template_header, **kwargs):
+        # The images are already on the projection of the header template
+        self.projected.append(os.path.basename(in_image))
+        shutil.copy(in_image, out_image)
+        fits.writeto(out_image[:-5] + '_area.fits', np.ones((12, 20)),
+                     fits.getheader(in_image))
+
+    def test_resume_interrupted_projection(self, monkeypatch):
+
+        # When a projection cache is used, an interrupted projection is not
+        # restarted with mProjExec's restart_rec, so the stats table should
+        # not list any frame twice
+
+        from astropy.table import Table
+
+        monkeypatch.setattr(wrappers, 'mProject_auto', self.fake_mProject_auto)
+
+        work_dir = os.path.join(self.tmpdir, 'work')
+        output_dir = os.path.join(self.tmpdir, 'mosaic')
+        kwargs = dict(header=self.header, work_dir=work_dir, cleanup=False,
+                      resume=True, n_workers=2, spatial_index=True,
+                      projection_cache=os.path.join(self.tmpdir, 'cache'))
+
+        mosaic(self.raw_dir, output_dir, **kwargs)
+        assert len(self.projected) == 3
+
+        # Simulate an interrupted projection
+        marker_file = os.path.join(work_dir, 'checkpoints', 'project_frames.json')
+        with open(marker_file) as f:
+            marker = json.load(f)
+        marker['complete'] = False
+        with open(marker_file, 'w') as f:
+            json.dump(marker, f)
+
+        mosaic(self.raw_dir, output_dir, **kwargs)
+
+        # All frames are fetched from the cache rather than projected again
+        assert len(self.projected) == 3
+        stats = Table.read(os.path.join(work_dir, 'stats.tbl'), format='ascii.ipac')
+        assert sorted(stats['fname']) == ['image_0.fits', 'image_1.fits', 'image_2.fits']
+        assert list(stats['stat']) == ['CACHED'] * 3
+
+
+    def test_header_too_large(self, monkeypatch):
+
+        # Headers covering a hemisphere or more are passed on to mSubset
+        # rather than to the spatial index
+
+        w = WCS(naxis=2)
+        w.wcs.crpix = [180.5, 90.5]
+        w.wcs.cdelt = [-1., 1.]
+        w.wcs.ctype = ["RA---CAR", "DEC--CAR"]
+        header = w.to_header()
+        header['NAXIS'] = 2
+        header['NAXIS1'] = 360
+        header['NAXIS2'] = 180
+        wrappers.fits_utils.write_header_file(header, self.header)
+
+        calls = []
+
+        def fake_mSubset(images_table, template_header, subset_table, **kwargs):
+            calls.append(template_header)
+            raise MontageError("Failed")
+
+        monkeypatch.setattr(wrappers.m, 'mSubset', fake_mSubset)
+
+        with pytest.raises(MontageError):
+            mosaic(self.raw_dir, os.path.join(self.tmpdir, 'mosaic'),
+                   header=self.header, n_workers=2, spatial_index=True)
+        assert len(calls) == 1
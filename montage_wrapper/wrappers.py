@@ -1,9 +1,13 @@
-import atexit
+import errno
+import hashlib
+import json
 import os
+import re
 import glob
 import shutil as sh
 import warnings
 import tempfile
+from multiprocessing.pool import ThreadPool
 
 import numpy
 
@@ -11,8 +15,34 @@ from astropy.io import fits
 from astropy import log
 
 from . import commands as m
+from . import background
+from . import coadd
+from .cache import ProjectionCache
+from . import fits_utils
+from . import metadata
+from . import pool
+from . import projection
+from . import spatial
+from . import status
 from .status import MontageError
 
+# RAM-backed directories to use for temporary files, in order of preference
+SCRATCH_DIRS = ['/dev/shm']
+
+# Number of 64-bit copies of the reprojected image that the temporary files
+# of reproject_array can take up (the projected image and its area map, and
+# the output image), in addition to a copy of the input image
+SCRATCH_COPIES = 3
+
+# Keywords defining the WCS of an image, and distortion keywords that
+# mProjectPP cannot handle
+WCS_KEYWORDS = '^(NAXIS[12]|CTYPE|CRVAL|CRPIX|CDELT|CROTA|CD[12]_|PC[12]_|PV|[AB]P?_|EQUINOX|EPOCH|RADE|LONPOLE|LATPOLE|PLT|PPO|AMD|CNPIX|XPIXELSZ|YPIXELSZ)'
+DISTORTION_KEYWORDS = re.compile('^(PV[12]_[0-9]+|PLTRAH|AMDX[0-9]+)$')
+
+# Fingerprints of (input WCS, header template) pairs for which mProjectPP
+# has failed, so that mProject can be used directly next time
+_PLANE_TO_PLANE_FAILED = set()
+
 
 def _finalize(cleanup, work_dir, silence=False):
     if cleanup:
@@ -26,45 +56,256 @@ def _finalize(cleanup, work_dir, silence=False):
             log.info("Leaving work directory %s" % work_dir)
 
 
-def reproject_hdu(in_hdu, **kwargs):
+def _map_parallel(function, items, n_workers=None, labels=None):
     '''
-    Reproject an image (HDU version)
+    Call ``function`` on each of ``items`` and return the results in order.
+
+    If ``n_workers`` is set, the calls are made from a pool of ``n_workers``
+    threads (the work itself is done by Montage subprocesses, so threads are
+    sufficient). In that case, all items are processed even if some fail, and
+    a single MontageError listing the failures (identified by ``labels``) is
+    raised at the end.
+    '''
+
+    if not n_workers or n_workers < 2:
+        return [function(item) for item in items]
+
+    def call(item):
+        try:
+            return function(item), None
+        except Exception as exc:
+            return None, exc
+
+    pool = ThreadPool(n_workers)
+    try:
+        outcomes = pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+    if labels is None:
+        labels = items
+
+    errors = ["%s: %s" % (label, exc)
+              for label, (result, exc) in zip(labels, outcomes)
+              if exc is not None]
+
+    if errors:
+        raise MontageError("%i of %i items failed:\n" % (len(errors), len(outcomes))
+                           + "\n".join(errors))
+
+    return [result for result, exc in outcomes]
+
+
+def _move_image(in_image, out_image, bitpix=None, header=None):
+    '''
+    Move an image written by Montage to its final location, converting it to
+    ``bitpix`` and padding or cropping it to the exact size of ``header`` if
+    needed, with as few passes over the data as possible. If the image
+    already has the right BITPIX and size, it is simply renamed.
+    '''
+
+    if bitpix == fits.getval(in_image, 'BITPIX'):
+        bitpix = None
+
+    if bitpix is not None and bitpix > 0:
+        # conversion to integer types relies on the scaling done by mConvert
+        if header is not None:
+            exact_image = in_image.replace('.fits', '_exact.fits')
+            fits_utils.crop_to_header(in_image, exact_image, header)
+            os.remove(in_image)
+            in_image = exact_image
+        m.mConvert(in_image, out_image, bitpix=bitpix)
+        os.remove(in_image)
+    elif header is not None:
+        fits_utils.crop_to_header(in_image, out_image, header, bitpix=bitpix)
+        os.remove(in_image)
+    elif bitpix is None:
+        sh.move(in_image, out_image)
+    else:
+        fits_utils.convert_image(in_image, out_image, bitpix)
+        os.remove(in_image)
+
+
+def _move_with_area(in_image, out_image, bitpix=None):
+    '''
+    Move an image written by mAdd and its area map to their final location
+    with _move_image, converting both at the same time.
+    '''
+    _map_parallel(lambda suffix: _move_image(in_image[:-5] + suffix + '.fits',
+                                             out_image[:-5] + suffix + '.fits',
+                                             bitpix=bitpix),
+                  ['', '_area'], n_workers=2)
+
+
+def _scratch_size(data, template_header=None):
+    '''
+    Estimate the space taken up by the temporary files of reproject_array for
+    an input image reprojected onto a header template (the reprojected image
+    is assumed to be as large as the input image if no template is given).
+    '''
+    n_in = numpy.size(data)
+    if template_header is None:
+        n_out = n_in
+    else:
+        header = fits_utils.read_header_file(template_header)
+        n_out = header['NAXIS1'] * header['NAXIS2']
+    return 8 * (n_in + SCRATCH_COPIES * n_out)
+
+
+def _get_scratch_dir(n_bytes=0):
+    '''
+    Return a RAM-backed directory with at least ``n_bytes`` of free space in
+    which to create temporary work directories for small images, or `None`
+    if none is available (in which case the default temporary directory is
+    used).
+    '''
+    for directory in SCRATCH_DIRS:
+        if os.path.isdir(directory) and os.access(directory, os.W_OK):
+            try:
+                stat = os.statvfs(directory)
+            except (AttributeError, OSError):
+                continue
+            if stat.f_bavail * stat.f_frsize >= n_bytes:
+                return directory
+    return None
+
+
+def _out_of_space(exc):
+    '''
+    Whether an exception was caused by a full disk, either in Python or in a
+    Montage command.
+    '''
+    return (getattr(exc, 'errno', None) == errno.ENOSPC or
+            'No space left on device' in str(exc))
+
+
+def _image_table(directory, images_table, n_workers=None, index=None,
+                 **kwargs):
+    '''
+    Build an image table with mImgtbl, or in Python if ``n_workers`` or
+    ``index`` is set.
+    '''
+    if n_workers or index:
+        return metadata.build_image_table(directory, images_table,
+                                          n_workers=n_workers or 16,
+                                          index=index, **kwargs)
+    else:
+        return m.mImgtbl(directory, images_table, **kwargs)
+
+
+def reproject_array(data, in_header, **kwargs):
+    '''
+    Reproject an image (array version)
+
+    The temporary files needed by Montage are written to a RAM-backed
+    directory (such as ``/dev/shm``) if one is available with enough free
+    space for the input and reprojected images. If this directory fills up
+    anyway, the reprojection is run again in the default temporary
+    directory.
 
     Parameters
     ----------
-    in_hdu : :class:`~astropy.io.fits.PrimaryHDU` or :class:`~astropy.io.fits.ImageHDU`
-        Input FITS HDU to be reprojected.
+    data : `numpy.ndarray`
+        Input image to be reprojected.
+    in_header : :class:`~astropy.io.fits.Header`
+        Header of the input image.
+    scratch_dir : str, optional
+        Directory in which to create the temporary work directories. By
+        default, a RAM-backed directory is used if available.
+
+    Returns
+    -------
+    data : `numpy.ndarray`
+        The reprojected image, loaded in memory.
+    header : :class:`~astropy.io.fits.Header`
+        The header of the reprojected image.
 
     Notes
     -----
     Additional keyword arguments are passed to :func:`~montage_wrapper.wrappers.reproject`
+    (including ``header``, the header template to reproject the image to)
+    '''
+
+    scratch_dir = kwargs.pop('scratch_dir', None)
+
+    if scratch_dir is not None:
+        return _reproject_array(data, in_header, scratch_dir, **kwargs)
+
+    scratch_dir = _get_scratch_dir(_scratch_size(data, kwargs.get('header')))
+
+    if scratch_dir is None:
+        return _reproject_array(data, in_header, None, **kwargs)
+
+    try:
+        return _reproject_array(data, in_header, scratch_dir, **kwargs)
+    except Exception as exc:
+        if not _out_of_space(exc):
+            raise
+        log.info("Not enough space in %s, using the default temporary "
+                 "directory instead" % scratch_dir)
+        return _reproject_array(data, in_header, tempfile.gettempdir(), **kwargs)
+
+
+def _reproject_array(data, in_header, scratch_dir, **kwargs):
+    '''
+    Reproject an array with temporary files in ``scratch_dir``.
     '''
 
     cleanup = kwargs.get('cleanup', True)
     silent_cleanup = kwargs.get('silent_cleanup', True)
 
     # Make work directory
-    work_dir = tempfile.mkdtemp()
+    work_dir = tempfile.mkdtemp(dir=scratch_dir)
 
     try:
         in_image = os.path.join(work_dir, 'in.fits')
         out_image = os.path.join(work_dir, 'out.fits')
 
-        fits.writeto(in_image, in_hdu.data, in_hdu.header)
+        fits.writeto(in_image, data, in_header)
 
-        reproject(in_image, out_image, **kwargs)
+        reproject(in_image, out_image, scratch_dir=scratch_dir, **kwargs)
 
-        out_hdu = fits.open(out_image)[0]
+        # Read the data into memory so that no file handles are left open
+        # once the work directory is removed
+        with fits.open(out_image, memmap=False) as hdulist:
+            out_data = hdulist[0].data
+            out_header = hdulist[0].header
 
-        return out_hdu
+        return out_data, out_header
     finally:
         _finalize(cleanup, work_dir, silent_cleanup)
 
 
+def reproject_hdu(in_hdu, **kwargs):
+    '''
+    Reproject an image (HDU version)
+
+    Parameters
+    ----------
+    in_hdu : :class:`~astropy.io.fits.PrimaryHDU` or :class:`~astropy.io.fits.ImageHDU`
+        Input FITS HDU to be reprojected.
+
+    Returns
+    -------
+    out_hdu : :class:`~astropy.io.fits.PrimaryHDU`
+        The reprojected HDU, with the data loaded in memory.
+
+    Notes
+    -----
+    Additional keyword arguments are passed to :func:`~montage_wrapper.wrappers.reproject_array`
+    '''
+
+    data, header = reproject_array(in_hdu.data, in_hdu.header, **kwargs)
+
+    return fits.PrimaryHDU(data=data, header=header)
+
+
 def reproject_cube(in_image, out_image, header=None, bitpix=None,
                    north_aligned=False, system=None, equinox=None, factor=None,
                    common=False, cleanup=True, clobber=False,
-                   silent_cleanup=True, hdu=0):
+                   silent_cleanup=True, hdu=0, n_workers=None, channels=None,
+                   plan=False):
     '''
     Cube reprojection routine.
 
@@ -90,6 +331,8 @@ def reproject_cube(in_image, out_image, header=None, bitpix=None,
         values are: 8 (character or unsigned binary integer), 16 (16-bit
         integer), 32 (32-bit integer), -32 (single precision floating
         point), -64 (double precision floating point).
+        For integer types, the values are scaled to the full range of the
+        type with BSCALE and BZERO, as done by mConvert.
 
     north_aligned : bool, optional
         Align the pixel y-axis with North
@@ -114,6 +357,24 @@ def reproject_cube(in_image, out_image, header=None, bitpix=None,
 
     hdu: int
         Defaults to zero.  Selects which HDU to use from the FITS file.
+
+    n_workers : int, optional
+        Number of planes to reproject in parallel. Planes are processed in
+        batches of ``n_workers``, so that at most ``n_workers`` input and
+        output planes are held in memory at a time. By default, planes are
+        reprojected one after the other.
+
+    channels : slice or list, optional
+        The planes of the cube to reproject, given either as a slice or as a
+        list of plane indices. Only these planes are read from the input
+        file, and the output cube contains only these planes, in the order
+        given. By default, all planes are reprojected.
+
+    plan : bool, optional
+        If `True`, the overlap between input and output pixels is computed
+        only once for all planes, and then applied to each plane in Python
+        (see :mod:`~montage_wrapper.projection`) instead of running mProject
+        for every plane. This requires scipy.
     '''
 
     if header:
@@ -130,94 +391,206 @@ def reproject_cube(in_image, out_image, header=None, bitpix=None,
     # Make work directory
     work_dir = tempfile.mkdtemp()
 
-    # Set paths
-
-    raw_dir = os.path.join(work_dir, 'raw')
-    final_dir = os.path.join(work_dir, 'final')
-
-    if header:
-        header_hdr = os.path.abspath(header)
-    else:
-        header_hdr = os.path.join(work_dir, 'header.hdr')
-
-    images_raw_tbl = os.path.join(work_dir, 'images_raw.tbl')
-    images_tmp_tbl = os.path.join(work_dir, 'images_tmp.tbl')
-
-    # Create raw directory
-    os.mkdir(raw_dir)
-    os.mkdir(final_dir)
-
-    # Make new header
-    if not header:
-        m.mMakeHdr(images_raw_tbl, header_hdr, north_aligned=north_aligned,
-                   system=system, equinox=equinox)
+    # the cube is only moved to out_image once all planes have been written
+    partial_image = out_image + '.part'
 
-    cubefile = fits.open(in_image)
-    if len(cubefile[hdu].data.shape) != 3 or cubefile[hdu].header.get('NAXIS') != 3:
-        raise Exception("Cube file must have 3 dimensions")
+    # Make sure the working directory and the partial cube are cleaned up
+    # if something goes wrong while reprojecting the planes
+    failed = False
 
-    # a temporary HDU that will be used to hold different data each time
-    # and reproject each plane separately
-    planefile = fits.PrimaryHDU(data=cubefile[hdu].data[0, :, :],
-                                header=cubefile[hdu].header)
+    try:
 
-    # generate a blank HDU to store the eventual projected cube
+        # Set paths
 
-    # first must remove END card from .hdr file
-    header_temp = header_hdr.replace(".hdr", "_tmp.hdr")
-    headerlines = open(header_hdr, 'r').readlines()[:-1]
-    w = open(header_temp, 'w')
-    w.writelines([line for line in headerlines])
-    w.close()
+        raw_dir = os.path.join(work_dir, 'raw')
+        final_dir = os.path.join(work_dir, 'final')
 
-    # when creating the new header, allow the 3rd axis to be
-    # set by the input data cube
-    newheader = fits.Header()
-    newheader.fromTxtFile(header_temp)
-    blank_data = numpy.zeros(
-            [cubefile[hdu].header.get('NAXIS3'),
-             newheader.get('NAXIS2'),
-             newheader.get('NAXIS1')]
-    )
-    newcube = fits.PrimaryHDU(data=blank_data, header=newheader)
+        if header:
+            header_hdr = os.path.abspath(header)
+        else:
+            header_hdr = os.path.join(work_dir, 'header.hdr')
+
+        images_raw_tbl = os.path.join(work_dir, 'images_raw.tbl')
+        images_tmp_tbl = os.path.join(work_dir, 'images_tmp.tbl')
+
+        # Create raw directory
+        os.mkdir(raw_dir)
+        os.mkdir(final_dir)
+
+        # Make new header
+        if not header:
+            m.mMakeHdr(images_raw_tbl, header_hdr, north_aligned=north_aligned,
+                       system=system, equinox=equinox)
+
+        # the input cube is read one plane at a time through the section
+        # attribute, so that the full cube is never loaded into memory
+        cubefile = fits.open(in_image, memmap=True)
+        cube_hdu = cubefile[hdu]
+        cube_header = cube_hdu.header
+        if cube_header.get('NAXIS') != 3:
+            raise Exception("Cube file must have 3 dimensions")
+
+        if channels is None:
+            channels = range(cube_header['NAXIS3'])
+        elif isinstance(channels, slice):
+            channels = range(*channels.indices(cube_header['NAXIS3']))
+        channels = list(channels)
+
+        if len(channels) == 0:
+            raise Exception("No channels selected")
+
+        # the output cube is written plane by plane into a pre-sized file on disk,
+        # so that it never needs to be held in memory in full
+
+        # when creating the new header, allow the 3rd axis to be
+        # set by the input data cube
+        newheader = fits_utils.read_header_file(header_hdr)
+
+        if bitpix is None:
+            bitpix = -64
+
+        # integer cubes are first written with floating-point values, and then
+        # scaled to the range of the data (as mConvert does) once all the planes
+        # are known
+        if bitpix > 0:
+            cube_image = os.path.join(work_dir, 'cube64.fits')
+            cube_bitpix = -64
+        else:
+            cube_image = partial_image
+            cube_bitpix = bitpix
+
+        newcube = fits_utils.create_image(cube_image, newheader,
+                                          (len(channels),
+                                           newheader.get('NAXIS2'),
+                                           newheader.get('NAXIS1')),
+                                          bitpix=cube_bitpix)
+
+        if plan:
+            # all planes share the same celestial WCS, so the pixel overlaps are
+            # the same for all of them
+            shape_out = (newheader.get('NAXIS2'), newheader.get('NAXIS1'))
+            weights = projection.projection_weights(cube_header, newheader,
+                                                    factor=factor)
+
+        def reproject_plane(plane):
+
+            if plan:
+                reprojected = projection.apply_projection_weights(weights, plane,
+                                                                  shape_out)
+                return fits_utils.to_bitpix(reprojected, cube_bitpix)
+
+            # reproject the individual plane - exact size MUST be specified so that the
+            # data can be put into the specified cube
+            reprojected, _ = reproject_array(plane, cube_header, header=header_hdr,
+                                             exact_size=True, factor=factor,
+                                             silent_cleanup=silent_cleanup)
+
+            return fits_utils.to_bitpix(reprojected, cube_bitpix)
+
+        # Reproject the planes in batches of n_workers, so that only a limited
+        # number of planes are held in memory at any given time
+        batch_size = n_workers or 1
+        for start in range(0, len(channels), batch_size):
+            batch = channels[start:start + batch_size]
+            planes = [cube_hdu.section[channel] for channel in batch]
+            results = _map_parallel(reproject_plane, planes, n_workers=n_workers,
+                                    labels=["plane %i" % channel for channel in batch])
+            for ii, data in enumerate(results):
+                newcube[start + ii, :, :] = data
+            newcube.flush()
+
+        del newcube
+
+        cubefile.close()
+
+        if bitpix > 0:
+            fits_utils.convert_image(cube_image, partial_image, bitpix)
+
+        os.rename(partial_image, out_image)
+
+    except BaseException:
+        failed = True
+        raise
 
-    for ii, plane in enumerate(cubefile[hdu].data):
+    finally:
 
-        os.mkdir(os.path.join(final_dir, '%i' % ii))
+        if failed and os.path.exists(partial_image):
+            os.remove(partial_image)
 
-        # reset the data plane within the temporary HDU
-        planefile.data = plane
+        _finalize(cleanup, work_dir)
 
-        # reproject the individual plane - exact size MUST be specified so that the
-        # data can be put into the specified cube
-        reprojected = reproject_hdu(planefile, header=header_hdr,
-                                    exact_size=True, factor=factor, bitpix=bitpix,
-                                    silent_cleanup=silent_cleanup)
+    return
 
-        newcube.data[ii, :, :] = reprojected.data
 
-    newcube.writeto(out_image, clobber=clobber)
+def _plane_to_plane_supported(header):
+    '''
+    Determine whether mProjectPP can handle a given header, i.e. whether it
+    uses a TAN projection (possibly with SIP distortion), and no other
+    distortion keywords.
+    '''
+    for key in ('CTYPE1', 'CTYPE2'):
+        if header.get(key, '')[5:8] != 'TAN':
+            return False
+    for keyword in header.keys():
+        if DISTORTION_KEYWORDS.match(keyword):
+            return False
+    return True
 
-    _finalize(cleanup, work_dir)
 
-    return
+def _image_header(in_image, hdu=None):
+    '''
+    Return the header of the HDU of an image that Montage uses: ``hdu`` if
+    set, and otherwise the first HDU with at least two dimensions (the
+    primary HDU of a multi-extension file is often empty).
+    '''
+    if hdu is not None:
+        return fits.getheader(in_image, hdu)
+    with fits.open(in_image) as hdulist:
+        for item in hdulist:
+            if item.header.get('NAXIS', 0) >= 2:
+                return item.header.copy()
+        return hdulist[0].header.copy()
 
 
-def mProject_auto(*args, **kwargs):
+def mProject_auto(in_image, out_image, template_header, **kwargs):
     '''
     Run mProject, automatically selecting whether to run mProject or
     mProjectPP if possible (fast plane-to-plane projection). For details on
     required and optional arguments, see help(mProject).
+
+    mProjectPP is only tried if both the input image and the header template
+    use a TAN projection (unless an alternate header is given), using the
+    same HDU of the input image as Montage. If mProjectPP fails for a given
+    pair of input WCS and header template, mProject is used straight away
+    for subsequent calls with the same pair.
     '''
-    try:
-        m.mProjectPP(*args, **kwargs)
-    except MontageError:
-        m.mProject(*args, **kwargs)
+
+    if kwargs.get('alternate_header'):
+        key = None
+        use_pp = True
+    else:
+        in_header = _image_header(in_image, kwargs.get('hdu'))
+        out_header = fits_utils.read_header_file(template_header)
+        key = (fits_utils.header_fingerprint(in_header, WCS_KEYWORDS),
+               fits_utils.header_fingerprint(out_header))
+        use_pp = (_plane_to_plane_supported(in_header) and
+                  _plane_to_plane_supported(out_header) and
+                  key not in _PLANE_TO_PLANE_FAILED)
+
+    if use_pp:
+        try:
+            return m.mProjectPP(in_image, out_image, template_header, **kwargs)
+        except MontageError:
+            if key is not None:
+                _PLANE_TO_PLANE_FAILED.add(key)
+
+    return m.mProject(in_image, out_image, template_header, **kwargs)
 
 
 def reproject(in_images, out_images, header=None, bitpix=None,
               north_aligned=False, system=None, equinox=None, factor=None, common=False,
-              exact_size=False, hdu=None, cleanup=True, silent_cleanup=False):
+              exact_size=False, hdu=None, cleanup=True, silent_cleanup=False,
+              n_workers=None, scratch_dir=None):
     '''
     General-purpose reprojection routine.
 
@@ -279,6 +652,17 @@ def reproject(in_images, out_images, header=None, bitpix=None,
     common : str, optional
         Compute a common optimal header for all images (only used if
         header=None and if multiple files are being reprojected)
+
+    n_workers : int, optional
+        Number of images to reproject in parallel. By default, images are
+        reprojected one after the other. If set, all images are processed
+        even if some fail, and a single exception listing the failed images
+        is raised at the end. The image headers are then also read in
+        parallel rather than with mImgtbl.
+
+    scratch_dir : str, optional
+        Directory in which to create the temporary work directory. By
+        default, the system temporary directory is used.
     '''
 
     if type(in_images) == str and type(out_images) == str:
@@ -301,16 +685,20 @@ def reproject(in_images, out_images, header=None, bitpix=None,
     out_images = [os.path.abspath(out_image) for out_image in out_images]
 
     if len(in_images) > 1 and not header and not common:
-        for i, in_image in enumerate(in_images):
+
+        def reproject_single(i):
             reproject(in_images[i], out_images[i], bitpix=bitpix,
                       north_aligned=north_aligned, system=system,
                       equinox=equinox, factor=factor,
-                      exact_size=exact_size, cleanup=cleanup,
-                      silent_cleanup=silent_cleanup)
+                      exact_size=exact_size, hdu=hdu, cleanup=cleanup,
+                      silent_cleanup=silent_cleanup, scratch_dir=scratch_dir)
+
+        _map_parallel(reproject_single, range(len(in_images)),
+                      n_workers=n_workers, labels=in_images)
         return
 
     # Make work directory
-    work_dir = tempfile.mkdtemp()
+    work_dir = tempfile.mkdtemp(dir=scratch_dir)
 
     # Set paths
 
@@ -323,7 +711,6 @@ def reproject(in_images, out_images, header=None, bitpix=None,
         header_hdr = os.path.join(work_dir, 'header.hdr')
 
     images_raw_tbl = os.path.join(work_dir, 'images_raw.tbl')
-    images_tmp_tbl = os.path.join(work_dir, 'images_tmp.tbl')
 
     # Create raw directory
     os.mkdir(raw_dir)
@@ -335,42 +722,246 @@ def reproject(in_images, out_images, header=None, bitpix=None,
         os.symlink(in_image, os.path.join(raw_dir, '%i' % i, 'image.fits'))
 
     # Make image table
-    m.mImgtbl(raw_dir, images_raw_tbl, corners=True, recursive=True)
+    _image_table(raw_dir, images_raw_tbl, n_workers=n_workers, corners=True,
+                 recursive=True)
 
     # Make new header
     if not header:
         m.mMakeHdr(images_raw_tbl, header_hdr, north_aligned=north_aligned,
                    system=system, equinox=equinox)
 
-    for i, in_image in enumerate(in_images):
+    if exact_size:
+        template_header = fits_utils.read_header_file(header_hdr)
 
-        os.mkdir(os.path.join(final_dir, '%i' % i))
+    def project_single(i):
 
-        mProject_auto(in_images[i], os.path.join(final_dir, '%i' % i, 'image_tmp.fits'),
+        image_dir = os.path.join(final_dir, '%i' % i)
+
+        os.mkdir(image_dir)
+
+        mProject_auto(in_images[i], os.path.join(image_dir, 'image_tmp.fits'),
                       header_hdr, hdu=hdu, factor=factor)
 
-        if exact_size:
-            m.mImgtbl(os.path.join(final_dir, '%i' % i), images_tmp_tbl, corners=True)
-            m.mAdd(images_tmp_tbl, header_hdr,
-                   os.path.join(final_dir, '%i' % i, 'image.fits'),
-                   img_dir=os.path.join(final_dir, '%i' % i), exact=True)
-        else:
-            os.symlink(os.path.join(final_dir, '%i' % i, 'image_tmp.fits'),
-                       os.path.join(final_dir, '%i' % i, 'image.fits'))
+        _move_image(os.path.join(image_dir, 'image_tmp.fits'), out_images[i],
+                    bitpix=bitpix,
+                    header=template_header if exact_size else None)
 
-        m.mConvert(os.path.join(final_dir, '%i' % i, 'image.fits'), out_images[i],
-                   bitpix=bitpix)
+    _map_parallel(project_single, range(len(in_images)),
+                  n_workers=n_workers, labels=in_images)
 
     _finalize(cleanup, work_dir, silence=silent_cleanup)
 
     return
 
 
+def _project_cached(images_table, template_header, proj_dir, stats_table,
+                    projection_cache, raw_dir=None, exact=False, n_workers=None):
+    '''
+    Project all images in an image table, as for mProjExec, but one at a
+    time so that the names of the output images are known. If
+    ``projection_cache`` is set, the projected images are re-used from the
+    cache when possible and the newly projected images are added to it.
+    '''
+
+    from astropy.table import Table
+
+    table = Table.read(images_table, format='ascii.ipac')
+
+    if exact:
+        header = fits_utils.read_header_file(template_header)
+
+    def project_single(row):
+
+        fname = str(row['fname']).strip()
+        hdu = int(row['hdu']) if 'hdu' in row.colnames else 0
+        in_image = os.path.join(raw_dir, fname) if raw_dir else fname
+
+        out_name = fname.replace(os.sep, '_')
+        if hdu > 0:
+            out_name = "hdu%i_%s" % (hdu, out_name)
+        out_image = os.path.join(proj_dir, out_name)
+
+        if projection_cache is not None:
+            key = projection_cache.key(in_image, template_header, hdu=hdu, exact=exact)
+            if projection_cache.fetch(key, out_image):
+                return fname, 'CACHED', ''
+
+        try:
+            if exact:
+                tmp_image = out_image[:-5] + '_tmp.fits'
+                mProject_auto(in_image, tmp_image, template_header, hdu=hdu)
+                for suffix in ('', '_area'):
+                    fits_utils.crop_to_header(tmp_image[:-5] + suffix + '.fits',
+                                              out_image[:-5] + suffix + '.fits',
+                                              header)
+                    os.remove(tmp_image[:-5] + suffix + '.fits')
+            else:
+                mProject_auto(in_image, out_image, template_header, hdu=hdu)
+        except MontageError as exc:
+            return fname, 'NOOVERLAP' if 'overlap' in str(exc).lower() else 'FAILED', str(exc)
+
+        if projection_cache is not None:
+            projection_cache.store(key, out_image)
+
+        return fname, 'OK', ''
+
+    rows = _map_parallel(project_single, list(table), n_workers=n_workers)
+
+    stats = Table()
+    stats['fname'] = [row[0] for row in rows]
+    stats['stat'] = [row[1] for row in rows]
+    stats['msg'] = [row[2].replace('|', ' ') or '-' for row in rows]
+    with open(stats_table, 'w') as f:
+        stats.write(f, format='ascii.ipac')
+
+    states = [row[1] for row in rows]
+
+    return status.Struct("mProjExec",
+                         '[struct stat="OK", count=%i, failed=%i, nooverlap=%i, cached=%i]'
+                         % (states.count('OK') + states.count('CACHED'),
+                            states.count('FAILED'), states.count('NOOVERLAP'),
+                            states.count('CACHED')))
+
+
+def _add_tiles(images_table, template_header, tile_dir, tiles, img_dir,
+               combine, n_workers=None):
+    '''
+    Combine projected frames into a grid of ``tiles = (n_x, n_y)`` tiles
+    covering a header template, using mTileHdr to compute the header of each
+    tile and only the frames overlapping each tile. The tiles are combined in
+    parallel if ``n_workers`` is set. Returns the list of tile images.
+    '''
+
+    from astropy.table import Table
+
+    table = Table.read(images_table, format='ascii.ipac')
+
+    n_x, n_y = tiles
+    grid = [(ix, iy) for iy in range(n_y) for ix in range(n_x)]
+
+    def add_tile(tile):
+        tile_hdr = os.path.join(tile_dir, 'header_%i_%i.hdr' % tile)
+        tile_fits = os.path.join(tile_dir, 'mosaic_%i_%i.fits' % tile)
+        m.mTileHdr(template_header, tile_hdr, n_x, n_y, tile[0], tile[1])
+        _add_region(table, fits_utils.read_header_file(tile_hdr), tile_fits,
+                    img_dir, combine)
+        return tile_fits
+
+    return _map_parallel(add_tile, grid, n_workers=n_workers,
+                         labels=['tile %i,%i' % tile for tile in grid])
+
+
+def _stitch_tiles(tile_images, template_header, out_image, bitpix=-64):
+    '''
+    Stitch tiles (and their area maps) into a single image covering a header
+    template, written directly with a floating-point ``bitpix``. The image
+    and the area map are stitched at the same time.
+    '''
+
+    header = fits_utils.read_header_file(template_header)
+    shape = (header['NAXIS2'], header['NAXIS1'])
+
+    def stitch(suffix):
+        output = out_image[:-5] + suffix + '.fits'
+        fits_utils.create_image(output, header, shape, bitpix=bitpix).flush()
+        for tile_image in tile_images:
+            tile_header = fits.getheader(tile_image)
+            xoff = int(round(header['CRPIX1'] - tile_header['CRPIX1']))
+            yoff = int(round(header['CRPIX2'] - tile_header['CRPIX2']))
+            fits_utils.paste_image(tile_image[:-5] + suffix + '.fits', output,
+                                   xoff, yoff)
+
+    _map_parallel(stitch, ['', '_area'], n_workers=2)
+
+
+class _Checkpoints(object):
+    '''
+    Keep track of the stages of a mosaic that have completed in a work
+    directory, so that they can be skipped when resuming.
+
+    Each stage writes a marker file in the ``checkpoints`` sub-directory,
+    containing a hash of its inputs (parameters, and the contents of input
+    files and directories), whether it completed, and the status returned by
+    the Montage command. Since the inputs of a stage include the outputs of
+    the previous stages, re-running a stage invalidates all following stages.
+    '''
+
+    def __init__(self, work_dir, resume=False):
+        self.directory = os.path.join(work_dir, 'checkpoints')
+        self.resume = resume
+        # Markers left by a previous call, read before they are overwritten
+        self._previous = {}
+        if not os.path.exists(self.directory):
+            os.mkdir(self.directory)
+
+    def fingerprint(self, files=(), dirs=(), params=()):
+        md5 = hashlib.md5(repr(params).encode('utf-8'))
+        for filename in files:
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    md5.update(block)
+        for directory in dirs:
+            for filename in sorted(os.listdir(directory)):
+                stat = os.stat(os.path.join(directory, filename))
+                md5.update(repr((filename, stat.st_size, stat.st_mtime)).encode('utf-8'))
+        return md5.hexdigest()
+
+    def _read(self, stage):
+        marker = os.path.join(self.directory, stage + '.json')
+        if os.path.exists(marker):
+            with open(marker, 'r') as f:
+                return json.load(f)
+
+    def _write(self, stage, fingerprint, complete, result=None):
+        marker = os.path.join(self.directory, stage + '.json')
+        with open(marker + '.tmp', 'w') as f:
+            json.dump({'inputs': fingerprint, 'complete': complete,
+                       'status': None if result is None else result.__dict__}, f)
+        os.rename(marker + '.tmp', marker)
+
+    def interrupted(self, stage, fingerprint):
+        '''
+        Whether a stage was started by a previous call with the same inputs
+        but did not complete.
+        '''
+        if stage in self._previous:
+            marker = self._previous[stage]
+        else:
+            marker = self._read(stage)
+        return (self.resume and marker is not None and
+                marker['inputs'] == fingerprint and not marker['complete'])
+
+    def run(self, stage, function, fingerprint, outputs=()):
+        '''
+        Run ``function`` for a stage, unless resuming and the stage already
+        completed with the same inputs and all its outputs exist, in which
+        case the status returned by the stage is returned.
+        '''
+        marker = self._read(stage)
+        self._previous[stage] = marker
+        if (self.resume and marker is not None and
+                marker['inputs'] == fingerprint and marker['complete'] and
+                all(os.path.exists(output) for output in outputs)):
+            log.info("Skipping completed stage: %s" % stage)
+            if marker['status'] is None:
+                return None
+            else:
+                return status.make_struct(stage, marker['status'])
+        self._write(stage, fingerprint, False)
+        result = function()
+        self._write(stage, fingerprint, True,
+                    result=result if isinstance(result, status.Struct) else None)
+        return result
+
+
 def mosaic(input_dir, output_dir, header=None, image_table=None, mpi=False,
            n_proc=8, background_match=False, imglist=None, combine="mean",
            exact_size=False, cleanup=True, bitpix=-32, level_only=True,
            work_dir=None, background_n_iter=None, subset_fast=False,
-           hdu=None):
+           hdu=None, n_workers=None, image_index=None, spatial_index=False,
+           parallel=None, resume=False, projection_cache=None, tiles=None,
+           stitch_tiles=True, keep_diffs=False, lazy_corrections=False,
+           background_solver='mBgModel', diff_fitter='mFitExec'):
     """
     Combine FITS files into a mosaic
 
@@ -397,7 +988,8 @@ def mosaic(input_dir, output_dir, header=None, image_table=None, mpi=False,
         Montage binaries to be installed).
 
     n_proc : int, optional
-        The number of processes to use if `mpi` is set to `True`
+        The number of processes to use if `mpi` is set to `True`, or if
+        `parallel` is set
 
     background_match : bool, optional
         Whether to include a background-matching step
@@ -422,6 +1014,10 @@ def mosaic(input_dir, output_dir, header=None, image_table=None, mpi=False,
         values are: 8 (character or unsigned binary integer), 16 (16-bit
         integer), 32 (32-bit integer), -32 (single precision floating
         point), -64 (double precision floating point).
+        With a floating-point type, the frames are combined in Python with
+        :func:`~montage_wrapper.coadd.add_frames` directly into the output
+        mosaic, rather than with mAdd into a 64-bit mosaic that is then
+        converted.
 
     level_only : bool, optional
         When doing background matching, whether to only allow changes in the
@@ -441,11 +1037,132 @@ def mosaic(input_dir, output_dir, header=None, image_table=None, mpi=False,
 
     hdu: int, optional
         Which HDU to use when mosaicing
+
+    n_workers : int, optional
+        If set, image tables are built in Python with
+        :func:`~montage_wrapper.metadata.build_image_table`, reading the
+        FITS headers with this many threads, rather than with mImgtbl.
+
+    image_index : str, optional
+        Path to an SQLite database in which to keep the metadata of the input
+        files between calls (see :class:`~montage_wrapper.metadata.MetadataIndex`).
+        If set, only the headers of input files that are new or have changed
+        since the last call are read when listing the raw frames. This is
+        ignored if `image_table` is set.
+
+    spatial_index : bool, optional
+        Whether to select the input images overlapping the header, and to
+        find overlapping images for background matching, with an in-process
+        :class:`~montage_wrapper.spatial.FootprintIndex` rather than with
+        mSubset and mOverlaps. mSubset is still used to select the input
+        images if the header covers a hemisphere or more.
+
+    parallel : str, optional
+        How to run the Montage executives in parallel. This can be ``'mpi'``
+        (the same as setting `mpi` to `True`), or ``'processes'`` to run the
+        serial executives on shards of the tables in a pool of `n_proc` local
+        processes (see :mod:`montage_wrapper.pool`), which does not require
+        MPI.
+
+    resume : bool, optional
+        Whether to resume a previous call to mosaic with the same `work_dir`
+        and `output_dir`. Each stage records its inputs and whether it
+        completed in the work directory, and stages that already completed
+        with the same inputs are skipped. If the projection of the raw frames
+        was interrupted, it is restarted after the last projected frame. In
+        this mode, `work_dir` has to be specified, and the work directory is
+        not removed if the mosaic fails, so `resume` should also be set for
+        the first call.
+
+    projection_cache : str or :class:`~montage_wrapper.cache.ProjectionCache`, optional
+        A cache of projected images to share between calls, given either as
+        a directory or as a :class:`~montage_wrapper.cache.ProjectionCache`
+        instance (to set a maximum size). If set, the raw frames are projected
+        one by one with mProject or mProjectPP instead of with mProjExec,
+        using `n_proc` threads if `parallel` is set (or `n_workers`
+        otherwise), and frames already in the cache for the same header are
+        linked into the projection directory instead of being projected
+        again.
+
+    tiles : tuple, optional
+        If set to ``(n_x, n_y)``, the frames are combined into a grid of
+        ``n_x`` by ``n_y`` tiles, with headers computed by mTileHdr, rather
+        than into a single image. Each tile is combined with mAdd from the
+        frames overlapping it, using `n_proc` concurrent processes if
+        `parallel` is set (or `n_workers` otherwise). Tiles always match the
+        header exactly, as if `exact_size` was set. The tiles are stitched
+        directly with the output `bitpix` if it is a floating-point type.
+
+    stitch_tiles : bool, optional
+        Whether to stitch the tiles into ``mosaic.fits`` and
+        ``mosaic_area.fits``. If `False`, the tiles are left in the output
+        directory as ``mosaic_<ix>_<iy>.fits`` and
+        ``mosaic_<ix>_<iy>_area.fits``.
+
+    keep_diffs : bool, optional
+        When doing background matching, whether to keep the difference images
+        between overlapping frames (in the ``diffs`` sub-directory of the
+        work directory) by computing and fitting them separately with
+        mDiffExec and mFitExec. By default, mDiffFitExec is used instead to
+        compute and fit the differences in a single pass, without keeping
+        the difference images.
+
+    lazy_corrections : bool, optional
+        When doing background matching, whether to combine the projected
+        frames in Python with :func:`~montage_wrapper.coadd.add_frames`,
+        subtracting the background corrections as the frames are read,
+        rather than writing corrected copies of all frames with mBgExec and
+        combining these with mAdd. The frames are combined using `n_proc`
+        threads if `parallel` is set (or `n_workers` otherwise). This cannot
+        be used together with `tiles`.
+
+    background_solver : str, optional
+        When doing background matching, how to compute the background
+        corrections from the fits to the differences: ``'mBgModel'`` to use
+        the iterative relaxation of mBgModel, or ``'direct'`` or ``'lsqr'``
+        to solve for all the corrections at once as a sparse least-squares
+        problem with :func:`~montage_wrapper.background.model_background`
+        (which requires scipy), using a direct solver or LSQR respectively.
+        `background_n_iter` only applies to mBgModel.
+
+    diff_fitter : str, optional
+        When doing background matching, how to fit planes to the differences
+        between overlapping frames: ``'mFitExec'`` to use mFitExec (or
+        mDiffFitExec, unless `keep_diffs` is set), or ``'python'`` to compute
+        the difference images with mDiffExec and fit them all in a single
+        process with :func:`~montage_wrapper.background.fit_diffs`, using
+        `n_proc` threads if `parallel` is set (or `n_workers` otherwise).
     """
 
     if not combine in ['mean', 'median', 'count']:
         raise Exception("combine should be one of mean/median/count")
 
+    if mpi:
+        if parallel not in (None, 'mpi'):
+            raise Exception("mpi=True cannot be used with parallel='%s'" % parallel)
+        parallel = 'mpi'
+    elif parallel not in (None, 'mpi', 'processes'):
+        raise Exception("parallel should be one of mpi/processes")
+
+    if tiles is not None and len(tiles) != 2:
+        raise Exception("tiles should be a tuple of two integers")
+
+    if tiles is not None and lazy_corrections:
+        raise Exception("lazy_corrections cannot be used with tiles")
+
+    if not background_solver in ['mBgModel', 'direct', 'lsqr']:
+        raise Exception("background_solver should be one of mBgModel/direct/lsqr")
+
+    if not diff_fitter in ['mFitExec', 'python']:
+        raise Exception("diff_fitter should be one of mFitExec/python")
+
+    if parallel == 'processes':
+        executives = pool
+        parallel_kwargs = {'n_proc': n_proc}
+    else:
+        executives = m
+        parallel_kwargs = {'mpi': parallel == 'mpi', 'n_proc': n_proc}
+
     # Check that there are files in the input directory
     if len(glob.glob(os.path.join(input_dir, '*'))) == 0:
         raise Exception("No files in input directory")
@@ -455,11 +1172,15 @@ def mosaic(input_dir, output_dir, header=None, image_table=None, mpi=False,
     output_dir = os.path.abspath(output_dir)
 
     # Make work directory
+    if resume and not work_dir:
+        raise Exception("work_dir should be specified if resume=True")
     if work_dir:
         work_dir = os.path.abspath(work_dir)
         if os.path.exists(work_dir):
-            raise Exception("Work directory already exists")
-        os.mkdir(work_dir)
+            if not resume:
+                raise Exception("Work directory already exists")
+        else:
+            os.mkdir(work_dir)
     else:
         # Use a temporary directory such as 'montage_mosaic_ngc2264_EdJyrj',
         # where 'ngc2264' would be here determined by the input directory.
@@ -467,147 +1188,605 @@ def mosaic(input_dir, output_dir, header=None, image_table=None, mpi=False,
         prefix = "montage_mosaic_{0}_".format(basename)
         work_dir = tempfile.mkdtemp(prefix=prefix)
 
-    # Make sure the working directory is cleaned up even when something goes
-    # wrong (or Ctrl-C is pressed, raising the KeyboardInterrupt exception)
-    @atexit.register
-    def cleanup_workdir():
-        """ Run _finalize() if necessary """
-        if os.path.exists(work_dir):
-            _finalize(cleanup, work_dir)
+    # Make sure the working directory is cleaned up whichever way this
+    # function exits, even when something goes wrong (or Ctrl-C is pressed,
+    # raising the KeyboardInterrupt exception), unless it is needed to resume
+    # the mosaic later.
+    failed = False
 
-    images_raw_all_tbl = os.path.join(work_dir, 'images_raw_all.tbl')
-    images_raw_tbl = os.path.join(work_dir, 'images_raw.tbl')
-    images_projected_tbl = os.path.join(work_dir, 'images_projected.tbl')
-    images_corrected_tbl = os.path.join(work_dir, 'images_corrected.tbl')
-    corrections_tbl = os.path.join(work_dir, 'corrections.tbl')
-    diffs_tbl = os.path.join(work_dir, 'diffs.tbl')
-    stats_tbl = os.path.join(work_dir, 'stats.tbl')
-    fits_tbl = os.path.join(work_dir, 'fits.tbl')
+    try:
 
-    raw_dir = os.path.join(work_dir, 'raw')
-    projected_dir = os.path.join(work_dir, 'projected')
-    corrected_dir = os.path.join(work_dir, 'corrected')
-    diffs_dir = os.path.join(work_dir, 'diffs')
+        checkpoints = _Checkpoints(work_dir, resume=resume)
 
-    header_hdr = os.path.join(work_dir, 'header.hdr')
+        if projection_cache is not None and not isinstance(projection_cache, ProjectionCache):
+            projection_cache = ProjectionCache(projection_cache)
 
-    # Find path to header file if specified
-    if header is not None:
-        header = os.path.abspath(header)
+        images_raw_all_tbl = os.path.join(work_dir, 'images_raw_all.tbl')
+        images_raw_tbl = os.path.join(work_dir, 'images_raw.tbl')
+        images_projected_tbl = os.path.join(work_dir, 'images_projected.tbl')
+        images_corrected_tbl = os.path.join(work_dir, 'images_corrected.tbl')
+        corrections_tbl = os.path.join(work_dir, 'corrections.tbl')
+        diffs_tbl = os.path.join(work_dir, 'diffs.tbl')
+        stats_tbl = os.path.join(work_dir, 'stats.tbl')
+        fits_tbl = os.path.join(work_dir, 'fits.tbl')
 
-    # Find path to image table if specified
-    if image_table is not None:
-        image_table = os.path.abspath(image_table)
+        raw_dir = os.path.join(work_dir, 'raw')
+        projected_dir = os.path.join(work_dir, 'projected')
+        corrected_dir = os.path.join(work_dir, 'corrected')
+        diffs_dir = os.path.join(work_dir, 'diffs')
+        tiles_dir = os.path.join(work_dir, 'tiles')
 
-    # Find path to image list if specified
-    if imglist:
-        imglist = os.path.abspath(imglist)
+        header_hdr = os.path.join(work_dir, 'header.hdr')
 
-    # Create output dir
-    if os.path.exists(output_dir):
-        raise IOError("Output directory already exists")
-    else:
-        os.mkdir(output_dir)
+        mosaic_fits = os.path.join(output_dir, 'mosaic.fits')
+        mosaic64_fits = os.path.join(output_dir, 'mosaic64.fits')
 
-    # Create symbolic links
-    os.symlink(input_dir, raw_dir)
+        # Find path to header file if specified
+        if header is not None:
+            header = os.path.abspath(header)
 
-    if header:
-        os.symlink(header, header_hdr)
-
-    # Create temporary directories for Montage
-    os.mkdir(projected_dir)
-    if background_match:
-        os.mkdir(diffs_dir)
-        os.mkdir(corrected_dir)
-
-    # List frames to mosaic
-    if image_table is None:
-        log.info("Listing raw frames")
-        m.mImgtbl(raw_dir, images_raw_all_tbl, img_list=imglist, corners=True)
-    else:
-        sh.copy2(image_table, images_raw_all_tbl)
+        # Find path to image table if specified
+        if image_table is not None:
+            image_table = os.path.abspath(image_table)
 
-    # Compute header if needed
-    if not header:
-        log.info("Computing optimal header")
-        m.mMakeHdr(images_raw_all_tbl, header_hdr)
-        images_raw_tbl = images_raw_all_tbl
-    else:
-        log.info("Checking for coverage")
-        s = m.mSubset(images_raw_all_tbl, header_hdr, images_raw_tbl, fast_mode=subset_fast)
-        if s.nmatches == 0:
-            raise MontageError("No images overlap with the requested header")
+        # Find path to image index if specified
+        if image_index is not None:
+            image_index = os.path.abspath(image_index)
 
-    # Projecting raw frames
-    log.info("Projecting raw frames")
+        # Find path to image list if specified
+        if imglist:
+            imglist = os.path.abspath(imglist)
 
-    if hdu is not None:
-        from astropy.table import Table
-        table = Table.read(images_raw_tbl, format='ascii.ipac')
-        table_filtered = table[table['hdu'] == hdu]
-        table_filtered.write(images_raw_tbl, format='ascii.ipac')
-
-    m.mProjExec(images_raw_tbl, header_hdr, projected_dir, stats_tbl,
-                raw_dir=raw_dir, mpi=mpi, n_proc=n_proc, exact=exact_size)
-
-    # List projected frames
-    s = m.mImgtbl(projected_dir, images_projected_tbl)
-    if s.count == 0:
-        raise MontageError("No images were successfully projected")
-
-    if background_match:
-        log.info("Determining overlaps")
-        s = m.mOverlaps(images_projected_tbl, diffs_tbl)
+        # Create output dir
+        if os.path.exists(output_dir):
+            if not resume:
+                raise IOError("Output directory already exists")
+        else:
+            os.mkdir(output_dir)
+
+        # Create symbolic links
+        if not os.path.lexists(raw_dir):
+            os.symlink(input_dir, raw_dir)
+
+        # When resuming, the header may have changed since the previous call (and
+        # a computed header should never be written through a link to the header
+        # given by the user)
+        if os.path.islink(header_hdr) and (not header or os.readlink(header_hdr) != header):
+            os.remove(header_hdr)
+        if header and os.path.lexists(header_hdr) and not os.path.islink(header_hdr):
+            os.remove(header_hdr)
+
+        if header and not os.path.lexists(header_hdr):
+            os.symlink(header, header_hdr)
+
+        # Create temporary directories for Montage
+        for directory in [projected_dir, diffs_dir, corrected_dir]:
+            if directory == corrected_dir and lazy_corrections:
+                continue
+            if (directory == projected_dir or background_match) and not os.path.exists(directory):
+                os.mkdir(directory)
+        if tiles is not None and not os.path.exists(tiles_dir):
+            os.mkdir(tiles_dir)
+
+        # List frames to mosaic
+        def list_frames():
+            if image_table is None:
+                log.info("Listing raw frames")
+                _image_table(raw_dir, images_raw_all_tbl, n_workers=n_workers,
+                             index=image_index, img_list=imglist, corners=True)
+            else:
+                sh.copy2(image_table, images_raw_all_tbl)
+
+        if image_table is None:
+            fingerprint = checkpoints.fingerprint(files=[imglist] if imglist else [],
+                                                  dirs=[raw_dir])
+        else:
+            fingerprint = checkpoints.fingerprint(files=[image_table])
+        checkpoints.run('list_frames', list_frames, fingerprint,
+                        outputs=[images_raw_all_tbl])
+
+        # Compute header if needed, and select frames to mosaic
+        def select_frames():
+            if not header:
+                log.info("Computing optimal header")
+                m.mMakeHdr(images_raw_all_tbl, header_hdr)
+                sh.copy(images_raw_all_tbl, images_raw_tbl)
+            else:
+                log.info("Checking for coverage")
+                selected = None
+                if spatial_index:
+                    index = spatial.FootprintIndex(images_raw_all_tbl)
+                    try:
+                        selected = index.overlaps_header(header_hdr)
+                    except spatial.RegionTooLargeError:
+                        log.info("Header covers a hemisphere or more, using mSubset instead")
+                if selected is None:
+                    s = m.mSubset(images_raw_all_tbl, header_hdr, images_raw_tbl, fast_mode=subset_fast)
+                else:
+                    s = index.write_subset(selected, images_raw_tbl)
+                if s.nmatches == 0:
+                    raise MontageError("No images overlap with the requested header")
+            if hdu is not None:
+                from astropy.table import Table
+                table = Table.read(images_raw_tbl, format='ascii.ipac')
+                table_filtered = table[table['hdu'] == hdu]
+                with open(images_raw_tbl, 'w') as f:
+                    table_filtered.write(f, format='ascii.ipac')
+
+        fingerprint = checkpoints.fingerprint(files=[images_raw_all_tbl] + ([header_hdr] if header else []),
+                                              params=[subset_fast, spatial_index, hdu])
+        checkpoints.run('select_frames', select_frames, fingerprint,
+                        outputs=[header_hdr, images_raw_tbl])
+
+        # Projecting raw frames
+        log.info("Projecting raw frames")
+
+        fingerprint = checkpoints.fingerprint(files=[images_raw_tbl, header_hdr],
+                                              params=[exact_size])
+
+        def project_frames():
+            # If a previous attempt at projecting the frames was interrupted,
+            # restart after the last image listed in the stats table (with a
+            # projection cache, all frames are projected again instead, since
+            # the frames that were already projected are fetched from the
+            # cache)
+            restart_rec = None
+            if (projection_cache is None and os.path.exists(stats_tbl) and
+                    checkpoints.interrupted('project_frames', fingerprint)):
+                previous_stats = stats_tbl + '.previous'
+                pool._merge_tables([previous_stats, stats_tbl], previous_stats + '.tmp')
+                os.rename(previous_stats + '.tmp', previous_stats)
+                restart_rec = len(pool._read_table_lines(previous_stats)[1])
+                log.info("Restarting projection at record %i" % restart_rec)
+            else:
+                # Frames left by a previous call may have been projected with
+                # different inputs, so they are all projected (or fetched from
+                # the cache) again
+                for filename in os.listdir(projected_dir):
+                    os.remove(os.path.join(projected_dir, filename))
+                for filename in [stats_tbl, stats_tbl + '.previous']:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+            if projection_cache is not None:
+                s = _project_cached(images_raw_tbl, header_hdr, projected_dir, stats_tbl,
+                                    projection_cache, raw_dir=raw_dir, exact=exact_size,
+                                    n_workers=n_proc if parallel else n_workers)
+            else:
+                s = executives.mProjExec(images_raw_tbl, header_hdr, projected_dir, stats_tbl,
+                                         raw_dir=raw_dir, exact=exact_size,
+                                         restart_rec=restart_rec, **parallel_kwargs)
+            if restart_rec is not None:
+                pool._merge_tables([stats_tbl + '.previous', stats_tbl], stats_tbl)
+                os.remove(stats_tbl + '.previous')
+            return s
+
+        checkpoints.run('project_frames', project_frames, fingerprint,
+                        outputs=[stats_tbl])
+
+        # List projected frames
+        s = checkpoints.run('list_projected',
+                            lambda: _image_table(projected_dir, images_projected_tbl,
+                                                 n_workers=n_workers),
+                            checkpoints.fingerprint(dirs=[projected_dir]),
+                            outputs=[images_projected_tbl])
         if s.count == 0:
-            log.info("No overlapping frames, backgrounds will not be adjusted")
-            background_match = False
+            raise MontageError("No images were successfully projected")
+
+        # Combine the frames, either into a single image or into tiles
+        if tiles is None:
+            tile_images = []
+        else:
+            tile_images = [os.path.join(tiles_dir, 'mosaic_%i_%i.fits' % (ix, iy))
+                           for iy in range(tiles[1]) for ix in range(tiles[0])]
+
+        # Without tiles, the frames are combined in Python directly into the
+        # final mosaic if the output BITPIX is a floating-point type, since
+        # mAdd can only write a 64-bit mosaic that then has to be converted
+        direct = tiles is None and (bitpix is None or bitpix < 0)
+
+        def add_frames(images_tbl, img_dir):
+            if direct:
+                function = lambda: coadd.add_frames(images_tbl, header_hdr, mosaic_fits,
+                                                    img_dir=img_dir, combine=combine,
+                                                    exact=exact_size, bitpix=bitpix or -64,
+                                                    n_workers=n_proc if parallel else n_workers)
+                outputs = [mosaic_fits]
+            elif tiles is None:
+                function = lambda: m.mAdd(images_tbl, header_hdr, mosaic64_fits,
+                                          img_dir=img_dir, type=combine,
+                                          exact=exact_size)
+                outputs = [mosaic64_fits]
+            else:
+                function = lambda: _add_tiles(images_tbl, header_hdr, tiles_dir,
+                                              tiles, img_dir, combine,
+                                              n_workers=n_proc if parallel else n_workers)
+                outputs = tile_images
+            checkpoints.run('add_frames', function,
+                            checkpoints.fingerprint(files=[images_tbl, header_hdr],
+                                                    params=[combine, exact_size, tiles,
+                                                            direct and bitpix]),
+                            outputs=outputs)
+
+        if background_match:
+            log.info("Determining overlaps")
+
+            def find_overlaps():
+                if spatial_index:
+                    index = spatial.FootprintIndex(images_projected_tbl)
+                    first, second = index.overlapping_pairs()
+                    return index.write_diffs(first, second, diffs_tbl)
+                else:
+                    return m.mOverlaps(images_projected_tbl, diffs_tbl)
+
+            s = checkpoints.run('find_overlaps', find_overlaps,
+                                checkpoints.fingerprint(files=[images_projected_tbl],
+                                                        params=[spatial_index]),
+                                outputs=[diffs_tbl])
+            if s.count == 0:
+                log.info("No overlapping frames, backgrounds will not be adjusted")
+                background_match = False
+
+        if background_match:
+
+            # Modeling background
+
+            log.info("Modeling background")
+            if keep_diffs or diff_fitter == 'python':
+                checkpoints.run('diff_frames',
+                                lambda: executives.mDiffExec(diffs_tbl, header_hdr, diffs_dir,
+                                                             proj_dir=projected_dir,
+                                                             **parallel_kwargs),
+                                checkpoints.fingerprint(files=[diffs_tbl, header_hdr,
+                                                               images_projected_tbl]))
+                if diff_fitter == 'python':
+                    fit_diffs = lambda: background.fit_diffs(diffs_tbl, fits_tbl, diffs_dir,
+                                                             n_workers=n_proc if parallel else n_workers)
+                else:
+                    fit_diffs = lambda: executives.mFitExec(diffs_tbl, fits_tbl, diffs_dir,
+                                                            **parallel_kwargs)
+                checkpoints.run('fit_diffs', fit_diffs,
+                                checkpoints.fingerprint(files=[diffs_tbl], dirs=[diffs_dir],
+                                                        params=[diff_fitter]),
+                                outputs=[fits_tbl])
+            else:
+                checkpoints.run('diff_fit_frames',
+                                lambda: executives.mDiffFitExec(diffs_tbl, fits_tbl, diffs_dir,
+                                                                template_header=header_hdr,
+                                                                proj_dir=projected_dir,
+                                                                **parallel_kwargs),
+                                checkpoints.fingerprint(files=[diffs_tbl, header_hdr,
+                                                               images_projected_tbl]),
+                                outputs=[fits_tbl])
+            if background_solver == 'mBgModel':
+                model_background = lambda: m.mBgModel(images_projected_tbl, fits_tbl,
+                                                      corrections_tbl, n_iter=background_n_iter,
+                                                      level_only=level_only)
+            else:
+                model_background = lambda: background.model_background(images_projected_tbl,
+                                                                        fits_tbl, corrections_tbl,
+                                                                        level_only=level_only,
+                                                                        method=background_solver)
+            checkpoints.run('model_background', model_background,
+                            checkpoints.fingerprint(files=[images_projected_tbl, fits_tbl],
+                                                    params=[background_n_iter, level_only,
+                                                            background_solver]),
+                            outputs=[corrections_tbl])
+
+            if lazy_corrections:
+
+                # Mosaicking frames, subtracting the backgrounds on the fly,
+                # directly in the output BITPIX if possible
+                log.info("Mosaicking frames")
+
+                sh.copy(corrections_tbl, output_dir)
+
+                if direct:
+                    coadd_fits = mosaic_fits
+                else:
+                    coadd_fits = mosaic64_fits
+
+                checkpoints.run('add_frames',
+                                lambda: coadd.add_frames(images_projected_tbl, header_hdr, coadd_fits,
+                                                         img_dir=projected_dir,
+                                                         corrections_table=corrections_tbl,
+                                                         combine=combine, exact=exact_size,
+                                                         bitpix=bitpix if direct and bitpix else -64,
+                                                         n_workers=n_proc if parallel else n_workers),
+                                checkpoints.fingerprint(files=[images_projected_tbl, corrections_tbl,
+                                                               header_hdr],
+                                                        params=[combine, exact_size, bitpix]),
+                                outputs=[coadd_fits])
+                sh.copy(images_projected_tbl, output_dir)
+
+            else:
+
+                # Matching background
+                log.info("Matching background")
+                checkpoints.run('match_background',
+                                lambda: executives.mBgExec(images_projected_tbl, corrections_tbl,
+                                                           corrected_dir, proj_dir=projected_dir,
+                                                           **parallel_kwargs),
+                                checkpoints.fingerprint(files=[images_projected_tbl,
+                                                               corrections_tbl]))
+                sh.copy(corrections_tbl, output_dir)
+
+                # Mosaicking frames
+                log.info("Mosaicking frames")
+
+                checkpoints.run('list_corrected',
+                                lambda: _image_table(corrected_dir, images_corrected_tbl,
+                                                     n_workers=n_workers),
+                                checkpoints.fingerprint(dirs=[corrected_dir]),
+                                outputs=[images_corrected_tbl])
+                add_frames(images_corrected_tbl, corrected_dir)
+                sh.copy(images_projected_tbl, output_dir)
+                sh.copy(images_corrected_tbl, output_dir)
+
+        else:
 
-    if background_match:
+            # Mosaicking frames
+            log.info("Mosaicking frames")
+
+            add_frames(images_projected_tbl, projected_dir)
+            sh.copy(images_projected_tbl, output_dir)
+
+        if direct:
+            # The frames were combined directly in the output BITPIX
+            pass
+        elif tiles is not None and not stitch_tiles:
+            for tile_image in tile_images:
+                _move_with_area(tile_image,
+                                os.path.join(output_dir, os.path.basename(tile_image)),
+                                bitpix=bitpix)
+        elif tiles is not None and (bitpix is None or bitpix < 0):
+            # The tiles can be stitched directly in the output BITPIX
+            log.info("Stitching tiles")
+            _stitch_tiles(tile_images, header_hdr, mosaic_fits,
+                          bitpix=bitpix or -64)
+        else:
+            if tiles is not None:
+                log.info("Stitching tiles")
+                _stitch_tiles(tile_images, header_hdr, mosaic64_fits)
+            # mAdd only writes 64-bit images, which are converted here
+            _move_with_area(mosaic64_fits, mosaic_fits, bitpix=bitpix)
+
+    except BaseException:
+        failed = True
+        raise
+
+    finally:
+
+        if os.path.exists(work_dir) and not (failed and resume):
+            _finalize(cleanup, work_dir)
+
+
+def _add_region(table, header, out_image, img_dir, combine):
+    '''
+    Combine the frames from a table of frames projected onto the same
+    projection as ``header`` that overlap the region it defines, with mAdd in
+    exact size mode. If no frames overlap the region, a blank image and an
+    empty area map are written instead.
+    '''
+
+    ny, nx = header['NAXIS2'], header['NAXIS1']
+
+    x0, x1, y0, y1 = coadd._pixel_boxes(table, header)
+    overlapping = (x0 < nx) & (x1 > 0) & (y0 < ny) & (y1 > 0)
+
+    if numpy.any(overlapping):
+        region_hdr = out_image[:-5] + '.hdr'
+        region_tbl = out_image[:-5] + '.tbl'
+        fits_utils.write_header_file(header, region_hdr)
+        with open(region_tbl, 'w') as f:
+            table[overlapping].write(f, format='ascii.ipac')
+        return m.mAdd(region_tbl, region_hdr, out_image, img_dir=img_dir,
+                      type=combine, exact=True)
+    else:
+        data = fits_utils.create_image(out_image, header, (ny, nx))
+        data[:] = numpy.nan
+        data.flush()
+        del data
+        fits_utils.create_image(out_image[:-5] + '_area.fits', header, (ny, nx)).flush()
+
+
+def update_mosaic(output_dir, proj_dir, new_images=None, removed_images=None,
+                  combine="mean", hdu=None, work_dir=None, cleanup=True,
+                  n_workers=None, projection_cache=None):
+    """
+    Add frames to, or remove frames from, an existing mosaic
+
+    Only the region of the mosaic covered by the added or removed frames is
+    combined again with mAdd, from the frames overlapping that region, and
+    the result is written into the existing ``mosaic.fits`` and
+    ``mosaic_area.fits`` files in place. The frames are located in the mosaic
+    using the footprints in the ``images_projected.tbl`` table, which is
+    updated to reflect the new set of frames.
+
+    Parameters
+    ----------
+
+    output_dir : str
+        The output directory of a previous call to
+        :func:`~montage_wrapper.wrappers.mosaic`
+
+    proj_dir : str
+        The directory containing the projected frames of the mosaic (the
+        ``projected`` sub-directory of the work directory of
+        :func:`~montage_wrapper.wrappers.mosaic`, which should therefore be
+        called with `work_dir` set and `cleanup` set to `False`). New frames
+        are projected into this directory.
+
+    new_images : list, optional
+        The FITS files to add to the mosaic. Only the parts of these images
+        that fall inside the existing mosaic are included, i.e. the mosaic is
+        never enlarged.
+
+    removed_images : list, optional
+        The files to remove from the mosaic, identified by their file name
+        (without any directory).
+
+    combine : str, optional
+        How to combine the images - this should be one of ``'mean'``,
+        ``'median'``, or ``'count'``, and should be the same as for the
+        original mosaic.
+
+    hdu: int, optional
+        Which HDU of the new images to use
+
+    work_dir : str, optional
+        The temporary directory to use. By default, this is a temporary
+        directory in a system-defined location.
+
+    cleanup : bool, optional
+        Whether to remove the temporary directory
+
+    n_workers : int, optional
+        The number of threads to use to list and project the new frames
+
+    projection_cache : str or :class:`~montage_wrapper.cache.ProjectionCache`, optional
+        A cache of projected images (see
+        :func:`~montage_wrapper.wrappers.mosaic`)
+
+    Notes
+    -----
+    Background matching is not re-done, so new frames are combined without
+    any background correction. For background-matched mosaics, `proj_dir`
+    should be the directory containing the corrected frames.
+    """
+
+    from astropy.table import Table, vstack
 
-        # Modeling background
+    if not combine in ['mean', 'median', 'count']:
+        raise Exception("combine should be one of mean/median/count")
 
-        log.info("Modeling background")
-        m.mDiffExec(diffs_tbl, header_hdr, diffs_dir, proj_dir=projected_dir,
-                    mpi=mpi, n_proc=n_proc)
-        m.mFitExec(diffs_tbl, fits_tbl, diffs_dir, mpi=mpi, n_proc=n_proc)
-        m.mBgModel(images_projected_tbl, fits_tbl, corrections_tbl,
-                   n_iter=background_n_iter, level_only=level_only)
+    output_dir = os.path.abspath(output_dir)
+    proj_dir = os.path.abspath(proj_dir)
 
-        # Matching background
-        log.info("Matching background")
-        m.mBgExec(images_projected_tbl, corrections_tbl, corrected_dir,
-                  proj_dir=projected_dir, mpi=mpi, n_proc=n_proc)
-        sh.copy(corrections_tbl, output_dir)
+    mosaic_fits = os.path.join(output_dir, 'mosaic.fits')
+    mosaic_area_fits = os.path.join(output_dir, 'mosaic_area.fits')
+    images_projected_tbl = os.path.join(output_dir, 'images_projected.tbl')
 
-        # Mosaicking frames
-        log.info("Mosaicking frames")
+    for filename in [mosaic_fits, mosaic_area_fits, images_projected_tbl]:
+        if not os.path.exists(filename):
+            raise IOError("File not found: %s" % filename)
 
-        m.mImgtbl(corrected_dir, images_corrected_tbl)
-        m.mAdd(images_corrected_tbl, header_hdr,
-               os.path.join(output_dir, 'mosaic64.fits'),
-               img_dir=corrected_dir, type=combine, exact=exact_size)
-        sh.copy(images_projected_tbl, output_dir)
-        sh.copy(images_corrected_tbl, output_dir)
+    if projection_cache is not None and not isinstance(projection_cache, ProjectionCache):
+        projection_cache = ProjectionCache(projection_cache)
 
+    # Make work directory
+    if work_dir:
+        work_dir = os.path.abspath(work_dir)
+        if os.path.exists(work_dir):
+            raise Exception("Work directory already exists")
+        os.mkdir(work_dir)
     else:
+        work_dir = tempfile.mkdtemp(prefix="montage_update_")
+
+    try:
+
+        raw_dir = os.path.join(work_dir, 'raw')
+        new_dir = os.path.join(work_dir, 'projected')
+
+        header_hdr = os.path.join(work_dir, 'header.hdr')
+        images_raw_tbl = os.path.join(work_dir, 'images_raw.tbl')
+        images_new_tbl = os.path.join(work_dir, 'images_new.tbl')
+        stats_tbl = os.path.join(work_dir, 'stats.tbl')
+        region_fits = os.path.join(work_dir, 'region.fits')
+        region_area_fits = os.path.join(work_dir, 'region_area.fits')
+
+        os.mkdir(raw_dir)
+        os.mkdir(new_dir)
+
+        header = fits.getheader(mosaic_fits)
+        fits_utils.write_header_file(header, header_hdr)
+
+        table = Table.read(images_projected_tbl, format='ascii.ipac')
+        names = [os.path.basename(str(fname).strip()) for fname in table['fname']]
+
+        # Find frames to remove (projected frames may have a hdu prefix)
+        removed = numpy.zeros(len(table), dtype=bool)
+        for image in removed_images or []:
+            pattern = re.compile('^(hdu[0-9]+_)?' + re.escape(os.path.basename(image)) + '$')
+            matches = numpy.array([pattern.match(name) is not None for name in names],
+                                  dtype=bool)
+            if not numpy.any(matches):
+                raise MontageError("Image is not part of the mosaic: %s" % image)
+            removed |= matches
+
+        changed = [table[removed]]
+        table = table[~removed]
+
+        # Project new frames
+        if new_images:
+
+            log.info("Projecting new frames")
+
+            for image in new_images:
+                name = os.path.basename(image)
+                if os.path.lexists(os.path.join(raw_dir, name)) or name in names:
+                    raise MontageError("Image is already part of the mosaic: %s" % image)
+                os.symlink(os.path.abspath(image), os.path.join(raw_dir, name))
+
+            _image_table(raw_dir, images_raw_tbl, n_workers=n_workers, corners=True)
+
+            if hdu is not None:
+                raw_table = Table.read(images_raw_tbl, format='ascii.ipac')
+                with open(images_raw_tbl, 'w') as f:
+                    raw_table[raw_table['hdu'] == hdu].write(f, format='ascii.ipac')
+
+            _project_cached(images_raw_tbl, header_hdr, new_dir, stats_tbl,
+                            projection_cache, raw_dir=raw_dir, n_workers=n_workers)
+
+            s = _image_table(new_dir, images_new_tbl, n_workers=n_workers)
+
+            if s.count > 0:
+                new_table = Table.read(images_new_tbl, format='ascii.ipac')
+                for fname in new_table['fname']:
+                    fname = str(fname).strip()
+                    for suffix in ('', '_area'):
+                        sh.move(os.path.join(new_dir, fname[:-5] + suffix + '.fits'),
+                                os.path.join(proj_dir, fname[:-5] + suffix + '.fits'))
+                changed.append(new_table)
+                table = vstack([table, new_table])
+            else:
+                log.info("None of the new frames overlap with the mosaic")
+
+        # Find the region of the mosaic affected by the changes
+        ny, nx = header['NAXIS2'], header['NAXIS1']
+        boxes = [coadd._pixel_boxes(t, header) for t in changed if len(t) > 0]
+
+        if boxes:
+            x0 = max(min(box[0].min() for box in boxes), 0)
+            x1 = min(max(box[1].max() for box in boxes), nx)
+            y0 = max(min(box[2].min() for box in boxes), 0)
+            y1 = min(max(box[3].max() for box in boxes), ny)
+        else:
+            x0 = x1 = y0 = y1 = 0
+
+        if x1 > x0 and y1 > y0:
+
+            log.info("Mosaicking region [%i:%i, %i:%i]" % (x0 + 1, x1, y0 + 1, y1))
+
+            region_header = header.copy()
+            region_header['NAXIS1'] = int(x1 - x0)
+            region_header['NAXIS2'] = int(y1 - y0)
+            region_header['CRPIX1'] = header['CRPIX1'] - x0
+            region_header['CRPIX2'] = header['CRPIX2'] - y0
 
-        # Mosaicking frames
-        log.info("Mosaicking frames")
+            _add_region(table, region_header, region_fits, proj_dir, combine)
 
-        m.mAdd(images_projected_tbl, header_hdr,
-               os.path.join(output_dir, 'mosaic64.fits'),
-               img_dir=projected_dir, type=combine, exact=exact_size)
-        sh.copy(images_projected_tbl, output_dir)
+            fits_utils.paste_image(region_fits, mosaic_fits, x0, y0)
+            fits_utils.paste_image(region_area_fits, mosaic_area_fits, x0, y0)
 
-    m.mConvert(os.path.join(output_dir, 'mosaic64.fits'),
-               os.path.join(output_dir, 'mosaic.fits'),
-               bitpix=bitpix)
-    m.mConvert(os.path.join(output_dir, 'mosaic64_area.fits'),
-               os.path.join(output_dir, 'mosaic_area.fits'),
-               bitpix=bitpix)
+        else:
+
+            log.info("No part of the mosaic needs to be updated")
 
-    os.remove(os.path.join(output_dir, "mosaic64.fits"))
-    os.remove(os.path.join(output_dir, "mosaic64_area.fits"))
+        # Update the table of projected frames
+        table['cntr'] = numpy.arange(len(table))
+        with open(images_projected_tbl, 'w') as f:
+            table.write(f, format='ascii.ipac')
+
+    finally:
 
-    _finalize(cleanup, work_dir)
+        _finalize(cleanup, work_dir)